@@ -0,0 +1,114 @@
+# async_llm_client.py - 基于 asyncio 的大模型客户端（需要 aiohttp），供 ASGI 服务使用
+
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from agents.llm_client import LLMClient, RETRY_STATUS, StreamAssembler, parse_retry_after
+from agents.telemetry import record_llm_usage, telemetry
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 为可选依赖，仅异步模式需要
+    aiohttp = None
+
+
+def _require_aiohttp():
+    if aiohttp is None:
+        raise ImportError("异步模式需要 aiohttp：pip install aiohttp")
+
+
+# 按 (base_url, 事件循环) 共享的异步连接池；ClientSession 不能跨事件循环使用
+_sessions: Dict[Tuple[str, int], "aiohttp.ClientSession"] = {}
+
+
+def get_shared_async_session(base_url: str, pool_size: int = 100) -> "aiohttp.ClientSession":
+    """获取当前事件循环中 base_url 对应的共享 ClientSession（只在事件循环线程内调用，无需加锁）"""
+    _require_aiohttp()
+    key = (base_url, id(asyncio.get_running_loop()))
+    session = _sessions.get(key)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size))
+        _sessions[key] = session
+    return session
+
+
+async def close_async_sessions():
+    """关闭当前事件循环创建的所有连接池（ASGI lifespan 关闭时调用）"""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _sessions if k[1] == loop_id]:
+        await _sessions.pop(key).close()
+
+
+class AsyncLLMClient(LLMClient):
+    """
+    LLMClient 的异步版本：achat_completion / astream_chat_completion 不占用线程，
+    单个进程可同时挂起数百个进行中的模型请求；同步方法仍可用
+    """
+
+    def __init__(self, base_url: str, api_key: str, model_name: str,
+                 timeout: Union[float, Tuple[float, float]] = None, pool_size: int = None, **kwargs):
+        _require_aiohttp()
+        super().__init__(base_url, api_key, model_name, timeout=timeout, pool_size=pool_size, **kwargs)
+        self.async_pool_size = pool_size or 100
+        if isinstance(self.timeout, tuple):
+            connect, read = self.timeout
+            self.async_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        else:
+            self.async_timeout = aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout)
+
+    async def _apost(self, payload: Dict) -> "aiohttp.ClientResponse":
+        """发送请求，对连接错误、超时与 429/5xx 按退避策略重试；调用方负责 release 响应"""
+        session = get_shared_async_session(self.base_url, self.async_pool_size)
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+            try:
+                response = await session.post(url, headers=self.headers, json=payload, timeout=self.async_timeout)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            if response.status in RETRY_STATUS and attempt < self.max_retries:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response.release()
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+                continue
+            if response.status >= 400:
+                response.release()
+                response.raise_for_status()
+            return response
+
+    async def achat_completion(self, messages: List[Dict[str, str]], tools: Optional[List] = None) -> Dict:
+        """异步调用聊天接口，返回值与 chat_completion 一致"""
+        with telemetry.span("llm_request", model=self.model_name, stream="false"):
+            response = await self._apost(self._payload(messages, tools, False))
+            async with response:
+                body = await response.read()
+            telemetry.inc("llm_response_bytes_total", len(body), model=self.model_name)
+            data = json.loads(body)
+        record_llm_usage(data, self.model_name)
+        return data
+
+    async def astream_chat_completion(self, messages: List[Dict[str, str]],
+                                      tools: Optional[List] = None) -> AsyncIterator[Dict]:
+        """异步流式调用，产出的事件格式与 stream_chat_completion 一致"""
+        with telemetry.span("llm_request", model=self.model_name, stream="true"):
+            response = await self._apost(self._payload(messages, tools, True))
+            assembler = StreamAssembler()
+            received = 0
+            try:
+                async with response:
+                    async for line in response.content:
+                        received += len(line)
+                        for token in assembler.feed(line.rstrip(b"\r\n")):
+                            yield {"type": "token", "content": token}
+                        if assembler.done:
+                            break
+            finally:
+                telemetry.inc("llm_response_bytes_total", received, model=self.model_name)
+        result = assembler.response()
+        record_llm_usage(result, self.model_name)
+        yield {"type": "response", "response": result}
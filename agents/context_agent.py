@@ -3,22 +3,32 @@
 import json
 from typing import Dict, List, Optional
 from agents.memory_agent import MemoryAgent
+from agents.telemetry import telemetry
 
 
 class ContextAgent:
-    def __init__(self, memory_agent: MemoryAgent):
+    def __init__(self, memory_agent: MemoryAgent, mode: str = "keyword", embedder=None):
+        """
+        mode: "keyword" 使用 BM25 倒排索引；"vector" 使用嵌入向量相似度（需要 numpy）
+        """
+        if mode not in ("keyword", "vector"):
+            raise ValueError(f"未知检索模式: {mode}")
         self.memory_agent = memory_agent
+        self.mode = mode
+        if mode == "vector":
+            memory_agent.enable_vector_index(embedder)
 
     def find_relevant_memories(self, query: str, top_k: int = 3) -> Dict[str, str]:
         """
-        根据查询关键词筛选最相关的记忆条目（简化版：关键词包含匹配）
-        实际项目中可替换为向量相似度搜索
+        根据查询检索最相关的记忆条目，按得分降序返回
+        keyword 模式为 BM25 倒排索引，vector 模式为向量余弦相似度
         """
-        relevant = {}
-        query_lower = query.lower()
-        for key, value in self.memory_agent.memories.items():
-            if query_lower in key.lower() or query_lower in value.lower():
-                relevant[key] = value
-                if len(relevant) >= top_k:
-                    break
+        with telemetry.span("memory_lookup", mode=self.mode) as span, self.memory_agent.reading() as memories:
+            if self.mode == "vector":
+                hits = self.memory_agent.vector_index.search(query, top_k)
+            else:
+                hits = self.memory_agent.index.search(query, top_k)
+            span.set(hits=len(hits), memories=len(memories))
+            relevant = {key: memories[key] for key, _ in hits}
+        self.memory_agent.record_hits(list(relevant))
         return relevant
\ No newline at end of file
@@ -0,0 +1,286 @@
+# embedding.py - 记忆向量检索：可插拔嵌入器 + 内存映射的 float32 向量矩阵
+
+import json
+import math
+import os
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from agents.memory_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # 向量检索为可选功能，未安装 numpy 时仅在启用时报错
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，仅保留进程内互斥
+    fcntl = None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("向量检索需要 numpy，请先执行 pip install numpy")
+
+
+class Embedder:
+    """嵌入器接口：把一批文本转为 L2 归一化的 (n, dim) float32 矩阵"""
+
+    name = "base"
+    dim = 0
+
+    def embed(self, texts: List[str]):
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    特征哈希嵌入器：分词后用 crc32 把词项映射到固定维度，带符号以减少冲突偏差
+    不需要训练或下载模型，结果跨进程稳定，可离线使用
+    """
+
+    def __init__(self, dim: int = 512):
+        _require_numpy()
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term, tf in Counter(tokenize(text)).items():
+                h = zlib.crc32(term.encode('utf-8'))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dim] += sign * (1.0 + math.log(tf))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix
+
+
+class VectorIndex:
+    """
+    记忆向量索引：
+    - <memory_file>.vectors.f32   行主序 float32 矩阵，np.memmap 映射，按容量倍增扩展
+    - <memory_file>.vectors.keys  JSONL，首行为头信息，其后每行记录一次行分配/释放
+    每条记忆只在写入时嵌入一次，查询为一次矩阵乘 + argpartition
+    多进程共享同一组文件：行分配、矩阵扩展与分配记录的追加都在 <memory_file>.vectors.lock 的 flock 下进行，
+    加锁后先读入其他进程追加的分配记录，再从最新状态分配行
+    """
+
+    def __init__(self, memory_file: str, embedder: Embedder = None, initial_capacity: int = 1024):
+        _require_numpy()
+        self.embedder = embedder or HashingEmbedder()
+        self.dim = self.embedder.dim
+        self.matrix_file = f"{memory_file}.vectors.f32"
+        self.keys_file = f"{memory_file}.vectors.keys"
+        self.lock_file = f"{memory_file}.vectors.lock"
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._keys_offset = 0  # 已读入的分配记录字节数
+        self._keys_ino = 0
+
+        self.row_of: Dict[str, int] = {}
+        self.key_of: Dict[int, str] = {}
+        self.free_rows: List[int] = []
+        self.count = 0       # 已使用的最大行号 + 1
+        self.capacity = 0
+        self.matrix = None
+        with self._file_lock():
+            self._load()
+
+    def _header(self) -> Dict:
+        return {"dim": self.dim, "embedder": self.embedder.name}
+
+    @contextmanager
+    def _file_lock(self):
+        """进程内 RLock + 跨进程 flock；同一线程重入时不再重复 flock"""
+        with self._lock:
+            if fcntl is None or self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _load(self):
+        """读取行分配记录并映射矩阵（须持有文件锁）；嵌入器或维度变化时丢弃旧数据"""
+        self.row_of, self.key_of, self.free_rows = {}, {}, []
+        self.count = 0
+        header_ok = False
+        if os.path.exists(self.keys_file) and os.path.exists(self.matrix_file):
+            with open(self.keys_file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            try:
+                header_ok = bool(lines) and json.loads(lines[0]) == self._header()
+            except json.JSONDecodeError:
+                header_ok = False
+            if header_ok:
+                for line in lines[1:]:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 崩溃残留的半行
+                    self._assign(record["row"], record["k"])
+        if not header_ok:
+            with open(self.keys_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self._header()) + "\n")
+            if os.path.exists(self.matrix_file):
+                os.remove(self.matrix_file)
+
+        self._remap()
+        self.free_rows = [row for row in range(self.count) if row not in self.key_of]
+        if header_ok and len(lines) > 2 * len(self.row_of) + 1024:
+            # 分配记录中大多是已失效的历史，重写为当前映射
+            with open(self.keys_file, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self._header()) + "\n")
+            self._log([{"row": row, "k": key} for key, row in self.row_of.items()])
+        st = os.stat(self.keys_file)
+        self._keys_offset, self._keys_ino = st.st_size, st.st_ino
+
+    def _remap(self):
+        """按矩阵文件当前大小重新映射（其他进程可能已扩展）"""
+        size = os.path.getsize(self.matrix_file) if os.path.exists(self.matrix_file) else 0
+        capacity = size // (4 * self.dim)
+        if capacity < max(self.count, 1):
+            self._grow(max(self.initial_capacity, self.count))
+        elif capacity != self.capacity or self.matrix is None:
+            if self.matrix is not None:
+                self.matrix.flush()
+                del self.matrix
+            self.capacity = capacity
+            self.matrix = np.memmap(self.matrix_file, dtype=np.float32, mode='r+',
+                                    shape=(self.capacity, self.dim))
+
+    def _catch_up(self):
+        """读入其他进程追加的分配记录（须持有文件锁）；分配记录被重写过时整体重新加载"""
+        try:
+            st = os.stat(self.keys_file)
+        except OSError:
+            st = None
+        if st is None or st.st_ino != self._keys_ino or st.st_size < self._keys_offset:
+            self._load()
+            return
+        if st.st_size == self._keys_offset:
+            return
+        with open(self.keys_file, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        self._keys_offset += len(data)
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._assign(record["row"], record["k"])
+        self.free_rows = [row for row in range(self.count) if row not in self.key_of]
+        self._remap()
+
+    def _assign(self, row: int, key):
+        old_key = self.key_of.pop(row, None)
+        if old_key is not None and self.row_of.get(old_key) == row:
+            del self.row_of[old_key]
+        if key is not None:
+            self.row_of[key] = row
+            self.key_of[row] = key
+        self.count = max(self.count, row + 1)
+
+    def _grow(self, min_capacity: int):
+        capacity = max(self.capacity * 2, min_capacity, self.initial_capacity)
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+        with open(self.matrix_file, 'ab') as f:
+            # 其他进程可能已扩展得更大，只增不减
+            capacity = max(capacity, f.seek(0, os.SEEK_END) // (4 * self.dim))
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self.matrix = np.memmap(self.matrix_file, dtype=np.float32, mode='r+',
+                                shape=(self.capacity, self.dim))
+
+    def _log(self, records: List[Dict]):
+        with open(self.keys_file, 'ab') as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode('utf-8'))
+            self._keys_offset = f.tell()
+
+    def sync(self, memories: Dict[str, str]):
+        """与记忆字典对齐：删除已不存在的条目，只为缺失或向量损坏的条目计算嵌入"""
+        with self._file_lock():
+            self._catch_up()
+            stale = [key for key in self.row_of if key not in memories]
+            for key in stale:
+                self.remove(key)
+            live_rows = np.fromiter(self.row_of.values(), dtype=np.int64, count=len(self.row_of))
+            if len(live_rows):
+                # 进程崩溃时 memmap 可能未落盘，零向量行需要重新计算
+                zero = np.flatnonzero(~self.matrix[live_rows].any(axis=1))
+                broken = [self.key_of[int(live_rows[i])] for i in zero]
+            else:
+                broken = []
+        missing = [key for key in memories if key not in self.row_of] + broken
+        if missing:
+            self.add_many({key: memories[key] for key in missing})
+
+    def add(self, key: str, value: str):
+        self.add_many({key: value})
+
+    def add_many(self, items: Dict[str, str]):
+        """批量嵌入并写入矩阵，已存在的 key 原地覆盖；嵌入在锁外计算，行分配与记录追加在锁内"""
+        if not items:
+            return
+        keys = list(items)
+        vectors = self.embedder.embed([f"{key} {items[key]}" for key in keys])
+        with self._file_lock():
+            self._catch_up()
+            records = []
+            for key, vector in zip(keys, vectors):
+                row = self.row_of.get(key)
+                if row is None:
+                    row = self.free_rows.pop() if self.free_rows else self.count
+                    if row >= self.capacity:
+                        self._grow(row + 1)
+                    self._assign(row, key)
+                    records.append({"row": row, "k": key})
+                self.matrix[row] = vector
+            if records:
+                self._log(records)
+
+    def remove(self, key: str):
+        with self._file_lock():
+            self._catch_up()
+            row = self.row_of.get(key)
+            if row is None:
+                return
+            self.matrix[row] = 0.0
+            self._assign(row, None)
+            self.free_rows.append(row)
+            self._log([{"row": row, "k": None}])
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[str, float]]:
+        """返回按余弦相似度排序的 (key, score) 列表；先读入其他进程的写入，被复用的行按新 key 报告"""
+        if top_k <= 0:
+            return []
+        q = self.embedder.embed([query])[0]
+        with self._file_lock():
+            self._catch_up()
+            if not self.row_of:
+                return []
+            scores = self.matrix[:self.count] @ q
+            k = min(top_k, self.count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.key_of[int(row)], float(scores[row]))
+                    for row in top if int(row) in self.key_of and scores[row] > 0]
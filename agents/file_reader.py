@@ -0,0 +1,163 @@
+# file_reader.py - 基于 mmap 的窗口化文件读取与行号索引
+
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+
+# 行索引每隔 LINE_STRIDE 行记录一个检查点，内存占用约为每 64 行 8 字节
+LINE_STRIDE = 64
+_LINE_INDEX_CACHE_SIZE = 64
+
+
+@contextmanager
+def open_mmap(path: str) -> Iterator[Optional[mmap.mmap]]:
+    """只读映射文件；空文件无法映射，返回 None"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield None
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def align_utf8(buf, pos: int) -> int:
+    """把字节位置向前调整到 UTF-8 字符边界，避免截断多字节字符"""
+    pos = max(0, min(pos, len(buf)))
+    steps = 0
+    while 0 < pos < len(buf) and steps < 3 and (buf[pos] & 0xC0) == 0x80:
+        pos -= 1
+        steps += 1
+    return pos
+
+
+def decode_window(buf, start: int, end: int) -> str:
+    """解码 [start, end) 字节窗口，两端先对齐到字符边界"""
+    start = align_utf8(buf, start)
+    end = align_utf8(buf, end)
+    return buf[start:end].decode('utf-8', errors='replace')
+
+
+class LineIndex:
+    """稀疏换行索引：checkpoints[i] 为第 i * LINE_STRIDE + 1 行的起始字节偏移"""
+
+    def __init__(self, mm: Optional[mmap.mmap]):
+        self.checkpoints = array('Q', [0])
+        self.line_count = 0
+        if mm is None:
+            return
+        size = len(mm)
+        pos = 0
+        lines = 0
+        while pos < size:
+            nl = mm.find(b"\n", pos)
+            lines += 1
+            if nl == -1:
+                break
+            pos = nl + 1
+            if lines % LINE_STRIDE == 0 and pos < size:
+                self.checkpoints.append(pos)
+        self.line_count = lines
+
+    def line_start(self, mm: mmap.mmap, line: int) -> int:
+        """第 line 行（从 1 开始）的起始偏移：一次查表 + 至多 LINE_STRIDE 次 find"""
+        if line > self.line_count:
+            return len(mm)
+        block, skip = divmod(line - 1, LINE_STRIDE)
+        pos = self.checkpoints[block]
+        for _ in range(skip):
+            pos = mm.find(b"\n", pos) + 1
+        return pos
+
+    def line_of(self, mm: mmap.mmap, offset: int) -> int:
+        """字节偏移所在的行号（从 1 开始）：二分定位检查点后统计块内换行数"""
+        block = bisect_right(self.checkpoints, offset) - 1
+        base = self.checkpoints[block]
+        return block * LINE_STRIDE + 1 + mm[base:offset].count(b"\n")
+
+
+_line_indexes: "OrderedDict[str, Tuple[tuple, LineIndex]]" = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+
+def file_signature(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def get_line_index(path: str, mm: Optional[mmap.mmap]) -> LineIndex:
+    """按 (inode, mtime, size) 缓存行索引，文件变化后首次访问时重建"""
+    signature = file_signature(path)
+    with _line_indexes_lock:
+        cached = _line_indexes.get(path)
+        if cached is not None and cached[0] == signature:
+            _line_indexes.move_to_end(path)
+            return cached[1]
+    index = LineIndex(mm)
+    with _line_indexes_lock:
+        _line_indexes[path] = (signature, index)
+        _line_indexes.move_to_end(path)
+        while len(_line_indexes) > _LINE_INDEX_CACHE_SIZE:
+            _line_indexes.popitem(last=False)
+    return index
+
+
+def resolve_window(size: int, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+    """与切片相同的偏移语义：None 表示文件开头/结尾，负数从文件末尾倒数，超出范围截到 [0, size]"""
+    start = 0 if start is None else (size + start if start < 0 else start)
+    end = size if end is None else (size + end if end < 0 else end)
+    return max(0, min(start, size)), max(0, min(end, size))
+
+
+def read_window(path: str, start: Optional[int] = None, end: Optional[int] = None) -> str:
+    """按字节偏移读取 [start, end)，只解码所需窗口；负偏移从文件末尾倒数（如 start=-4096 读取最后 4KB）"""
+    with open_mmap(path) as mm:
+        if mm is None:
+            return ""
+        start, end = resolve_window(len(mm), start, end)
+        return decode_window(mm, start, end)
+
+
+def read_window_bounded(path: str, start: Optional[int] = None, end: Optional[int] = None,
+                        max_bytes: Optional[int] = None) -> Tuple[str, Optional[int], int]:
+    """
+    与 read_window 相同，但最多解码 max_bytes 字节（止点对齐到字符边界）
+    返回 (文本, 下一段的起始偏移（已读完为 None）, 请求窗口的结束偏移)
+    """
+    with open_mmap(path) as mm:
+        if mm is None:
+            return "", None, 0
+        start, end = resolve_window(len(mm), start, end)
+        stop = end
+        if max_bytes is not None and end - start > max_bytes:
+            stop = align_utf8(mm, start + max_bytes)
+        return decode_window(mm, start, stop), (stop if stop < end else None), end
+
+
+def line_range(path: str, start_line: Optional[int] = None, end_line: Optional[int] = None) -> Tuple[int, int]:
+    """第 start_line 到 end_line 行（从 1 开始，包含 end_line）对应的字节范围 [start, end)"""
+    with open_mmap(path) as mm:
+        if mm is None:
+            return 0, 0
+        index = get_line_index(path, mm)
+        start_line = max(1, start_line or 1)
+        end_line = index.line_count if end_line is None else min(end_line, index.line_count)
+        if end_line < start_line:
+            return 0, 0
+        return index.line_start(mm, start_line), index.line_start(mm, end_line + 1)
+
+
+def read_lines(path: str, start_line: Optional[int] = None, end_line: Optional[int] = None) -> str:
+    """读取第 start_line 到 end_line 行（从 1 开始，包含 end_line）"""
+    start, end = line_range(path, start_line, end_line)
+    if start >= end:
+        return ""
+    with open_mmap(path) as mm:
+        return mm[start:end].decode('utf-8', errors='replace')
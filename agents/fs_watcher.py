@@ -0,0 +1,494 @@
+# fs_watcher.py - 工作目录文件变更监听：Linux 上经 ctypes 使用 inotify，不可用时轮询比对 os.scandir 快照；
+# 变更按时间窗口合并成批次后发布给订阅者（三元组索引、目录快照缓存、工具结果缓存、响应缓存），由它们在后台增量更新
+#
+# 环境变量：MEMAGENT_FS_WATCH=1 启用；MEMAGENT_FS_WATCH_BACKEND=auto|inotify|poll；
+#          MEMAGENT_FS_POLL_INTERVAL 轮询间隔（秒，默认 1）；MEMAGENT_FS_WATCH_DEBOUNCE 静默多久后发布（秒，默认 0.05）；
+#          MEMAGENT_FS_WATCH_MAX_DELAY 持续写入时一个批次最多攒多久（秒，默认 0.25）
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Pattern, Set, Tuple
+
+from agents.gitignore import ALWAYS_IGNORED, IgnoreRules
+from agents.telemetry import telemetry
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT = struct.Struct("iIII")
+
+
+class FileChanges:
+    """
+    一个合并后的变更批次，路径均相对监听根目录（'/' 分隔，根目录为空串）：
+    - files:        内容、元数据发生变化或被创建/删除的文件
+    - dirs:         条目列表或条目大小发生变化的目录
+    - removed_dirs: 被删除或移出的目录，其下所有内容都已不存在（同一批次中可能又以新内容出现在 files 中，
+                    订阅者应先处理 removed_dirs 再处理 files）
+    - overflow:     事件丢失（inotify 队列溢出、.gitignore 变化、切换后端等），订阅者应整体重建
+    """
+    __slots__ = ("root", "files", "dirs", "removed_dirs", "overflow", "first_event")
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files: Set[str] = set()
+        self.dirs: Set[str] = set()
+        self.removed_dirs: Set[str] = set()
+        self.overflow = False
+        self.first_event = time.monotonic()
+
+    def __bool__(self) -> bool:
+        return bool(self.files or self.dirs or self.removed_dirs or self.overflow)
+
+    def abs_path(self, rel_path: str) -> str:
+        return os.path.join(self.root, rel_path) if rel_path else self.root
+
+
+def _join(rel_dir: str, name: str) -> str:
+    return f"{rel_dir}/{name}" if rel_dir else name
+
+
+def _walk(root: str, rel: str, rules: IgnoreRules, use_gitignore: bool,
+          before_scan: Optional[Callable[[str, IgnoreRules], None]] = None,
+          skip_file: Optional[Callable[[str], bool]] = None
+          ) -> Iterator[Tuple[str, List[Tuple[str, bool, os.DirEntry]]]]:
+    """
+    从 rel 开始遍历未被忽略的目录，产出 (目录相对路径, [(名称, 是否目录, DirEntry)])，条目已过滤忽略规则
+    before_scan 在读取每个目录之前调用（inotify 先加 watch 再扫描，扫描期间新建的文件不会漏掉）
+    skip_file 按文件相对路径判断是否跳过（FileWatcher.ignored_file）
+    """
+    stack = [(rel, rules)]
+    while stack:
+        rel_dir, dir_rules = stack.pop()
+        if before_scan is not None:
+            before_scan(rel_dir, dir_rules)
+        try:
+            with os.scandir(os.path.join(root, rel_dir) if rel_dir else root) as it:
+                raw = list(it)
+        except OSError:
+            continue
+        entries = []
+        for entry in raw:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir and entry.name in ALWAYS_IGNORED:
+                continue
+            if not is_dir and skip_file is not None and skip_file(_join(rel_dir, entry.name)):
+                continue
+            if use_gitignore and dir_rules.ignored(_join(rel_dir, entry.name), is_dir):
+                continue
+            entries.append((entry.name, is_dir, entry))
+        yield rel_dir, entries
+        for name, is_dir, entry in entries:
+            if is_dir:
+                child = _join(rel_dir, name)
+                stack.append((child, dir_rules.child(entry.path, child) if use_gitignore else dir_rules))
+
+
+def _root_rules(root: str, use_gitignore: bool) -> IgnoreRules:
+    return IgnoreRules().child(root, '') if use_gitignore else IgnoreRules()
+
+
+class _PollingSource:
+    """每隔 interval 秒重新遍历一次，与上一次的快照 {目录: {名称: (是否目录, inode, mtime_ns, size)}} 比对"""
+    name = "poll"
+
+    def __init__(self, watcher: "FileWatcher"):
+        self.watcher = watcher
+        self.snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Dict[str, Tuple[bool, int, int, int]]]:
+        watcher = self.watcher
+        snapshot = {}
+        for rel_dir, entries in _walk(watcher.root, '', _root_rules(watcher.root, watcher.use_gitignore),
+                                      watcher.use_gitignore, skip_file=watcher.ignored_file):
+            infos = {}
+            for name, is_dir, entry in entries:
+                if is_dir:
+                    infos[name] = (True, 0, 0, 0)
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue  # 扫描期间被删除，或指向不存在目标的符号链接
+                infos[name] = (False, st.st_ino, st.st_mtime_ns, st.st_size)
+            snapshot[rel_dir] = infos
+        return snapshot
+
+    @staticmethod
+    def diff(old: Dict, new: Dict, changes: FileChanges):
+        for rel_dir, infos in new.items():
+            before = old.get(rel_dir)
+            if before == infos:
+                continue
+            before = before or {}
+            changes.dirs.add(rel_dir)
+            for name, info in infos.items():
+                if not info[0] and before.get(name) != info:
+                    changes.files.add(_join(rel_dir, name))
+            for name, info in before.items():
+                if not info[0] and (name not in infos or infos[name][0]):
+                    changes.files.add(_join(rel_dir, name))
+        for rel_dir in old:
+            if rel_dir not in new:
+                if not rel_dir:
+                    changes.overflow = True  # 根目录本身不见了
+                elif rel_dir.rpartition('/')[0] in new:
+                    changes.removed_dirs.add(rel_dir)  # 只记录最上层，子目录由前缀覆盖
+
+    @property
+    def watches(self) -> int:
+        return len(self.snapshot)
+
+    def run(self, stop: threading.Event):
+        while not stop.wait(self.watcher.poll_interval):
+            changes = FileChanges(self.watcher.root)
+            snapshot = self._scan()
+            self.diff(self.snapshot, snapshot, changes)
+            self.snapshot = snapshot
+            if changes:
+                self.watcher.publish(changes)
+
+    def close(self):
+        pass
+
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        for name in ("inotify_init1", "inotify_add_watch", "inotify_rm_watch"):
+            if not hasattr(libc, name):
+                raise OSError(errno.ENOSYS, f"libc 中没有 {name}")
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+class _InotifySource:
+    """
+    每个未被忽略的目录一个 watch：新建或移入的目录立即加 watch 并补报其中已有的文件，删除或移出的目录撤掉整棵子树的 watch
+    事件在 debounce 秒内无新事件、或最早的事件已等待 max_delay 秒时作为一个批次发布
+    watch 数量达到 fs.inotify.max_user_watches 时抛出 ENOSPC，由 FileWatcher 切换为轮询
+    """
+    name = "inotify"
+
+    def __init__(self, watcher: "FileWatcher"):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify 仅在 Linux 上可用")
+        self.watcher = watcher
+        self.libc = _load_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 失败: {os.strerror(err)}")
+        self._wds: Dict[int, str] = {}
+        self._dirs: Dict[str, Tuple[int, IgnoreRules]] = {}
+        self._rescan = False
+        try:
+            self._add_tree('', _root_rules(watcher.root, watcher.use_gitignore), None)
+        except OSError:
+            self.close()
+            raise
+
+    @property
+    def watches(self) -> int:
+        return len(self._dirs)
+
+    def _add_watch(self, rel_dir: str, rules: IgnoreRules):
+        path = os.path.join(self.watcher.root, rel_dir) if rel_dir else self.watcher.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch 数量达到上限（fs.inotify.max_user_watches）")
+            return  # 目录刚被删除或不是目录，父目录的事件会反映这一点
+        self._wds[wd] = rel_dir
+        self._dirs[rel_dir] = (wd, rules)
+
+    def _add_tree(self, rel: str, rules: IgnoreRules, changes: Optional[FileChanges]):
+        for rel_dir, entries in _walk(self.watcher.root, rel, rules, self.watcher.use_gitignore, self._add_watch,
+                                      self.watcher.ignored_file):
+            if changes is not None:
+                changes.dirs.add(rel_dir)
+                changes.files.update(_join(rel_dir, name) for name, is_dir, _ in entries if not is_dir)
+
+    def _drop_tree(self, rel: str):
+        prefix = rel + '/'
+        for rel_dir in [d for d in self._dirs if d == rel or d.startswith(prefix)]:
+            wd, _ = self._dirs.pop(rel_dir)
+            self._wds.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _rebuild(self):
+        """重新遍历并按当前的 .gitignore 建立 watch，撤掉不再需要的"""
+        old = set(self._wds)
+        self._wds.clear()
+        self._dirs.clear()
+        self._add_tree('', _root_rules(self.watcher.root, self.watcher.use_gitignore), None)
+        for wd in old - set(self._wds):
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _handle(self, wd: int, mask: int, name: str, changes: FileChanges):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan = True
+            return
+        rel_dir = self._wds.get(wd)
+        if rel_dir is None:
+            return
+        if mask & IN_IGNORED:
+            del self._wds[wd]
+            if self._dirs.get(rel_dir, (None,))[0] == wd:
+                del self._dirs[rel_dir]
+            return
+        if not name:
+            # 目录自身被删除/移动由父目录的事件处理；根目录没有父目录
+            if not rel_dir and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changes.overflow = True
+            return
+        rel = _join(rel_dir, name)
+        is_dir = bool(mask & IN_ISDIR)
+        rules = self._dirs[rel_dir][1]
+        if is_dir and name in ALWAYS_IGNORED:
+            return
+        if not is_dir and self.watcher.ignored_file(rel):
+            return
+        if self.watcher.use_gitignore and rules.ignored(rel, is_dir):
+            return
+        changes.dirs.add(rel_dir)
+        if not is_dir:
+            changes.files.add(rel)
+            if name == ".gitignore":
+                self._rescan = True
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            path = os.path.join(self.watcher.root, rel)
+            self._add_tree(rel, rules.child(path, rel) if self.watcher.use_gitignore else rules, changes)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._drop_tree(rel)
+            changes.removed_dirs.add(rel)
+
+    def _read(self, changes: FileChanges) -> bool:
+        """读取并处理当前可读的全部事件，返回是否读到了事件"""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            start = offset + _EVENT.size
+            name = os.fsdecode(data[start:start + length].split(b"\0", 1)[0])
+            offset = start + length
+            self._handle(wd, mask, name, changes)
+        return True
+
+    def run(self, stop: threading.Event):
+        watcher = self.watcher
+        changes: Optional[FileChanges] = None
+        last_event = 0.0
+        while not stop.is_set():
+            timeout = 0.5
+            if changes is not None:
+                now = time.monotonic()
+                deadline = min(last_event + watcher.debounce, changes.first_event + watcher.max_delay)
+                if now >= deadline:
+                    if self._rescan:
+                        self._rescan = False
+                        self._rebuild()
+                        changes.overflow = True
+                    watcher.publish(changes)
+                    changes = None
+                    continue
+                timeout = min(timeout, deadline - now)
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                continue
+            batch = changes if changes is not None else FileChanges(watcher.root)
+            if self._read(batch) and (batch or self._rescan):
+                changes = batch
+                last_event = time.monotonic()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileWatcher:
+    """
+    监听 root 下未被 .gitignore 忽略的文件，在后台线程中把变更合并为 FileChanges 批次，按订阅顺序同步调用订阅者
+    订阅者抛出的异常只计数，不影响其他订阅者，但该订阅者已丢失这批变更，下一批次改为 overflow 交给它整体重建；
+    同一个回调重复订阅只保留一份（多个会话共享同一组缓存）
+    backend: auto（优先 inotify，不可用时轮询）| inotify | poll
+    """
+
+    def __init__(self, root: str, backend: str = "auto", debounce: float = 0.05, max_delay: float = 0.25,
+                 poll_interval: float = 1.0, use_gitignore: bool = True):
+        if backend not in ("auto", "inotify", "poll"):
+            raise ValueError(f"未知的监听后端: {backend}")
+        self.root = os.path.abspath(root)
+        self.backend = backend
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_gitignore = use_gitignore
+        self.batches = 0
+        self.files_published = 0
+        self.overflows = 0
+        self.fallbacks = 0
+        self.subscriber_errors = 0
+        self.last_latency_ms = 0.0
+        self._subscribers: List[Callable[[FileChanges], None]] = []
+        self._stale: Set[Callable[[FileChanges], None]] = set()
+        self._real_root = os.path.realpath(self.root)
+        self._ignored: List[Pattern] = []
+        self._source = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def backend_name(self) -> Optional[str]:
+        return self._source.name if self._source is not None else None
+
+    def subscribe(self, callback: Callable[[FileChanges], None]):
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[FileChanges], None]):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+            self._stale.discard(callback)
+
+    def ignore_files(self, pattern: Pattern):
+        """
+        不发布真实绝对路径与 pattern 完全匹配的文件，用于排除记忆库自身的存储文件（memory_store.store_files_pattern），
+        它们每次问答都会写入，与工作目录内容无关；应在启动前后尽早调用，之前的快照中已有的此类文件会再发布一次
+        """
+        with self._lock:
+            if pattern not in self._ignored:
+                self._ignored.append(pattern)
+
+    def ignored_file(self, rel_path: str) -> bool:
+        if not self._ignored:
+            return False
+        path = os.path.join(self._real_root, rel_path)
+        return any(pattern.fullmatch(path) for pattern in self._ignored)
+
+    def start(self) -> "FileWatcher":
+        """建立初始 watch 或快照后返回；此后发生的变更都会被发布"""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            if self.backend != "poll":
+                try:
+                    self._source = _InotifySource(self)
+                except OSError:
+                    if self.backend == "inotify":
+                        raise
+            if self._source is None:
+                self._source = _PollingSource(self)
+            self._thread = threading.Thread(target=self._run, name="fs-watch", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._source.run(self._stop)
+            except OSError:
+                # inotify watch 用尽等运行期错误：改为轮询，并通知订阅者整体重建
+                self._source.close()
+                self._source = _PollingSource(self)
+                self.fallbacks += 1
+                changes = FileChanges(self.root)
+                changes.overflow = True
+                self.publish(changes)
+        self._source.close()
+
+    def publish(self, changes: FileChanges):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            batch = changes
+            if callback in self._stale and not changes.overflow:
+                batch = FileChanges(self.root)
+                batch.overflow = True
+            try:
+                callback(batch)
+                self._stale.discard(callback)
+            except Exception:
+                self._stale.add(callback)
+                self.subscriber_errors += 1
+                telemetry.inc("fs_watch_subscriber_errors_total")
+        latency = time.monotonic() - changes.first_event
+        self.batches += 1
+        self.files_published += len(changes.files)
+        self.overflows += 1 if changes.overflow else 0
+        self.last_latency_ms = round(latency * 1000, 3)
+        telemetry.inc("fs_watch_batches_total", backend=self.backend_name)
+        telemetry.observe("fs_watch_consistency_seconds", latency, backend=self.backend_name)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> Dict:
+        return {"root": self.root, "backend": self.backend_name, "watches": self._source.watches if self._source else 0,
+                "subscribers": len(self._subscribers), "batches": self.batches, "files": self.files_published,
+                "overflows": self.overflows, "fallbacks": self.fallbacks, "subscriber_errors": self.subscriber_errors,
+                "last_latency_ms": self.last_latency_ms}
+
+
+_shared_watchers: Dict[str, FileWatcher] = {}
+_shared_watchers_lock = threading.Lock()
+
+
+def get_shared_watcher(root: str) -> FileWatcher:
+    """同一工作目录在进程内只监听一次，已启动；参数取自 MEMAGENT_FS_* 环境变量"""
+    root = os.path.abspath(root)
+    with _shared_watchers_lock:
+        watcher = _shared_watchers.get(root)
+        if watcher is None:
+            watcher = _shared_watchers[root] = FileWatcher(
+                root,
+                backend=os.environ.get("MEMAGENT_FS_WATCH_BACKEND", "auto"),
+                debounce=float(os.environ.get("MEMAGENT_FS_WATCH_DEBOUNCE", 0.05)),
+                max_delay=float(os.environ.get("MEMAGENT_FS_WATCH_MAX_DELAY", 0.25)),
+                poll_interval=float(os.environ.get("MEMAGENT_FS_POLL_INTERVAL", 1.0))
+            ).start()
+        return watcher
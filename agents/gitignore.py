@@ -0,0 +1,146 @@
+# gitignore.py - .gitignore 规则解析与遵循忽略规则的目录遍历
+
+import os
+import re
+from typing import Iterator, List, Optional, Tuple
+
+# 无论 .gitignore 如何配置都跳过的目录
+ALWAYS_IGNORED = {".git", ".hg", ".svn"}
+
+
+def _translate(pattern: str) -> str:
+    """把 gitignore 通配符翻译为正则表达式片段"""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i + 3] == '**/':
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern[i:i + 2] == '**':
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class IgnoreRule:
+    def __init__(self, base: str, pattern: str):
+        """base 为 .gitignore 所在目录（相对根目录，根目录为空串）"""
+        self.base = base
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # 含中间斜杠的模式相对 .gitignore 所在目录锚定，否则匹配任意层级
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        self.regex = re.compile(f'^{prefix}{_translate(pattern)}$')
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not rel_path.startswith(self.base + '/'):
+                return False
+            rel_path = rel_path[len(self.base) + 1:]
+        return self.regex.match(rel_path) is not None
+
+
+class IgnoreRules:
+    """从根目录到当前目录累积的忽略规则，后出现的规则优先"""
+
+    def __init__(self, rules: Optional[List[IgnoreRule]] = None):
+        self.rules = rules or []
+
+    @staticmethod
+    def parse(base: str, text: str) -> List[IgnoreRule]:
+        rules = []
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            rules.append(IgnoreRule(base, line))
+        return rules
+
+    def child(self, dir_path: str, rel_dir: str) -> "IgnoreRules":
+        """进入子目录：若其中有 .gitignore 则追加其规则"""
+        try:
+            with open(os.path.join(dir_path, '.gitignore'), 'r', encoding='utf-8', errors='replace') as f:
+                extra = self.parse(rel_dir, f.read())
+        except OSError:
+            return self
+        return IgnoreRules(self.rules + extra) if extra else self
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        result = False
+        for rule in self.rules:
+            if rule.matches(rel_path, is_dir):
+                result = not rule.negate
+        return result
+
+
+def load_rules(root: str, sub_path: str = "") -> Tuple[IgnoreRules, str]:
+    """加载从 root 到 sub_path 路径上所有 .gitignore 的规则，返回 (规则, 规范化的相对路径)"""
+    rel = os.path.normpath(sub_path).replace(os.sep, '/').strip('/')
+    rel = '' if rel == '.' else rel
+    rules = IgnoreRules().child(root, '')
+    current = ''
+    for part in [p for p in rel.split('/') if p]:
+        current = f"{current}/{part}" if current else part
+        rules = rules.child(os.path.join(root, current), current)
+    return rules, rel
+
+
+def walk_files(root: str, sub_path: str = "", use_gitignore: bool = True) -> Iterator[Tuple[str, os.DirEntry]]:
+    """
+    深度优先遍历 root/sub_path 下的文件，产出 (相对 root 的路径, DirEntry)
+    被忽略的目录整体剪枝，不会进入；不跟随符号链接目录
+    """
+    rules, rel = load_rules(root, sub_path) if use_gitignore else (IgnoreRules(), sub_path.strip('/'))
+    stack = [(os.path.join(root, rel) if rel else root, rel, rules)]
+    while stack:
+        dir_path, rel_dir, rules = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if entry.name in ALWAYS_IGNORED or (use_gitignore and rules.ignored(rel_path, True)):
+                    continue
+                subdirs.append((entry.path, rel_path))
+            elif entry.is_file() and not (use_gitignore and rules.ignored(rel_path, False)):
+                yield rel_path, entry
+        for path, rel_path in reversed(subdirs):
+            stack.append((path, rel_path, rules.child(path, rel_path) if use_gitignore else rules))
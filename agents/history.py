@@ -0,0 +1,142 @@
+# history.py - 对话历史压缩：按 token 预算截断旧工具结果、丢弃最早的轮次
+
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+
+# tokenizer(text) -> token 数；可替换为 tiktoken 等精确实现
+Tokenizer = Callable[[str], int]
+
+
+def approx_token_count(text: str) -> int:
+    """
+    快速近似：ASCII 约 4 字符 1 个 token，非 ASCII（以 3 字节的中日韩字符为主）约 1 字符 1 个 token
+    只用 len 与 encode 两次 C 层调用，不逐字符遍历
+    """
+    if not text:
+        return 0
+    chars = len(text)
+    non_ascii = (len(text.encode('utf-8')) - chars) // 2
+    return (chars - non_ascii) // 4 + non_ascii + 1
+
+
+def elide(text: str, limit: int) -> str:
+    """保留头部 2/3 与尾部 1/3，中间替换为省略说明"""
+    if len(text) <= limit:
+        return text
+    head = limit * 2 // 3
+    tail = limit - head
+    return f"{text[:head]}\n…[已省略 {len(text) - limit} 个字符]…\n{text[len(text) - tail:]}"
+
+
+class HistoryManager:
+    """
+    在发送给大模型前压缩消息历史，使其不超过 max_tokens（不修改传入的原始历史）：
+    1. 最近 keep_recent 条之前的工具结果截断到 tool_result_chars 个字符
+    2. 仍超预算时按轮次丢弃最早的非 system 消息（带 tool_calls 的 assistant 与其工具结果一起丢弃）
+    3. 仍超预算时再截断最近的工具结果
+    system 消息（记忆上下文）与最后一条 user 消息始终保留在原位置
+    """
+
+    def __init__(self, max_tokens: int = 16000, tokenizer: Optional[Tokenizer] = None, keep_recent: int = 6,
+                 tool_result_chars: int = 2000, message_overhead: int = 4):
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer or approx_token_count
+        self.keep_recent = keep_recent
+        self.tool_result_chars = tool_result_chars
+        self.message_overhead = message_overhead
+
+    def count_message(self, message: Dict) -> int:
+        tokens = self.message_overhead + self.tokenizer(message.get("content") or "")
+        for call in message.get("tool_calls") or []:
+            function = call.get("function", {})
+            tokens += self.message_overhead + self.tokenizer(function.get("name") or "")
+            tokens += self.tokenizer(function.get("arguments") or "")
+        return tokens
+
+    def count(self, messages: List[Dict]) -> int:
+        return sum(self.count_message(m) for m in messages)
+
+    def _recent_start(self, messages: List[Dict]) -> int:
+        """最近窗口的起点：不从工具结果中间开始"""
+        start = max(0, len(messages) - self.keep_recent)
+        while start > 0 and messages[start]["role"] == "tool":
+            start -= 1
+        return start
+
+    @staticmethod
+    def _pinned(messages: List[Dict]) -> set:
+        """始终保留的位置：system 消息与最后一条 user 消息"""
+        pinned = {i for i, m in enumerate(messages) if m["role"] == "system"}
+        last_user = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]["role"] == "user"), None)
+        if last_user is not None:
+            pinned.add(last_user)
+        return pinned
+
+    def _truncate_tools(self, messages: List[Dict], counts: List[int], lo: int, hi: int) -> int:
+        truncated = 0
+        for i in range(lo, hi):
+            m = messages[i]
+            if m["role"] == "tool" and len(m.get("content") or "") > self.tool_result_chars:
+                messages[i] = dict(m, content=elide(m["content"], self.tool_result_chars))
+                counts[i] = self.count_message(messages[i])
+                truncated += 1
+        return truncated
+
+    def compact(self, messages: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """返回 (压缩后的消息列表, 统计)；未超预算时原样返回"""
+        counts = [self.count_message(m) for m in messages]
+        tokens_before = sum(counts)
+        stats = {"tokens_before": tokens_before, "tokens_after": tokens_before, "tokens_saved": 0,
+                 "bytes_saved": 0, "truncated": 0, "dropped": 0}
+        if tokens_before <= self.max_tokens:
+            return messages, stats
+
+        messages = list(messages)
+        recent = self._recent_start(messages)
+        stats["truncated"] += self._truncate_tools(messages, counts, 0, recent)
+
+        # 以轮次为单位丢弃：assistant(tool_calls) 及紧随其后的 tool 消息构成一组
+        pinned = self._pinned(messages)
+        keep = [True] * len(messages)
+        total = sum(counts)
+        i = 0
+        while total > self.max_tokens and i < recent:
+            if i in pinned:
+                i += 1
+                continue
+            j = i + 1
+            while j < recent and messages[j]["role"] == "tool":
+                j += 1
+            for k in range(i, j):
+                keep[k] = False
+                total -= counts[k]
+                stats["dropped"] += 1
+            i = j
+        if stats["dropped"]:
+            notice = {"role": "system", "content": f"（为控制上下文长度，已省略较早的 {stats['dropped']} 条消息）"}
+            first_dropped = keep.index(False)
+            kept = [k for k in range(len(messages)) if keep[k]]
+            at = sum(1 for k in kept if k < first_dropped)
+            recent -= stats["dropped"] - 1
+            messages = [messages[k] for k in kept]
+            counts = [counts[k] for k in kept]
+            messages.insert(at, notice)
+            counts.insert(at, self.count_message(notice))
+            total = sum(counts)
+
+        if total > self.max_tokens:
+            stats["truncated"] += self._truncate_tools(messages, counts, recent, len(messages))
+            total = sum(counts)
+
+        stats["tokens_after"] = total
+        stats["tokens_saved"] = tokens_before - total
+        return messages, stats
+
+    def prepare(self, messages: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """compact 并补充字节统计（序列化后的请求体大小）"""
+        compacted, stats = self.compact(messages)
+        if compacted is not messages:
+            bytes_before = len(json.dumps(messages, ensure_ascii=False).encode('utf-8'))
+            bytes_after = len(json.dumps(compacted, ensure_ascii=False).encode('utf-8'))
+            stats["bytes_saved"] = bytes_before - bytes_after
+        return compacted, stats
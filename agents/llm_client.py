@@ -1,12 +1,113 @@
 # llm_client.py - 大模型客户端，支持 OpenAI 兼容 API
 
+import json
 import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterator, List, Dict, Optional, Tuple, Union
+
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+
+from agents.rate_limit import RateLimiter, get_endpoint_limiter
+from agents.telemetry import record_llm_usage, telemetry
+
+# 可重试的 HTTP 状态码：限流与服务端临时错误
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 按 base_url 共享的连接池：指向同一端点的所有会话复用 keep-alive 连接
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_shared_session(base_url: str, pool_size: int = 10) -> requests.Session:
+    """
+    获取 base_url 对应的共享 requests.Session
+    连接池大小由首次创建时的 pool_size 决定
+    """
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            # 重试由 LLMClient 自行处理（需要识别 Retry-After），适配器层不重试
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[base_url] = session
+        return session
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class StreamAssembler:
+    """把流式 SSE 的 data 行重组为完整响应；工具调用参数按 index 拼接分片"""
+
+    def __init__(self):
+        self.content_parts: List[str] = []
+        self.tool_calls: Dict[int, Dict] = {}
+        self.finish_reason = None
+        self.usage: Optional[Dict] = None
+        self.done = False
+
+    def feed(self, line: bytes) -> List[str]:
+        """处理一行 SSE，返回其中的文本增量；遇到 [DONE] 后 done 为 True"""
+        if not line or not line.startswith(b"data:"):
+            return []  # 空行分隔事件，":" 开头为注释/心跳
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            self.done = True
+            return []
+        tokens = []
+        chunk = json.loads(data)
+        # 请求带 stream_options.include_usage 时，usage 出现在最后一个分片中
+        self.usage = chunk.get("usage") or self.usage
+        for choice in chunk.get("choices", []):
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                self.content_parts.append(delta["content"])
+                tokens.append(delta["content"])
+            for fragment in delta.get("tool_calls") or []:
+                call = self.tool_calls.setdefault(fragment.get("index", len(self.tool_calls)), {
+                    "id": "", "type": "function", "function": {"name": "", "arguments": ""}
+                })
+                if fragment.get("id"):
+                    call["id"] = fragment["id"]
+                function = fragment.get("function") or {}
+                call["function"]["name"] += function.get("name") or ""
+                call["function"]["arguments"] += function.get("arguments") or ""
+            self.finish_reason = choice.get("finish_reason") or self.finish_reason
+        return tokens
+
+    def response(self) -> Dict:
+        """与非流式接口格式一致的完整响应"""
+        message = {"role": "assistant", "content": "".join(self.content_parts)}
+        if self.tool_calls:
+            message["tool_calls"] = [self.tool_calls[i] for i in sorted(self.tool_calls)]
+        response = {"choices": [{"index": 0, "message": message, "finish_reason": self.finish_reason}]}
+        if self.usage:
+            response["usage"] = self.usage
+        return response
 
 
 class LLMClient:
-    def __init__(self, base_url: str, api_key: str, model_name: str):
+    def __init__(self, base_url: str, api_key: str, model_name: str,
+                 timeout: Union[float, Tuple[float, float]] = None, pool_size: int = None,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 rate_limiter: Optional[RateLimiter] = None):
         self.base_url = base_url.rstrip('/')
         self.api_key = api_key
         self.model_name = model_name
@@ -14,11 +115,45 @@ class LLMClient:
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        # 超时可为单个秒数或 (连接超时, 读取超时)
+        self.timeout = timeout if timeout is not None else float(os.environ.get("MEMAGENT_LLM_TIMEOUT", 30))
+        pool_size = pool_size or int(os.environ.get("MEMAGENT_LLM_POOL_SIZE", 10))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = get_shared_session(self.base_url, pool_size)
+        # 端点限流（含重试请求）；默认使用按端点共享的令牌桶，未配置时为 None
+        self.rate_limiter = rate_limiter or get_endpoint_limiter(self.base_url)
 
-    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List] = None) -> Dict:
-        """
-        调用大模型聊天接口，支持工具调用
-        """
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """带全抖动的指数退避；服务端给出 Retry-After 时以其为准"""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _post(self, payload: Dict, **kwargs) -> requests.Response:
+        """发送请求，对连接错误、超时与 429/5xx 按退避策略重试"""
+        url = f"{self.base_url}/chat/completions"
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.post(url, headers=self.headers, json=payload,
+                                             timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(self._backoff(attempt, retry_after))
+                continue
+            response.raise_for_status()
+            return response
+
+    def _payload(self, messages: List[Dict[str, str]], tools: Optional[List], stream: bool) -> Dict:
         payload = {
             "model": self.model_name,
             "messages": messages
@@ -26,15 +161,55 @@ class LLMClient:
         if tools:
             payload["tools"] = tools
             payload["tool_choice"] = "auto"
+        if stream:
+            payload["stream"] = True
+        return payload
 
-        response = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=self.headers,
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
+    def chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List] = None,
+                        stream: bool = False, on_token: Optional[Callable[[str], None]] = None) -> Dict:
+        """
+        调用大模型聊天接口，支持工具调用
+        stream=True 时以 SSE 流式接收，每个文本增量回调 on_token，返回值与非流式格式一致
+        """
+        if not stream:
+            with telemetry.span("llm_request", model=self.model_name, stream="false"):
+                response = self._post(self._payload(messages, tools, False))
+                telemetry.inc("llm_response_bytes_total", len(response.content), model=self.model_name)
+                data = response.json()
+            record_llm_usage(data, self.model_name)
+            return data
+        response = None
+        for event in self.stream_chat_completion(messages, tools):
+            if event["type"] == "token":
+                if on_token is not None:
+                    on_token(event["content"])
+            else:
+                response = event["response"]
+        return response
+
+    def stream_chat_completion(self, messages: List[Dict[str, str]], tools: Optional[List] = None) -> Iterator[Dict]:
+        """
+        流式调用：逐个产出 {"type": "token", "content": 增量文本}，
+        结束时产出 {"type": "response", "response": 重组后的完整响应}
+        工具调用参数按 index 拼接分片
+        """
+        with telemetry.span("llm_request", model=self.model_name, stream="true"):
+            response = self._post(self._payload(messages, tools, True), stream=True)
+            assembler = StreamAssembler()
+            received = 0
+            try:
+                for line in response.iter_lines(decode_unicode=False):
+                    received += len(line)
+                    for token in assembler.feed(line):
+                        yield {"type": "token", "content": token}
+                    if assembler.done:
+                        break
+            finally:
+                response.close()
+                telemetry.inc("llm_response_bytes_total", received, model=self.model_name)
+        result = assembler.response()
+        record_llm_usage(result, self.model_name)
+        yield {"type": "response", "response": result}
 
     def is_tool_call(self, response_data: Dict) -> bool:
         """
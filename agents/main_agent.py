@@ -1,55 +1,188 @@
 # main_agent.py - 主代理：负责与客户对话及文件操作（集成大模型）
 
+import asyncio
+import contextvars
 import os
 import json
-from typing import List, Dict, Optional, Tuple
+import threading
+import time
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from agents import file_reader
+from agents.search import search_tree
 from agents.llm_client import LLMClient
+from agents.tool_cache import CACHEABLE_TOOLS, ToolResultCache
+from agents.history import HistoryManager
+from agents.telemetry import telemetry
+from agents.tree_listing import DirectoryCache, get_shared_listing_cache, list_tree
+from agents.tool_output import OutputGovernor
+
+# 进程内共享的有界工具线程池，限制所有会话的并发工具数
+TOOL_WORKERS = int(os.environ.get("MEMAGENT_TOOL_WORKERS", 8))
+# search_keyword 每个匹配前后返回的上下文字节数，以及合并后单个窗口的最大字节数
+SEARCH_CONTEXT_BYTES = 200
+SEARCH_WINDOW_MAX_BYTES = 2000
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+        return _tool_executor
+
+
+FETCH_MORE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "fetch_more",
+        "description": "工具结果带 truncated 与 continuation 时，用 continuation 获取下一页（不会重新执行原工具）",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "continuation": {"type": "string", "description": "上一页结果中的 continuation"}
+            },
+            "required": ["continuation"]
+        }
+    }
+}
 
 
 class MainAgent:
-    def __init__(self, root_dir: str = ".", llm_client: Optional[LLMClient] = None):
+    def __init__(self, root_dir: str = ".", llm_client: Optional[LLMClient] = None,
+                 tool_timeout: float = 30.0, tool_cache: Optional[ToolResultCache] = None,
+                 history: Optional[HistoryManager] = None, listing_cache: Optional[DirectoryCache] = None,
+                 output_governor: Optional[OutputGovernor] = None):
         self.root_dir = os.path.abspath(root_dir)
         self.llm_client = llm_client
+        self.tool_timeout = tool_timeout
+        # 可由多个会话共享；为 None 时不缓存
+        self.tool_cache = tool_cache
+        self.trigram_index = None
+        self.watcher = None
+        # 目录快照缓存（list_tree 使用），默认进程内共享
+        self.listing_cache = listing_cache or get_shared_listing_cache()
+        # 工具输出预算：超出的结果分页，余下部分通过 fetch_more 续取；为 None 时不限制
+        self.output_governor = output_governor
+        # 发送前按 token 预算压缩消息历史；last_history_stats 为最近一次压缩的节省统计
+        self.history = history or HistoryManager()
+        self.last_history_stats: Dict = {}
+
+    def enable_trigram_index(self, index_path: Optional[str] = None):
+        """启用三元组内容索引：search_files 先用索引缩小候选文件再校验"""
+        from agents.trigram_index import get_shared_index
+        self.trigram_index = get_shared_index(self.root_dir, index_path)
+        if self.watcher is not None:
+            self._watch_trigram_index()
+        return self.trigram_index
+
+    def _watch_trigram_index(self):
+        self.trigram_index.watched = True
+        self.watcher.subscribe(self.trigram_index.apply_changes)
+
+    def enable_watcher(self, watcher=None):
+        """监听工作目录的文件变更：三元组索引、目录快照缓存与工具结果缓存随变更批次在后台增量更新"""
+        from agents.fs_watcher import get_shared_watcher
+        self.watcher = watcher or get_shared_watcher(self.root_dir)
+        self.watcher.subscribe(self.listing_cache.apply_changes)
+        if self.tool_cache is not None:
+            self.watcher.subscribe(self.tool_cache.apply_changes)
+        if self.trigram_index is not None:
+            self._watch_trigram_index()
+        return self.watcher
 
     def list_files(self, sub_path: str = "") -> List[str]:
         """列出指定子目录下的所有文件（非递归）"""
         target_dir = os.path.join(self.root_dir, sub_path)
         if not os.path.exists(target_dir):
             raise FileNotFoundError(f"Directory not found: {target_dir}")
-        return [f for f in os.listdir(target_dir) if os.path.isfile(os.path.join(target_dir, f))]
+        # DirEntry.is_file 直接使用 d_type，只有符号链接才需要 stat
+        with os.scandir(target_dir) as it:
+            return [entry.name for entry in it if entry.is_file()]
+
+    def list_tree(self, path: str = "", max_depth: int = 3, glob=None, exclude=None, gitignore: bool = True,
+                  limit: int = 200, cursor: Optional[str] = None) -> Dict:
+        """递归列出目录树（文件带大小），按 limit 分页；目录快照按 mtime 缓存，重复调用只需逐目录 stat"""
+        return list_tree(self.root_dir, path, max_depth=max_depth, glob=glob, exclude=exclude,
+                         use_gitignore=gitignore, limit=limit, cursor=cursor, cache=self.listing_cache)
+
+    def read_file_content(self, file_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                          start_line: Optional[int] = None, end_line: Optional[int] = None) -> str:
+        """
+        读取文件内容：start/end 为字节偏移（自动对齐到 UTF-8 字符边界，负数从文件末尾倒数），
+        start_line/end_line 为行号（从 1 开始，包含 end_line）；均基于 mmap，只解码请求的窗口
+        """
+        full_path = os.path.join(self.root_dir, file_path)
+        if not os.path.exists(full_path):
+            raise FileNotFoundError(f"File not found: {full_path}")
+        if start_line is not None or end_line is not None:
+            return file_reader.read_lines(full_path, start_line, end_line)
+        return file_reader.read_window(full_path, start, end)
 
-    def read_file_content(self, file_path: str, start: Optional[int] = None, end: Optional[int] = None) -> str:
-        """读取文件内容，可指定起止位置"""
+    def read_file_limited(self, file_path: str, start: Optional[int] = None, end: Optional[int] = None,
+                          start_line: Optional[int] = None, end_line: Optional[int] = None) -> Dict:
+        """
+        按输出预算读取：行号范围先换算为字节范围，只解码预算内的窗口；
+        超出部分返回 continuation（fetch_more 续取）与 next_start（也可用 start 继续读取）
+        """
         full_path = os.path.join(self.root_dir, file_path)
         if not os.path.exists(full_path):
             raise FileNotFoundError(f"File not found: {full_path}")
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        if start is not None or end is not None:
-            start = start if start is not None else 0
-            end = end if end is not None else len(content)
-            return content[start:end]
-        return content
-
-    def search_keyword(self, file_path: str, keyword: str) -> List[Dict]:
-        """在文件中搜索关键词，返回每个匹配位置前后200字符的上下文"""
-        content = self.read_file_content(file_path)
-        results = []
-        start = 0
-        while True:
-            pos = content.find(keyword, start)
-            if pos == -1:
-                break
-            before = max(0, pos - 200)
-            after = min(len(content), pos + len(keyword) + 200)
-            results.append({
-                "position": pos,
-                "context_before": content[before:pos],
-                "matched": content[pos:pos + len(keyword)],
-                "context_after": content[pos + len(keyword):after]
-            })
-            start = pos + 1
-        return results
+        if start_line is not None or end_line is not None:
+            start, end = file_reader.line_range(full_path, start_line, end_line)
+        return self.output_governor.read_file(full_path, start, end)
+
+    def search_keyword(self, file_path: str, keyword: str, max_results: int = 50) -> List[Dict]:
+        """
+        在文件中搜索关键词，返回前 max_results 个匹配位置（字节偏移与行号）及前后 200 字节的上下文
+        相邻匹配的上下文窗口重叠时合并为一个窗口：{"matches": [{"position", "line"}, ...], "context": 文本}
+        """
+        if not keyword:
+            raise ValueError("keyword 不能为空")
+        full_path = os.path.join(self.root_dir, file_path)
+        if not os.path.exists(full_path):
+            raise FileNotFoundError(f"File not found: {full_path}")
+        needle = keyword.encode('utf-8')
+        # [窗口起点, 窗口终点, 窗口内的匹配]；上下文重叠的相邻匹配合并到同一窗口（窗口有最大长度），
+        # 不再合并时新窗口从上一窗口终点开始，重叠文本只返回一次
+        windows = []
+        found = 0
+        with file_reader.open_mmap(full_path) as mm:
+            if mm is None:
+                return []
+            line_index = file_reader.get_line_index(full_path, mm)
+            pos = mm.find(needle)
+            while pos != -1 and found < max_results:
+                match = {"position": pos, "line": line_index.line_of(mm, pos)}
+                start, end = pos - SEARCH_CONTEXT_BYTES, pos + len(needle) + SEARCH_CONTEXT_BYTES
+                if windows and start <= windows[-1][1] and end - windows[-1][0] <= SEARCH_WINDOW_MAX_BYTES:
+                    windows[-1][1] = end
+                    windows[-1][2].append(match)
+                else:
+                    windows.append([max(start, windows[-1][1]) if windows else start, end, [match]])
+                found += 1
+                pos = mm.find(needle, pos + 1)
+            return [{"matches": matches, "context": file_reader.decode_window(mm, start, end)}
+                    for start, end, matches in windows]
+
+    def search_files(self, pattern: str, path: str = "", regex: bool = False, ignore_case: bool = False,
+                     glob: Optional[str] = None, max_results: int = 50) -> Dict:
+        """递归搜索目录下所有文件（遵循 .gitignore），返回匹配行及是否因达到上限而截断"""
+        target_dir = os.path.join(self.root_dir, path)
+        if not os.path.isdir(target_dir):
+            raise FileNotFoundError(f"Directory not found: {target_dir}")
+        stats = {}
+        search = self.trigram_index.search if self.trigram_index is not None else partial(search_tree, self.root_dir)
+        matches = list(search(pattern, path, regex=regex, ignore_case=ignore_case,
+                              glob=glob, max_results=max_results + 1, stats=stats))
+        return {
+            "matches": matches[:max_results],
+            "truncated": len(matches) > max_results,
+            "files_scanned": stats["files_scanned"]
+        }
 
     def get_tool_definitions(self) -> List[Dict]:
         """返回可用工具的 OpenAI 格式定义"""
@@ -68,17 +201,40 @@ class MainAgent:
                     }
                 }
             },
+            {
+                "type": "function",
+                "function": {
+                    "name": "list_tree",
+                    "description": "递归列出目录树（遵循 .gitignore），返回相对路径、类型与文件大小；"
+                                   "结果分页，next_cursor 不为空时传入 cursor 获取下一页。了解项目结构时优先使用",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "path": {"type": "string", "description": "相对目录，留空表示工作目录（可选）"},
+                            "max_depth": {"type": "integer", "description": "最大展开深度，1 表示只列直接子项（可选，默认 3）"},
+                            "glob": {"type": "string", "description": "只列出匹配的文件，如 *.py，多个用逗号分隔（可选）"},
+                            "exclude": {"type": "string", "description": "排除匹配的文件和目录，如 node_modules,*.log（可选）"},
+                            "gitignore": {"type": "boolean", "description": "是否遵循 .gitignore（可选，默认 true）"},
+                            "limit": {"type": "integer", "description": "每页最多条目数（可选，默认 200）"},
+                            "cursor": {"type": "string", "description": "上一页返回的 next_cursor（可选）"}
+                        },
+                        "required": []
+                    }
+                }
+            },
             {
                 "type": "function",
                 "function": {
                     "name": "read_file",
-                    "description": "读取文件内容，可指定起止位置",
+                    "description": "读取文件内容，可按字节偏移或行号范围读取，大文件请只读取需要的部分",
                     "parameters": {
                         "type": "object",
                         "properties": {
                             "file_path": {"type": "string", "description": "文件相对路径"},
-                            "start": {"type": "integer", "description": "起始位置（可选）"},
-                            "end": {"type": "integer", "description": "结束位置（可选）"}
+                            "start": {"type": "integer", "description": "起始字节偏移（可选，负数表示从文件末尾倒数）"},
+                            "end": {"type": "integer", "description": "结束字节偏移（可选，不含；负数表示从文件末尾倒数）"},
+                            "start_line": {"type": "integer", "description": "起始行号，从 1 开始（可选）"},
+                            "end_line": {"type": "integer", "description": "结束行号，包含该行（可选）"}
                         },
                         "required": ["file_path"]
                     }
@@ -88,40 +244,252 @@ class MainAgent:
                 "type": "function",
                 "function": {
                     "name": "search_keyword",
-                    "description": "在文件中搜索关键词，返回匹配位置上下文",
+                    "description": "在文件中搜索关键词，返回匹配位置（字节偏移与行号）及上下文，上下文重叠的相邻匹配合并为一段",
                     "parameters": {
                         "type": "object",
                         "properties": {
                             "file_path": {"type": "string", "description": "文件相对路径"},
-                            "keyword": {"type": "string", "description": "要搜索的关键词"}
+                            "keyword": {"type": "string", "description": "要搜索的关键词"},
+                            "max_results": {"type": "integer", "description": "最多返回的匹配数（可选，默认 50）"}
                         },
                         "required": ["file_path", "keyword"]
                     }
                 }
+            },
+            {
+                "type": "function",
+                "function": {
+                    "name": "search_files",
+                    "description": "在目录下递归搜索所有文件（遵循 .gitignore），返回匹配的文件、行号与该行内容",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "pattern": {"type": "string", "description": "要搜索的关键词或正则表达式"},
+                            "path": {"type": "string", "description": "搜索的相对目录，留空表示工作目录（可选）"},
+                            "regex": {"type": "boolean", "description": "pattern 是否为正则表达式（可选，默认 false）"},
+                            "ignore_case": {"type": "boolean", "description": "是否忽略大小写（可选，默认 false）"},
+                            "glob": {"type": "string", "description": "只搜索文件名匹配该通配符的文件，如 *.py（可选）"},
+                            "max_results": {"type": "integer", "description": "最多返回的匹配数（可选，默认 50）"}
+                        },
+                        "required": ["pattern"]
+                    }
+                }
             }
-        ]
+        ] + ([FETCH_MORE_TOOL] if self.output_governor is not None else [])
 
     def execute_tool_call(self, tool_name: str, arguments: Dict) -> Dict:
-        """执行具体工具调用"""
+        """执行具体工具调用；启用缓存时，目标文件未变化的相同调用直接返回缓存结果"""
+        with telemetry.span("tool_call", tool=tool_name) as span:
+            key = self.tool_cache.make_key(self.root_dir, tool_name, arguments) if self.tool_cache else None
+            result = self.tool_cache.get(key) if key is not None else None
+            if result is not None:
+                span.set(cached=True)
+                if tool_name == "read_file" and self.output_governor is not None:
+                    result = self.output_governor.resume_file(
+                        os.path.join(self.root_dir, arguments.get("file_path") or ""), result)
+            else:
+                result = self._execute_tool_call(tool_name, arguments)
+                if "error" in result:
+                    telemetry.inc("tool_call_failures_total", tool=tool_name)
+                    span.set(error=result["error"])
+                elif key is not None:
+                    # 受预算限制的 read_file 首页不缓存游标（游标会被淘汰），命中时重新签发
+                    self.tool_cache.put(key, {k: v for k, v in result.items() if k != "continuation"})
+            # 其余工具缓存的是完整结果，预算在输出时应用
+            if self.output_governor is not None and tool_name != "fetch_more":
+                result = self.output_governor.limit(tool_name, result)
+                if result.get("truncated"):
+                    span.set(truncated=True)
+            return result
+
+    def _execute_tool_call(self, tool_name: str, arguments: Dict) -> Dict:
         try:
             if tool_name == "list_files":
                 files = self.list_files(arguments.get("path", ""))
                 return {"result": files}
+            elif tool_name == "list_tree":
+                return {"result": self.list_tree(
+                    arguments.get("path", ""),
+                    arguments.get("max_depth", 3),
+                    arguments.get("glob"),
+                    arguments.get("exclude"),
+                    arguments.get("gitignore", True),
+                    arguments.get("limit", 200),
+                    arguments.get("cursor")
+                )}
+            elif tool_name == "read_file" and self.output_governor is not None:
+                return self.read_file_limited(
+                    arguments["file_path"],
+                    arguments.get("start"),
+                    arguments.get("end"),
+                    arguments.get("start_line"),
+                    arguments.get("end_line")
+                )
             elif tool_name == "read_file":
                 content = self.read_file_content(
                     arguments["file_path"],
                     arguments.get("start"),
-                    arguments.get("end")
+                    arguments.get("end"),
+                    arguments.get("start_line"),
+                    arguments.get("end_line")
                 )
                 return {"result": content}
             elif tool_name == "search_keyword":
-                results = self.search_keyword(arguments["file_path"], arguments["keyword"])
+                results = self.search_keyword(arguments["file_path"], arguments["keyword"],
+                                              arguments.get("max_results", 50))
+                return {"result": results}
+            elif tool_name == "search_files":
+                results = self.search_files(
+                    arguments["pattern"],
+                    arguments.get("path", ""),
+                    arguments.get("regex", False),
+                    arguments.get("ignore_case", False),
+                    arguments.get("glob"),
+                    arguments.get("max_results", 50)
+                )
                 return {"result": results}
+            elif tool_name == "fetch_more" and self.output_governor is not None:
+                return self.output_governor.fetch_more(arguments["continuation"])
             else:
                 return {"error": f"未知工具: {tool_name}"}
         except Exception as e:
             return {"error": str(e)}
 
+    def run_tool_calls(self, tool_calls: List[Dict]) -> List[Dict]:
+        """
+        在共享线程池中并行执行同一轮的多个工具调用，返回与 tool_calls 顺序一致的结果
+        单个工具从开始执行起超过 tool_timeout 秒即返回超时错误（线程本身无法中止，会在后台结束）
+        """
+        results: List[Optional[Dict]] = [None] * len(tool_calls)
+        for index, result in self.iter_tool_calls(tool_calls):
+            results[index] = result
+        return results
+
+    def iter_tool_calls(self, tool_calls: List[Dict]) -> Iterator[Tuple[int, Dict]]:
+        """与 run_tool_calls 相同，但按完成顺序产出 (调用下标, 结果)，供流式接口逐个推送"""
+        executor = get_tool_executor()
+        started: List[Optional[float]] = [None] * len(tool_calls)
+
+        def run(index: int, call: Dict) -> Dict:
+            started[index] = time.monotonic()
+            return self._run_call(call)
+
+        # 每个调用复制一份 contextvars 上下文，工具线程中的 span 仍归属当前会话的 trace
+        futures = {executor.submit(contextvars.copy_context().run, run, i, call): i
+                   for i, call in enumerate(tool_calls)}
+        # 排队中的调用最多等到前面每一波都各自超时为止
+        waves = -(-len(tool_calls) // TOOL_WORKERS)
+        round_deadline = time.monotonic() + self.tool_timeout * (waves + 1)
+        pending = set(futures)
+        try:
+            while pending:
+                now = time.monotonic()
+                deadlines = {}
+                for future in pending:
+                    i = futures[future]
+                    deadlines[future] = (round_deadline if started[i] is None
+                                         else min(started[i] + self.tool_timeout, round_deadline))
+                for future in [f for f in pending if deadlines[f] <= now and not f.done()]:
+                    future.cancel()
+                    pending.discard(future)
+                    yield futures[future], {"error": f"工具执行超时（{self.tool_timeout:g}s）"}
+                if not pending:
+                    return
+                # 等待期间可能有调用刚开始执行，最多等 0.1 秒就按实际开始时间重新计算截止时间
+                timeout = max(0.0, min(min(deadlines[f] for f in pending) - now, 0.1))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield futures[future], future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _run_call(self, call: Dict) -> Dict:
+        """解析参数并执行单个工具调用"""
+        try:
+            args = json.loads(call["function"].get("arguments") or "{}")
+        except json.JSONDecodeError as e:
+            return {"error": f"工具参数解析失败: {e}"}
+        return self.execute_tool_call(call["function"]["name"], args)
+
+    async def arun_tool_calls(self, tool_calls: List[Dict]) -> List[Dict]:
+        """
+        run_tool_calls 的异步版本：阻塞的文件工具仍在共享线程池中执行，事件循环只等待结果
+        超时规则相同：从工具实际开始执行起计时，排队时间受整轮截止时间限制
+        """
+        results: List[Optional[Dict]] = [None] * len(tool_calls)
+        async for index, result in self.aiter_tool_calls(tool_calls):
+            results[index] = result
+        return results
+
+    async def aiter_tool_calls(self, tool_calls: List[Dict]) -> AsyncIterator[Tuple[int, Dict]]:
+        """arun_tool_calls 的流式版本：按完成顺序产出 (调用下标, 结果)"""
+        loop = asyncio.get_running_loop()
+        executor = get_tool_executor()
+        waves = -(-len(tool_calls) // TOOL_WORKERS)
+        round_deadline = loop.time() + self.tool_timeout * (waves + 1)
+
+        async def run_one(index: int, call: Dict) -> Tuple[int, Dict]:
+            started = asyncio.Event()
+
+            def run() -> Dict:
+                loop.call_soon_threadsafe(started.set)
+                return self._run_call(call)
+
+            future = loop.run_in_executor(executor, contextvars.copy_context().run, run)
+            try:
+                await asyncio.wait_for(started.wait(), timeout=max(0.0, round_deadline - loop.time()))
+                return index, await asyncio.wait_for(future, timeout=self.tool_timeout)
+            except asyncio.TimeoutError:
+                future.cancel()
+                return index, {"error": f"工具执行超时（{self.tool_timeout:g}s）"}
+
+        tasks = [asyncio.ensure_future(run_one(i, call)) for i, call in enumerate(tool_calls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def make_tool_message(call: Dict, result: Dict) -> Dict:
+        """构建追加到消息历史的工具结果消息"""
+        content = json.dumps(result, ensure_ascii=False)
+        if telemetry.enabled:
+            telemetry.inc("tool_result_bytes_total", len(content.encode('utf-8')), tool=call["function"]["name"])
+        return {
+            "role": "tool",
+            "tool_call_id": call["id"],
+            "name": call["function"]["name"],
+            "content": content
+        }
+
+    def collect_sources(self, messages: List[Dict]) -> Optional[List[str]]:
+        """
+        本轮（最后一条 user 消息之后）工具调用读取过的路径，供响应缓存记录指纹
+        用过无法按单个路径校验的工具（如跨文件搜索）时返回 None，表示该回答不可缓存
+        """
+        last_user = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=-1)
+        sources = set()
+        for message in messages[last_user + 1:]:
+            for call in message.get("tool_calls") or []:
+                path_arg = CACHEABLE_TOOLS.get(call["function"]["name"])
+                if path_arg is None:
+                    return None
+                try:
+                    args = json.loads(call["function"].get("arguments") or "{}")
+                except json.JSONDecodeError:
+                    continue
+                sources.add(os.path.normpath(os.path.join(self.root_dir, args.get(path_arg) or "")))
+        return sorted(sources)
+
+    def prepare_messages(self, messages: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """压缩消息历史以控制请求大小，返回 (发送用的消息, 节省统计)；原始历史不变"""
+        compacted, stats = self.history.prepare(messages)
+        self.last_history_stats = stats
+        return compacted, stats
+
     def chat_with_tools(self, messages: List[Dict]) -> str:
         """
         与大模型对话，自动处理工具调用循环
@@ -134,30 +502,47 @@ class MainAgent:
 
         while True:
             # 调用大模型
-            response = self.llm_client.chat_completion(current_messages, tools=tools)
-            
+            payload, _ = self.prepare_messages(current_messages)
+            response = self.llm_client.chat_completion(payload, tools=tools)
+
             # 检查是否包含工具调用
             if self.llm_client.is_tool_call(response):
                 tool_calls = self.llm_client.extract_tool_calls(response)
-                tool_results = []
-
-                # 执行所有工具调用
-                for call in tool_calls:
-                    func_name = call["function"]["name"]
-                    args = json.loads(call["function"]["arguments"])
-                    result = self.execute_tool_call(func_name, args)
-                    
-                    # 添加工具结果到消息历史
-                    current_messages.append({
-                        "role": "tool",
-                        "tool_call_id": call["id"],
-                        "name": func_name,
-                        "content": json.dumps(result, ensure_ascii=False)
-                    })
-                    tool_results.append(result)
-                
+                current_messages.append({
+                    "role": "assistant",
+                    "content": self.llm_client.extract_content(response) or "",
+                    "tool_calls": tool_calls
+                })
+
+                # 并行执行所有工具调用，结果按 tool_call 原顺序加入消息历史
+                for call, result in zip(tool_calls, self.run_tool_calls(tool_calls)):
+                    current_messages.append(self.make_tool_message(call, result))
+
                 # 继续下一轮调用（模型会基于工具结果生成最终回复）
                 continue
             else:
                 # 无工具调用，返回最终内容
-                return self.llm_client.extract_content(response)
\ No newline at end of file
+                return self.llm_client.extract_content(response)
+
+    async def achat_with_tools(self, messages: List[Dict]) -> str:
+        """chat_with_tools 的异步版本，需要 AsyncLLMClient"""
+        if self.llm_client is None:
+            raise ValueError("LLM client not initialized")
+
+        tools = self.get_tool_definitions()
+        current_messages = messages.copy()
+
+        while True:
+            payload, _ = self.prepare_messages(current_messages)
+            response = await self.llm_client.achat_completion(payload, tools=tools)
+            if not self.llm_client.is_tool_call(response):
+                return self.llm_client.extract_content(response)
+
+            tool_calls = self.llm_client.extract_tool_calls(response)
+            current_messages.append({
+                "role": "assistant",
+                "content": self.llm_client.extract_content(response) or "",
+                "tool_calls": tool_calls
+            })
+            for call, result in zip(tool_calls, await self.arun_tool_calls(tool_calls)):
+                current_messages.append(self.make_tool_message(call, result))
@@ -1,26 +1,159 @@
 # memory_agent.py - 记忆代理：会话总结与记忆条目生成
 
-import json
-from typing import Dict, List, Optional
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, MutableMapping, Optional, Set
+from agents.memory_consolidation import MemoryConsolidator, memory_key, merge_values, question_digest
+from agents.memory_index import MemoryIndex
+from agents.memory_store import LazyValues, MemoryStore, create_memory_store
+from agents.rwlock import ReadWriteLock
+from agents.telemetry import telemetry
 
 
 class MemoryAgent:
-    def __init__(self, memory_file: str = "memory.json"):
+    def __init__(self, memory_file: str = "memory.json", store: Optional[MemoryStore] = None,
+                 consolidator: Optional[MemoryConsolidator] = None):
         self.memory_file = memory_file
-        self.memories: Dict[str, str] = self._load_memories()
+        # 默认使用追加日志存储，写入为 O(1)；MEMAGENT_MEMORY_STORE=compact 时只在内存中保留 key 与指针
+        self.store = store or create_memory_store(memory_file)
+        self.memories: MutableMapping[str, str] = self._load_memories()
+        # 规范化问题哈希 -> key，写入时 O(1) 找到同一问题的旧条目（只看 key，不读取正文）
+        self._by_digest: Dict[str, Set[str]] = {}
+        self._index_digests(self.memories, ())
+        # BM25 索引在第一次检索时构建，启动时不读取记忆正文
+        self._index: Optional[MemoryIndex] = None
+        self._index_lock = threading.Lock()
+        self.vector_index = None
+        self.response_cache = None
+        # 近似重复合并与容量淘汰；使用统计存于 <memory_file>.usage
+        self.consolidator = consolidator or MemoryConsolidator.from_env(memory_file)
+        # 检索持读锁，写入与同步其他进程的变更持写锁
+        self._rwlock = ReadWriteLock()
 
-    def _load_memories(self) -> Dict[str, str]:
-        """从文件加载现有记忆"""
-        try:
-            with open(self.memory_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+    @property
+    def index(self) -> MemoryIndex:
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    index = MemoryIndex()
+                    index.build(self.memories)
+                    self._index = index
+        return self._index
+
+    def _load_memories(self) -> MutableMapping[str, str]:
+        """从存储加载现有记忆（快照 + 日志重放）"""
+        return self.store.load()
 
     def save_memories(self):
-        """保存记忆到文件"""
-        with open(self.memory_file, 'w', encoding='utf-8') as f:
-            json.dump(self.memories, f, ensure_ascii=False, indent=2)
+        """把全部记忆压缩为完整快照（原子替换）"""
+        with telemetry.span("memory_snapshot") as span:
+            self.consolidator.usage.flush()
+            self.store.snapshot()
+            span.set(memories=len(self.memories))
+
+    def enable_vector_index(self, embedder=None):
+        """启用向量检索：加载磁盘上的向量矩阵，只为缺失的记忆计算嵌入"""
+        with self._rwlock.write():
+            if self.vector_index is None:
+                from agents.embedding import VectorIndex
+                self.vector_index = VectorIndex(self.memory_file, embedder)
+                self.vector_index.sync(self.memories)
+        return self.vector_index
+
+    def enable_response_cache(self, threshold: float = 1.0, ttl: float = 86400.0):
+        """启用响应缓存：相近问题且依赖文件未变化时可直接复用历史回答"""
+        with self._rwlock.write():
+            if self.response_cache is None:
+                from agents.response_cache import ResponseCache
+                self.response_cache = ResponseCache(self.memory_file, threshold=threshold, ttl=ttl)
+        return self.response_cache
+
+    def refresh(self):
+        """同步其他进程写入的记忆；磁盘未变化时只需两次 stat，不加写锁"""
+        if self.store.is_stale():
+            with self._rwlock.write():
+                self._apply_changes(self.store.poll_changes())
+
+    @contextmanager
+    def reading(self) -> Iterator[MutableMapping[str, str]]:
+        """先同步外部变更，再在读锁内访问记忆与索引"""
+        self.refresh()
+        with self._rwlock.read():
+            yield self.memories
+
+    def _index_digests(self, added, removed):
+        for key in removed:
+            keys = self._by_digest.get(question_digest(key))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_digest[question_digest(key)]
+        for key in added:
+            digest = question_digest(key)
+            if digest is not None:
+                self._by_digest.setdefault(digest, set()).add(key)
+
+    def _apply_changes(self, changed: Optional[Set[str]]):
+        """把存储中变化的 key 增量更新到索引；None 表示存储整体重载过，重建索引"""
+        if changed is None:
+            self._by_digest = {}
+            self._index_digests(self.memories, ())
+            self._index = None  # 下次检索时重建
+            if self.vector_index is not None:
+                self.vector_index.sync(self.memories)
+            if self.consolidator.index is not None:
+                self.consolidator.index.build(self.memories)
+            return
+        upserts = {key: self.memories[key] for key in changed if key in self.memories}
+        removed = [key for key in changed if key not in self.memories]
+        self._index_digests(upserts, removed)
+        if self._index is not None:
+            for key, value in upserts.items():
+                self._index.add(key, value)
+            for key in removed:
+                self._index.remove(key)
+        if self.vector_index is not None:
+            self.vector_index.add_many(upserts)
+            for key in removed:
+                self.vector_index.remove(key)
+        self.consolidator.apply_changes(upserts, removed)
+
+    def list_memories(self, offset: int = 0, limit: int = 50, query: Optional[str] = None,
+                      search: Optional[str] = None, preview: int = 200) -> Dict:
+        """
+        分页浏览记忆：默认最新的在前，query 按 key 的子串过滤（不读取正文），search 按 BM25 相关度排序
+        每项返回 key、值的前 preview 个字符与字节数（preview=0 返回完整的值）；只读取当前页的正文
+        """
+        offset, limit = max(0, offset), max(1, limit)
+        with self.reading() as memories:
+            if search:
+                # 相关度检索无法廉价地得到总数，多取一条判断是否还有下一页
+                keys = [key for key, _ in self.index.search(search, offset + limit + 1)]
+                total = None
+            else:
+                keys = list(memories)
+                keys.reverse()
+                if query:
+                    needle = query.lower()
+                    keys = [key for key in keys if needle in key.lower()]
+                total = len(keys)
+            items = []
+            for key in keys[offset:offset + limit]:
+                value = memories[key]
+                size = memories.value_size(key) if isinstance(memories, LazyValues) else len(value.encode('utf-8'))
+                item = {"key": key, "value": value[:preview] if preview else value, "size": size}
+                if preview and len(value) > preview:
+                    item["truncated"] = True
+                items.append(item)
+        has_more = len(keys) > offset + limit
+        return {"items": items, "offset": offset, "limit": limit, "total": total,
+                "next_offset": offset + limit if has_more else None}
+
+    def get_memory(self, key: str) -> Optional[str]:
+        with self.reading() as memories:
+            return memories.get(key)
 
     def summarize_conversation(self, conversation_history: List[Dict]) -> Optional[str]:
         """
@@ -45,6 +178,101 @@ class MemoryAgent:
         return None
 
     def add_memory_entry(self, key: str, value: str):
-        """添加记忆条目（key-value）"""
-        self.memories[key] = value
-        self.save_memories()
\ No newline at end of file
+        """
+        添加记忆条目（key-value）；写入前顺带追上的其他进程条目一并更新到索引
+        规范化问题完全相同的旧条目由新条目取代，超出容量上限时淘汰使用得分最低的条目；近似重复只在显式整理（consolidate）时合并
+        """
+        with telemetry.span("memory_write") as span, self._rwlock.write():
+            self.store.set(key, value)
+            self._apply_changes(self.store.poll_changes())
+            self.consolidator.usage.record_write(key)
+            replaced = [other for other in self._by_digest.get(question_digest(key), ()) if other != key]
+            if replaced:
+                for old in replaced:
+                    self.store.delete(old)
+                self.consolidator.usage.merge(key, replaced)
+                self._apply_changes(self.store.poll_changes())
+            evicted = self._evict(protect=key)
+            span.set(replaced=len(replaced), evicted=evicted)
+        if telemetry.enabled:
+            telemetry.inc("memory_write_bytes_total", len(key.encode('utf-8')) + len(value.encode('utf-8')))
+
+    def record_hits(self, keys: List[str]):
+        """记录检索命中，作为淘汰得分的依据"""
+        if keys:
+            self.consolidator.usage.touch(keys)
+
+    def _merge_into(self, survivor: str, duplicates: List[str]) -> int:
+        """把近似重复条目的解答附到 survivor 后再删除它们，使用统计一并并入（需持有写锁）"""
+        if not duplicates:
+            return 0
+        merged = merge_values(self.memories[survivor], [self.memories[key] for key in duplicates])
+        if merged != self.memories[survivor]:
+            self.store.set(survivor, merged)
+        for key in duplicates:
+            self.store.delete(key)
+        self.consolidator.usage.merge(survivor, duplicates)
+        self._apply_changes(self.store.poll_changes())
+        self.consolidator.merged += len(duplicates)
+        telemetry.inc("memory_merged_total", len(duplicates))
+        return len(duplicates)
+
+    def _evict(self, protect: Optional[str] = None) -> int:
+        """条数超过上限时删除使用得分最低的条目（需持有写锁）"""
+        evicted = self.consolidator.eviction_candidates(self.memories, time.time(), protect)
+        if not evicted:
+            return 0
+        for key in evicted:
+            self.store.delete(key)
+        self.consolidator.usage.forget(evicted)
+        self._apply_changes(self.store.poll_changes())
+        self.consolidator.evicted += len(evicted)
+        telemetry.inc("memory_evicted_total", len(evicted))
+        return len(evicted)
+
+    def consolidate(self) -> Dict[str, int]:
+        """对全部记忆做一次近似重复合并（问题与解答都相似）与容量淘汰，返回 {"merged", "evicted", "memories"}"""
+        self.refresh()
+        with telemetry.span("memory_consolidate") as span, self._rwlock.write():
+            now = time.time()
+            merged = 0
+            for group in self.consolidator.clusters(self.memories):
+                survivor = self.consolidator.survivor(group, now)
+                merged += self._merge_into(survivor, [key for key in group if key != survivor])
+            evicted = self._evict()
+            span.set(merged=merged, evicted=evicted)
+            self.consolidator.usage.flush()
+            return {"merged": merged, "evicted": evicted, "memories": len(self.memories)}
+
+    def remember_exchange(self, user_msg: str, assistant_reply: str,
+                          sources: Optional[List[str]] = None) -> Optional[str]:
+        """
+        总结一轮问答并写入记忆，返回写入的 key（无可总结内容时返回 None）
+        sources 为回答所依赖的文件/目录；启用响应缓存且 sources 不为 None 时同时写入响应缓存
+        """
+        summary = self.summarize_conversation([
+            {"role": "user", "content": user_msg},
+            {"role": "assistant", "content": assistant_reply}
+        ])
+        if not summary:
+            return None
+        key = memory_key(user_msg)
+        self.add_memory_entry(key, summary)
+        if self.response_cache is not None and sources is not None:
+            self.response_cache.record(user_msg, assistant_reply, sources)
+        return key
+
+
+_shared_agents: Dict[str, MemoryAgent] = {}
+_shared_agents_lock = threading.Lock()
+
+
+def get_shared_memory_agent(memory_file: str = "memory.json") -> MemoryAgent:
+    """进程内按记忆文件路径共享同一个 MemoryAgent，避免每个会话重复加载与互相覆盖"""
+    path = os.path.realpath(memory_file)
+    with _shared_agents_lock:
+        agent = _shared_agents.get(path)
+        if agent is None:
+            agent = MemoryAgent(memory_file=path)
+            _shared_agents[path] = agent
+        return agent
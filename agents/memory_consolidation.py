@@ -0,0 +1,382 @@
+# memory_consolidation.py - 记忆整理：无冲突的记忆 key、MinHash 近似去重合并、使用统计与按得分淘汰
+#
+# 环境变量：MEMAGENT_MAX_MEMORIES 记忆条数上限（默认 5000，0 为不限）；
+#           MEMAGENT_MEMORY_DEDUP_THRESHOLD / MEMAGENT_MEMORY_DEDUP_ANSWER_THRESHOLD
+#           整理（POST /memories/consolidate）时问题与解答的相似度都达到各自阈值才合并（默认 0.9 / 0.8，0 关闭）；
+#           MEMAGENT_MEMORY_HALF_LIFE_DAYS 淘汰得分中最近使用时间的半衰期（默认 30 天）
+
+import hashlib
+import heapq
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from agents.memory_store import JournalMemoryStore, MemoryStore
+from agents.response_cache import normalize_question
+
+try:
+    import numpy as np
+except ImportError:  # 无 numpy 时用纯 Python 计算签名，结果相同
+    np = None
+
+# 31 位梅森素数：哈希值与系数都小于它，a*x+b 不会超出 uint64
+_PRIME = (1 << 31) - 1
+
+
+def memory_key(question: str) -> str:
+    """
+    记忆 key：保留前 50 个字符便于阅读，再附上规范化问题的哈希，
+    前缀相同的不同问题不再互相覆盖，而完全相同的问题仍写入同一个 key
+    """
+    digest = hashlib.blake2b(normalize_question(question).encode('utf-8'), digest_size=6).hexdigest()
+    return f"Q: {question[:50]}... #{digest}"
+
+
+def question_digest(key: str) -> Optional[str]:
+    """memory_key 附加的规范化问题哈希；不是这种格式的 key 返回 None"""
+    _, sep, digest = key.rpartition(" #")
+    return digest if sep and len(digest) == 12 else None
+
+
+def question_of(value: str) -> str:
+    """从 "问题：...；解答：..." 格式的记忆中取出问题部分；其他格式的记忆整体参与比较"""
+    if value.startswith("问题："):
+        question, sep, _ = value[3:].partition("；解答：")
+        if sep:
+            return question
+    return value
+
+
+def answer_of(value: str) -> str:
+    """记忆中的解答部分；其他格式的记忆整体作为解答"""
+    if value.startswith("问题："):
+        _, sep, answer = value.partition("；解答：")
+        if sep:
+            return answer
+    return value
+
+
+# 合并时被吸收条目的原文附在保留条目之后，以该标记分隔
+MERGED_MARKER = "\n\n【已合并】"
+
+
+def merge_values(survivor: str, absorbed: List[str]) -> str:
+    """保留条目的内容 + 解答与之不同的被吸收条目原文，合并不丢失任何解答"""
+    seen = {normalize_question(answer_of(part)) for part in survivor.split(MERGED_MARKER)}
+    parts = [survivor]
+    for value in absorbed:
+        for part in value.split(MERGED_MARKER):
+            answer = normalize_question(answer_of(part))
+            if answer not in seen:
+                seen.add(answer)
+                parts.append(part)
+    return MERGED_MARKER.join(parts)
+
+
+def shingles(text: str, k: int = 3) -> Set[int]:
+    """规范化文本的字符 k-gram（中英文通用），以 CRC32 表示；短于 k 的文本整体作为一个片段"""
+    text = normalize_question(text)
+    if not text:
+        return set()
+    if len(text) <= k:
+        return {zlib.crc32(text.encode('utf-8')) % _PRIME}
+    return {zlib.crc32(text[i:i + k].encode('utf-8')) % _PRIME for i in range(len(text) - k + 1)}
+
+
+class MinHasher:
+    """
+    num_perm 个形如 (a*x + b) mod p 的哈希函数的最小值构成签名，两个签名相同位置相等的比例即 Jaccard 的估计
+    LSH 把签名切成 bands 段，任一段完全相同即为候选；默认 16 段 × 4 行，相似度约 0.5 以上的才大概率成为候选
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.a = [rng.randrange(1, _PRIME) for _ in range(num_perm)]
+        self.b = [rng.randrange(0, _PRIME) for _ in range(num_perm)]
+        if np is not None:
+            self._a = np.array(self.a, dtype=np.uint64)[:, None]
+            self._b = np.array(self.b, dtype=np.uint64)[:, None]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = shingles(text)
+        if not hashes:
+            return ()
+        if np is not None:
+            x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+            return tuple(((self._a * x + self._b) % _PRIME).min(axis=1).tolist())
+        return tuple(min((a * x + b) % _PRIME for x in hashes) for a, b in zip(self.a, self.b))
+
+    def band_keys(self, signature: Tuple[int, ...]) -> List[Tuple]:
+        return [(i, signature[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+
+    @staticmethod
+    def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+        if not sig_a or len(sig_a) != len(sig_b):
+            return 0.0
+        return sum(x == y for x, y in zip(sig_a, sig_b)) / len(sig_a)
+
+
+class NearDuplicateIndex:
+    """记忆问题的 MinHash 签名 + LSH 分桶：查找近似重复只比较同桶的候选，不随记忆总数线性增长"""
+
+    def __init__(self, hasher: Optional[MinHasher] = None):
+        self.hasher = hasher or MinHasher()
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: Dict[Tuple, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def build(self, memories: Dict[str, str]):
+        self.signatures.clear()
+        self._buckets.clear()
+        for key, value in memories.items():
+            self.add(key, value)
+
+    def add(self, key: str, value: str):
+        self.remove(key)
+        signature = self.hasher.signature(question_of(value))
+        if not signature:
+            return
+        self.signatures[key] = signature
+        for band in self.hasher.band_keys(signature):
+            self._buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band in self.hasher.band_keys(signature):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def similar(self, key: str, threshold: float) -> List[Tuple[str, float]]:
+        """与 key 的签名估计相似度不低于 threshold 的其他条目，按相似度降序"""
+        signature = self.signatures.get(key)
+        if signature is None:
+            return []
+        candidates: Set[str] = set()
+        for band in self.hasher.band_keys(signature):
+            candidates |= self._buckets.get(band, set())
+        candidates.discard(key)
+        scored = [(other, self.hasher.similarity(signature, self.signatures[other])) for other in candidates]
+        scored = [item for item in scored if item[1] >= threshold]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored
+
+
+@lru_cache(maxsize=65536)
+def _decode_usage(raw: str) -> Tuple[float, float, int]:
+    created, last_used, hits = json.loads(raw)
+    return created, last_used, hits
+
+
+def _encode_usage(created: float, last_used: float, hits: int) -> str:
+    return json.dumps([round(created, 3), round(last_used, 3), hits])
+
+
+class MemoryUsage:
+    """
+    每条记忆的 [创建时间, 最近使用时间, 命中次数]，存于 <memory_file>.usage（快照 + 追加日志，多进程共享）
+    检索命中只在内存中累加，flush 时先追上其他进程的写入再叠加本进程的增量，计数不会被整体覆盖
+    没有使用记录的旧记忆按首次加载时间计
+    """
+
+    def __init__(self, memory_file: str, store: Optional[MemoryStore] = None, flush_every: int = 256):
+        self.store = store or JournalMemoryStore(f"{memory_file}.usage")
+        self.records = self.store.load()
+        self.flush_every = flush_every
+        self.loaded_at = time.time()
+        self._pending: Dict[str, List] = {}  # key -> [最近使用时间, 命中增量]
+        self._lock = threading.Lock()
+
+    def _stored(self, key: str) -> Tuple[float, float, int]:
+        raw = self.records.get(key)
+        if raw is None:
+            return self.loaded_at, self.loaded_at, 0
+        try:
+            return _decode_usage(raw)
+        except (ValueError, TypeError):
+            return self.loaded_at, self.loaded_at, 0
+
+    def get(self, key: str) -> Tuple[float, float, int]:
+        created, last_used, hits = self._stored(key)
+        pending = self._pending.get(key)
+        if pending is not None:
+            last_used, hits = max(last_used, pending[0]), hits + pending[1]
+        return created, last_used, hits
+
+    def touch(self, keys: Iterable[str], now: Optional[float] = None):
+        """记录一次检索命中；待写入的增量足够多时顺带落盘"""
+        now = now or time.time()
+        with self._lock:
+            for key in keys:
+                pending = self._pending.setdefault(key, [now, 0])
+                pending[0] = now
+                pending[1] += 1
+            should_flush = len(self._pending) >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def record_write(self, key: str, now: Optional[float] = None):
+        """记忆被写入：新 key 从零开始计数，同一问题再次写入视为一次命中"""
+        now = now or time.time()
+        self.store.poll_changes()
+        with self._lock:
+            existed = key in self.records or key in self._pending
+            created, _, hits = self.get(key) if existed else (now, now, 0)
+            self._pending.pop(key, None)
+            self.store.set(key, _encode_usage(created, now, hits + 1 if existed else 0))
+
+    def merge(self, survivor: str, absorbed: List[str]):
+        """合并近似重复：命中次数相加，创建时间取最早、最近使用时间取最晚"""
+        self.store.poll_changes()
+        with self._lock:
+            created, last_used, hits = self.get(survivor)
+            for key in absorbed:
+                other = self.get(key)
+                created, last_used, hits = min(created, other[0]), max(last_used, other[1]), hits + other[2]
+            self._pending.pop(survivor, None)
+            self.store.set(survivor, _encode_usage(created, last_used, hits))
+            self._forget(absorbed)
+
+    def forget(self, keys: List[str]):
+        with self._lock:
+            self._forget(keys)
+
+    def _forget(self, keys: List[str]):
+        for key in keys:
+            self._pending.pop(key, None)
+            if key in self.records:
+                self.store.delete(key)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        self.store.poll_changes()
+        with self._lock:
+            for key, (last_used, hits) in pending.items():
+                created, stored_last, stored_hits = self._stored(key)
+                self.store.set(key, _encode_usage(created, max(stored_last, last_used), stored_hits + hits))
+
+    def score(self, key: str, now: float, half_life: float) -> float:
+        """淘汰得分：命中次数取对数，再按距最近使用的时间指数衰减；得分最低的先被淘汰"""
+        created, last_used, hits = self.get(key)
+        age = max(0.0, now - max(created, last_used))
+        return (1.0 + math.log1p(hits)) * 0.5 ** (age / half_life)
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+
+class MemoryConsolidator:
+    """
+    记忆整理策略：写入时只替换规范化后完全相同的问题（保留最新解答），不做近似合并；
+    条数超过 max_memories 时按使用得分淘汰；MemoryAgent.consolidate 显式整理时，
+    问题相似度 ≥ threshold 且解答相似度 ≥ answer_threshold 的条目才合并，被吸收条目的解答附在保留条目之后
+    近似重复索引在第一次整理时才构建，平时的写入不付出签名计算的开销
+    """
+
+    def __init__(self, memory_file: str, max_memories: int = 5000, threshold: float = 0.9,
+                 answer_threshold: float = 0.8, half_life: float = 30 * 86400, usage: Optional[MemoryUsage] = None,
+                 hasher: Optional[MinHasher] = None):
+        self.max_memories = max_memories
+        self.threshold = threshold
+        self.answer_threshold = answer_threshold
+        self.half_life = half_life
+        self.usage = usage or MemoryUsage(memory_file)
+        self.hasher = hasher
+        self.index: Optional[NearDuplicateIndex] = None
+        self.merged = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_env(cls, memory_file: str) -> "MemoryConsolidator":
+        return cls(memory_file,
+                   max_memories=int(os.environ.get("MEMAGENT_MAX_MEMORIES", 5000)),
+                   threshold=float(os.environ.get("MEMAGENT_MEMORY_DEDUP_THRESHOLD", 0.9)),
+                   answer_threshold=float(os.environ.get("MEMAGENT_MEMORY_DEDUP_ANSWER_THRESHOLD", 0.8)),
+                   half_life=float(os.environ.get("MEMAGENT_MEMORY_HALF_LIFE_DAYS", 30)) * 86400)
+
+    def ensure_index(self, memories: Dict[str, str]) -> NearDuplicateIndex:
+        if self.index is None:
+            self.index = NearDuplicateIndex(self.hasher)
+            self.index.build(memories)
+        return self.index
+
+    def apply_changes(self, upserts: Dict[str, str], removed: List[str]):
+        """与 MemoryAgent 的增量索引更新同步；索引尚未构建时无需维护"""
+        if self.index is None:
+            return
+        for key, value in upserts.items():
+            self.index.add(key, value)
+        for key in removed:
+            self.index.remove(key)
+
+    def clusters(self, memories: Dict[str, str]) -> List[List[str]]:
+        """
+        把问题与解答都近似重复的记忆分组，只返回包含两条以上的组
+        每组以一条记忆为中心、只收与它直接相似的条目，不做传递闭包，避免 A≈B≈C 把不相干的 A、C 连到一起
+        """
+        if self.threshold <= 0:
+            return []
+        index = self.ensure_index(memories)
+        hasher = index.hasher
+        answers: Dict[str, Tuple[int, ...]] = {}
+
+        def answer_signature(key: str) -> Tuple[int, ...]:
+            if key not in answers:
+                answers[key] = hasher.signature(answer_of(memories[key]))
+            return answers[key]
+
+        assigned: Set[str] = set()
+        groups = []
+        for key in sorted(index.signatures):
+            if key in assigned:
+                continue
+            group = [key]
+            for other, _ in index.similar(key, self.threshold):
+                if other in assigned or other not in memories:
+                    continue
+                if hasher.similarity(answer_signature(key), answer_signature(other)) >= self.answer_threshold:
+                    group.append(other)
+            if len(group) > 1:
+                assigned.update(group)
+                groups.append(group)
+        return groups
+
+    def survivor(self, keys: List[str], now: float) -> str:
+        """一组近似重复中保留得分最高的条目，得分相同时保留最近使用的"""
+        return max(keys, key=lambda k: (self.usage.score(k, now, self.half_life), self.usage.get(k)[1]))
+
+    def eviction_candidates(self, memories: Dict[str, str], now: float, protect: Optional[str] = None) -> List[str]:
+        if self.max_memories <= 0 or len(memories) <= self.max_memories:
+            return []
+        excess = len(memories) - self.max_memories
+        keys = (key for key in memories if key != protect)
+        return heapq.nsmallest(excess, keys, key=lambda k: self.usage.score(k, now, self.half_life))
+
+    def stats(self) -> Dict:
+        return {"max_memories": self.max_memories, "merged": self.merged, "evicted": self.evicted,
+                "indexed": len(self.index) if self.index is not None else 0}
+
+    def close(self):
+        self.usage.close()
+
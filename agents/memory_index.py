@@ -0,0 +1,107 @@
+# memory_index.py - 记忆倒排索引：中英文分词 + BM25 排序
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# 英文/数字按单词切分，中日韩字符按连续片段切分后再做二元切分
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[぀-ヿ㐀-䶿一-鿿가-힯]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文/数字取整词，中文片段取二元组（单字片段保留单字）
+    不依赖第三方分词库，适合离线运行
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class MemoryIndex:
+    """
+    记忆条目的倒排索引，支持增量更新与 BM25 排序
+    查询只遍历命中词项的倒排表，不扫描全部记忆
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_df_ratio: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        # 出现在超过该比例文档中的词项（如“问题”“解答”）区分度极低，查询时跳过
+        self.max_df_ratio = max_df_ratio
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.total_len = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def build(self, memories: Dict[str, str]):
+        """根据现有记忆全量建立索引"""
+        self.postings.clear()
+        self.doc_terms.clear()
+        self.doc_len.clear()
+        self.total_len = 0
+        for key, value in memories.items():
+            self.add(key, value)
+
+    def add(self, key: str, value: str):
+        """添加或覆盖一条记忆"""
+        if key in self.doc_terms:
+            self.remove(key)
+        terms = Counter(tokenize(f"{key} {value}"))
+        length = sum(terms.values())
+        self.doc_terms[key] = terms
+        self.doc_len[key] = length
+        self.total_len += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[key] = tf
+
+    def remove(self, key: str):
+        """从索引中删除一条记忆"""
+        terms = self.doc_terms.pop(key, None)
+        if terms is None:
+            return
+        self.total_len -= self.doc_len.pop(key)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(key, None)
+            if not posting:
+                del self.postings[term]
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[str, float]]:
+        """返回按 BM25 得分排序的 (key, score) 列表"""
+        n_docs = len(self.doc_len)
+        if n_docs == 0 or top_k <= 0:
+            return []
+        postings = [self.postings[t] for t in set(tokenize(query)) if t in self.postings]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        max_df = max(1, int(n_docs * self.max_df_ratio))
+        selective = [p for p in postings if len(p) <= max_df]
+        # 若查询只包含高频词，则退化为使用最稀有的那一个
+        postings = selective or postings[:1]
+
+        doc_len = self.doc_len
+        base = self.k1 * (1 - self.b)
+        slope = self.k1 * self.b * n_docs / self.total_len
+        scores: Dict[str, float] = {}
+        for posting in postings:
+            df = len(posting)
+            weight = math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) * (self.k1 + 1)
+            for key, tf in posting.items():
+                scores[key] = scores.get(key, 0.0) + weight * tf / (tf + base + slope * doc_len[key])
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
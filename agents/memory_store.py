@@ -0,0 +1,714 @@
+# memory_store.py - 记忆存储后端：追加写日志 + 原子快照
+
+import atexit
+import glob
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import weakref
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Pattern, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，仅保留进程内互斥
+    fcntl = None
+
+
+def atomic_write_json(path: str, data, indent: Optional[int] = 2):
+    """先写临时文件并 fsync，再 os.replace 覆盖目标，保证读者只看到完整文件"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MemoryStore:
+    """记忆存储接口：load 返回的字典即为存储持有的内存视图"""
+
+    def __init__(self, memory_file: str):
+        self.memory_file = memory_file
+        self.memories: Dict[str, str] = {}
+
+    def load(self) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def snapshot(self):
+        """把当前全部记忆落盘为完整快照"""
+        raise NotImplementedError
+
+    def is_stale(self) -> bool:
+        """磁盘上是否有尚未应用到内存视图的写入（只做 stat，不读文件）"""
+        return False
+
+    def poll_changes(self) -> Optional[Set[str]]:
+        """
+        检查其他进程的写入并应用到内存视图，返回自上次调用以来变化（新增/覆盖/删除）的 key；
+        内存视图被整体重新加载时返回 None
+        """
+        return set()
+
+    def flush(self):
+        """确保已写入的条目持久化"""
+
+    def close(self):
+        self.flush()
+
+
+class JsonMemoryStore(MemoryStore):
+    """原始实现：每次写入都重写整个 JSON 文件"""
+
+    def __init__(self, memory_file: str):
+        super().__init__(memory_file)
+        self._mtime_ns: Optional[int] = None
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.memory_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> Dict[str, str]:
+        self._mtime_ns = self._file_mtime()
+        try:
+            with open(self.memory_file, 'r', encoding='utf-8') as f:
+                memories = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            memories = {}
+        # 原地更新，保持外部持有的 memories 引用有效
+        self.memories.clear()
+        self.memories.update(memories)
+        return self.memories
+
+    def is_stale(self) -> bool:
+        return self._file_mtime() != self._mtime_ns
+
+    def poll_changes(self) -> Optional[Set[str]]:
+        if not self.is_stale():
+            return set()
+        self.load()
+        return None
+
+    def set(self, key: str, value: str):
+        self.memories[key] = value
+        self.snapshot()
+
+    def delete(self, key: str):
+        if self.memories.pop(key, None) is not None:
+            self.snapshot()
+
+    def snapshot(self):
+        atomic_write_json(self.memory_file, self.memories)
+        self._mtime_ns = self._file_mtime()
+
+
+_open_stores = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_stores():
+    for store in list(_open_stores):
+        store.close()
+
+
+class JournalMemoryStore(MemoryStore):
+    """
+    快照 + 追加日志存储：
+    - 快照沿用 memory.json 格式，原子替换写入
+    - 每次写入只向 <memory_file>.journal 追加一行 JSON，成组 fsync
+    - 日志条目过多时由后台线程压缩为新快照
+    加载时读取快照后顺序重放日志；跨进程写入通过 <journal>.lock 上的 flock 串行化
+    内存视图只在 load/poll_changes/set/delete 中修改，后台压缩不会改动它
+    """
+
+    def __init__(self, memory_file: str, fsync_every: int = 32, fsync_interval: float = 1.0,
+                 compact_every: int = 1000):
+        super().__init__(memory_file)
+        self.journal_file = f"{memory_file}.journal"
+        self.lock_file = f"{self.journal_file}.lock"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+
+        self._lock = threading.RLock()
+        self._journal = None
+        self._snapshot_id: Optional[tuple] = None
+        self._journal_offset = 0      # 已应用到内存视图的日志字节位置
+        self._journal_entries = 0     # 当前日志中的条目数
+        self._changed: Set[str] = set()  # 上次 poll_changes 以来变化的 key
+        self._reloaded = False
+        self._pending_sync = 0
+        self._compact_requested = False
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        _open_stores.add(self)
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False):
+        """进程内 RLock + 跨进程 flock"""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def load(self) -> Dict[str, str]:
+        """读取快照并重放日志"""
+        with self._file_lock(shared=True):
+            self._reload()
+        return self.memories
+
+    def _reload(self):
+        try:
+            with open(self.memory_file, 'r', encoding='utf-8') as f:
+                memories = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            memories = {}
+        # 原地更新，保持外部持有的 memories 引用有效
+        self.memories.clear()
+        self.memories.update(memories)
+        self._changed.clear()
+        self._reloaded = True
+        self._snapshot_id = self._stat_snapshot()
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._replay()
+
+    def _stat_snapshot(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.memory_file)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _catch_up(self) -> int:
+        """
+        追上其他进程写入的条目；快照被替换过（其他进程做了压缩）则整体重新加载
+        返回 -1 表示发生了整体重载
+        """
+        if self._stat_snapshot() != self._snapshot_id:
+            self._reload()
+            return -1
+        return self._replay()
+
+    def _read_journal(self, offset: int):
+        """读取日志 offset 之后的完整条目，返回 (条目列表, 新的 offset)"""
+        records = []
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return records, offset
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 末尾不完整的行（写入中或崩溃残留），下次再读
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records, offset
+
+    def _replay(self) -> int:
+        """从上次位置起重放日志中的新条目，返回应用的条目数"""
+        records, self._journal_offset = self._read_journal(self._journal_offset)
+        for record in records:
+            self._apply(record)
+        self._journal_entries += len(records)
+        return len(records)
+
+    @staticmethod
+    def _apply_to(memories: Dict[str, str], record: Dict):
+        if record.get("op") == "del":
+            memories.pop(record["k"], None)
+        else:
+            memories[record["k"]] = record["v"]
+
+    def _apply(self, record: Dict):
+        self._apply_to(self.memories, record)
+        self._changed.add(record["k"])
+
+    def is_stale(self) -> bool:
+        """两次 stat：快照被替换或日志长度超过已读位置，说明有其他进程写入"""
+        if self._stat_snapshot() != self._snapshot_id:
+            return True
+        try:
+            return os.stat(self.journal_file).st_size != self._journal_offset
+        except FileNotFoundError:
+            return self._journal_offset != 0
+
+    def poll_changes(self) -> Optional[Set[str]]:
+        with self._lock:
+            if self.is_stale():
+                with self._file_lock(shared=True):
+                    self._catch_up()
+            if self._reloaded:
+                self._reloaded = False
+                self._changed.clear()
+                return None
+            changed, self._changed = self._changed, set()
+            return changed
+
+    def _open_journal(self):
+        """打开（或在被其他进程压缩替换后重新打开）日志文件"""
+        if self._journal is not None:
+            try:
+                if os.fstat(self._journal.fileno()).st_ino == os.stat(self.journal_file).st_ino:
+                    return self._journal
+            except FileNotFoundError:
+                pass
+            self._journal.close()
+        self._journal = open(self.journal_file, 'ab')
+        return self._journal
+
+    def _append(self, record: Dict):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with self._file_lock():
+            # 先追上其他进程写入的条目，保证内存视图与日志顺序一致
+            self._catch_up()
+            journal = self._open_journal()
+            journal.write(line)
+            journal.flush()
+            self._journal_offset = journal.tell()
+            self._journal_entries += 1
+            self._apply(record)
+            self._pending_sync += 1
+            if self._pending_sync >= self.fsync_every:
+                self._sync()
+            if self._journal_entries >= self.compact_every:
+                self._compact_requested = True
+        self._ensure_worker()
+
+    def set(self, key: str, value: str):
+        self._append({"op": "set", "k": key, "v": value})
+
+    def delete(self, key: str):
+        self._append({"op": "del", "k": key})
+
+    def _sync(self):
+        if self._journal is not None and self._pending_sync:
+            os.fsync(self._journal.fileno())
+            self._pending_sync = 0
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+
+    def _ensure_worker(self):
+        if self._worker is None and not self._closed:
+            self._worker = threading.Thread(target=self._run_worker, name="memory-journal", daemon=True)
+            self._worker.start()
+        if self._compact_requested:
+            self._wakeup.set()
+
+    def _run_worker(self):
+        """后台线程：定时成组 fsync，按需压缩日志"""
+        while not self._closed:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self._compact_requested:
+                    self.snapshot()
+            except OSError:
+                time.sleep(self.fsync_interval)
+
+    def snapshot(self):
+        """
+        压缩：把内存视图写成新快照，再把快照之后追加的日志尾部迁移到新日志
+        快照写入期间不持有锁，写入方只在首尾两次短暂加锁
+        """
+        with self._file_lock():
+            self._compact_requested = False
+            base_id = self._snapshot_id
+            if self._stat_snapshot() != base_id:
+                return  # 其他进程刚完成压缩，内存视图会在下次 poll_changes 时重新加载
+            # 在副本上追上日志，不改动内存视图（读者可能正在无锁访问）
+            data = dict(self.memories)
+            records, cut = self._read_journal(self._journal_offset)
+            for record in records:
+                self._apply_to(data, record)
+
+        tmp_snapshot = f"{self.memory_file}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_snapshot, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._file_lock():
+            if self._stat_snapshot() != base_id:
+                # 期间其他进程已完成压缩，放弃本次结果
+                os.remove(tmp_snapshot)
+                return
+            self._sync()
+            tail = b""
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(cut)
+                    tail = f.read()
+            os.replace(tmp_snapshot, self.memory_file)
+            tmp_journal = f"{self.journal_file}.tmp"
+            with open(tmp_journal, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_journal, self.journal_file)
+            self._journal_entries = tail.count(b"\n")
+            if self._journal_offset >= cut:
+                self._snapshot_id = self._stat_snapshot()
+                self._journal_offset -= cut
+            else:
+                # 内存视图落后于新快照，下次追赶时整体重新加载
+                self._snapshot_id = None
+                self._journal_offset = 0
+
+    def replace_all(self, data: Dict[str, str]):
+        """
+        用 data 整体替换全部条目：写入新快照并清空日志，内存视图随之替换（下次 poll_changes 返回 None）
+        调用方需保证期间没有其他写入者（例如持有更外层的锁）
+        """
+        with self._file_lock():
+            self._sync()
+            atomic_write_json(self.memory_file, data, indent=None)
+            tmp_journal = f"{self.journal_file}.tmp"
+            with open(tmp_journal, 'wb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_journal, self.journal_file)
+            self.memories.clear()
+            self.memories.update(data)
+            self._changed.clear()
+            self._reloaded = True
+            self._snapshot_id = self._stat_snapshot()
+            self._journal_offset = 0
+            self._journal_entries = 0
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.set()
+        # 等待后台线程完成进行中的压缩，避免遗留临时快照
+        if self._worker is not None and self._worker is not threading.current_thread():
+            self._worker.join()
+        with self._lock:
+            self._sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+class LazyValues(MutableMapping):
+    """CompactMemoryStore 的内存视图：迭代与成员判断只访问 key → 指针，取值时才从 mmap 解码"""
+
+    def __init__(self, store: "CompactMemoryStore"):
+        self.store = store
+
+    def __getitem__(self, key: str) -> str:
+        return self.store.read_value(key)
+
+    def __setitem__(self, key: str, value: str):
+        self.store.set(key, value)
+
+    def __delitem__(self, key: str):
+        if key not in self.store.pointers.memories:
+            raise KeyError(key)
+        self.store.delete(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.pointers.memories)
+
+    def __len__(self) -> int:
+        return len(self.store.pointers.memories)
+
+    def __contains__(self, key) -> bool:
+        return key in self.store.pointers.memories
+
+    def value_size(self, key: str) -> int:
+        """值的 UTF-8 字节数，不读取正文"""
+        return _parse_pointer(self.store.pointers.memories[key])[2]
+
+
+def _parse_pointer(pointer: str) -> Tuple[int, int, int]:
+    gen, offset, length = pointer.split(":")
+    return int(gen), int(offset), int(length)
+
+
+class CompactMemoryStore(MemoryStore):
+    """
+    紧凑存储：内存中只保存 key → "代号:偏移:长度" 指针（<memory_file>.keys，沿用快照 + 追加日志），
+    值的正文追加写入 <memory_file>.values.<代号>，读取时经 mmap 解码；启动只加载指针，与值的总大小无关
+    覆盖与删除留下的无效字节超过 compact_ratio 时，把存活的值拷贝到新代号的文件并整体替换指针，随后删除旧文件
+    值文件的追加与压缩由 <memory_file>.values.lock 串行化（先于指针日志的锁获取）
+    第一次打开时若只有旧格式的 memory.json（及其日志），会导入一次；旧文件保持不变
+    """
+
+    def __init__(self, memory_file: str, compact_ratio: float = 0.5, compact_min_bytes: int = 1 << 20,
+                 fsync_every: int = 32, check_every: int = 256):
+        super().__init__(memory_file)
+        self.pointers = JournalMemoryStore(f"{memory_file}.keys")
+        self.values_prefix = f"{memory_file}.values."
+        self.lock_file = f"{memory_file}.values.lock"
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.fsync_every = fsync_every
+        self.check_every = check_every
+        self.memories = LazyValues(self)
+        self._lock = threading.RLock()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._writer = None
+        self._writer_gen = 0
+        self._write_gen = 0
+        self._changed: Set[str] = set()
+        self._reloaded = False
+        self._pending_sync = 0
+        self._writes = 0
+        _open_stores.add(self)
+
+    @contextmanager
+    def _values_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _values_path(self, gen: int) -> str:
+        return f"{self.values_prefix}{gen}"
+
+    def _gens_on_disk(self) -> Set[int]:
+        gens = set()
+        for path in glob.glob(glob.escape(self.values_prefix) + "*"):
+            suffix = path[len(self.values_prefix):]
+            if suffix.isdigit():
+                gens.add(int(suffix))
+        return gens
+
+    def load(self) -> LazyValues:
+        with self._values_lock():
+            if not os.path.exists(self.pointers.memory_file) and not os.path.exists(self.pointers.journal_file):
+                self._import_legacy()
+            self.pointers.load()
+            self._on_reload()
+        return self.memories
+
+    def _import_legacy(self):
+        """把旧格式（memory.json 快照 + 日志）的全部条目写入新的值文件与指针快照"""
+        if not os.path.exists(self.memory_file) and not os.path.exists(f"{self.memory_file}.journal"):
+            return
+        legacy = JournalMemoryStore(self.memory_file)
+        try:
+            memories = legacy.load()
+            pointers = {}
+            with open(self._values_path(1), 'wb') as f:
+                for key, value in memories.items():
+                    data = value.encode('utf-8')
+                    pointers[key] = f"1:{f.tell()}:{len(data)}"
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.pointers.replace_all(pointers)
+        finally:
+            legacy.close()
+
+    def _on_reload(self):
+        """指针整体重新加载后：确定写入代号，丢弃不再被引用的映射，移除指向未落盘字节的指针"""
+        gens = self._gens_on_disk()
+        self._write_gen = max(gens) if gens else 1
+        referenced = set()
+        sizes = {gen: os.path.getsize(self._values_path(gen)) for gen in gens}
+        torn = []
+        for key, pointer in self.pointers.memories.items():
+            gen, offset, length = _parse_pointer(pointer)
+            if offset + length > sizes.get(gen, -1):
+                torn.append(key)  # 崩溃时值文件尚未落盘，而指针已写入
+            referenced.add(gen)
+        for key in torn:
+            self.pointers.memories.pop(key, None)
+        for gen in list(self._maps):
+            if gen not in referenced:
+                del self._maps[gen]
+        if self._writer is not None and self._writer_gen != self._write_gen:
+            self._writer.close()
+            self._writer = None
+
+    def _catch_up(self):
+        """应用其他进程的写入；变化的 key 累积到下次 poll_changes 返回"""
+        changed = self.pointers.poll_changes()
+        if changed is None:
+            self._on_reload()
+            self._reloaded = True
+            self._changed.clear()
+        else:
+            self._changed |= changed
+
+    def is_stale(self) -> bool:
+        return self.pointers.is_stale()
+
+    def poll_changes(self) -> Optional[Set[str]]:
+        with self._lock:
+            self._catch_up()
+            if self._reloaded:
+                self._reloaded = False
+                return None
+            changed, self._changed = self._changed, set()
+            return changed
+
+    def _read_bytes(self, pointer: str) -> bytes:
+        gen, offset, length = _parse_pointer(pointer)
+        if length == 0:
+            return b""
+        mm = self._maps.get(gen)
+        if mm is None or len(mm) < offset + length:
+            with self._lock:
+                mm = self._maps.get(gen)
+                if mm is None or len(mm) < offset + length:
+                    with open(self._values_path(gen), 'rb') as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    # 旧映射不主动关闭，正在读取它的线程不受影响
+                    self._maps[gen] = mm
+        return mm[offset:offset + length]
+
+    def read_value(self, key: str) -> str:
+        try:
+            return self._read_bytes(self.pointers.memories[key]).decode('utf-8')
+        except FileNotFoundError:
+            raise KeyError(key)  # 其他进程刚完成压缩，下次同步后可读
+
+    def _append_value(self, data: bytes) -> str:
+        """追加值的正文并返回指针（需持有值文件锁）"""
+        if self._writer is None:
+            self._writer = open(self._values_path(self._write_gen), 'ab')
+            self._writer_gen = self._write_gen
+        offset = self._writer.seek(0, os.SEEK_END)
+        self._writer.write(data)
+        self._writer.flush()
+        self._pending_sync += 1
+        if self._pending_sync >= self.fsync_every:
+            self._sync()
+        return f"{self._writer_gen}:{offset}:{len(data)}"
+
+    def _sync(self):
+        if self._writer is not None and self._pending_sync:
+            os.fsync(self._writer.fileno())
+            self._pending_sync = 0
+
+    def set(self, key: str, value: str):
+        with self._values_lock():
+            self._catch_up()
+            self.pointers.set(key, self._append_value(value.encode('utf-8')))
+            self._writes += 1
+            if self._writes % self.check_every == 0:
+                self._maybe_compact()
+
+    def delete(self, key: str):
+        with self._values_lock():
+            self.pointers.delete(key)
+
+    def garbage_ratio(self) -> Tuple[int, float]:
+        """(值文件总字节数, 其中无效字节所占比例)"""
+        total = sum(os.path.getsize(self._values_path(gen)) for gen in self._gens_on_disk())
+        live = sum(_parse_pointer(pointer)[2] for pointer in self.pointers.memories.values())
+        return total, (1.0 - live / total) if total else 0.0
+
+    def _maybe_compact(self):
+        total, ratio = self.garbage_ratio()
+        if total >= self.compact_min_bytes and ratio >= self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """把存活的值拷贝到新代号的值文件，整体替换指针后删除旧文件；本进程的索引不需要重建"""
+        with self._values_lock():
+            self._catch_up()
+            self._sync()
+            old_gens = self._gens_on_disk()
+            gen = max(old_gens | {self._write_gen}) + 1
+            path = self._values_path(gen)
+            pointers = {}
+            with open(f"{path}.tmp", 'wb') as f:
+                for key, pointer in self.pointers.memories.items():
+                    data = self._read_bytes(pointer)
+                    pointers[key] = f"{gen}:{f.tell()}:{len(data)}"
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{path}.tmp", path)
+            self.pointers.replace_all(pointers)
+            self.pointers.poll_changes()  # 条目内容没有变化，不向上层报告整体重载
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._maps.clear()
+            self._write_gen = gen
+            for old in old_gens:
+                try:
+                    os.remove(self._values_path(old))
+                except FileNotFoundError:
+                    pass
+
+    def snapshot(self):
+        """压缩值文件（无效字节足够多时）并把指针日志合并为快照"""
+        with self._lock:
+            total, ratio = self.garbage_ratio()
+            if total and ratio >= self.compact_ratio:
+                self.compact()
+            else:
+                self.flush()
+                self.pointers.snapshot()
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+        self.pointers.flush()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        self.pointers.close()
+
+
+def store_files_pattern(memory_file: str) -> Pattern:
+    """
+    匹配记忆库及其附属文件绝对路径的正则（供文件监听排除）：快照与 .journal/.journal.lock/临时文件，
+    同样结构的 .usage/.keys/.responses 存储，紧凑存储的 .values.<代号>/.values.lock，向量索引的 .vectors.*
+    """
+    base = re.escape(os.path.realpath(memory_file))
+    return re.compile(rf"{base}(?:\.(?:usage|keys|responses))?(?:\.journal(?:\.lock|\.tmp)?|\.tmp\.\d+\.\d+)?"
+                      rf"|{base}\.values\.(?:\d+|lock)|{base}\.vectors\.(?:f32|keys|lock)")
+
+
+def create_memory_store(memory_file: str) -> MemoryStore:
+    """按 MEMAGENT_MEMORY_STORE 选择记忆存储：journal（默认，memory.json 快照 + 日志）| compact | json"""
+    kind = os.environ.get("MEMAGENT_MEMORY_STORE", "journal")
+    if kind == "compact":
+        return CompactMemoryStore(memory_file)
+    if kind == "json":
+        return JsonMemoryStore(memory_file)
+    return JournalMemoryStore(memory_file)
@@ -0,0 +1,190 @@
+# prefetch.py - 工具结果预取：/next_step 得到模型的工具调用后立即在后台执行只读工具，/execute_tool 直接取用结果
+#
+# 环境变量：MEMAGENT_PREFETCH=1 启用；预取结果只在本进程内有效，多 worker 部署时落到其他进程的调用照常执行
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from agents.main_agent import get_tool_executor
+from agents.telemetry import telemetry
+from agents.tool_cache import CACHEABLE_TOOLS, path_fingerprint
+
+# 可预取的只读工具即带目标路径参数的可缓存工具；取用前用目标指纹确认结果没有过期
+PREFETCH_TOOLS = CACHEABLE_TOOLS
+# 用户输入与记忆中形如路径的片段：含 / 或扩展名的 ASCII 串
+_PATH_RE = re.compile(r"[A-Za-z0-9_./-]*[A-Za-z0-9_-](?:/|\.[A-Za-z0-9]{1,8})[A-Za-z0-9_./-]*")
+
+
+class _Prefetched:
+    __slots__ = ("created", "name", "arguments", "fingerprint", "future")
+
+    def __init__(self, name: str, arguments: str, fingerprint, future: Future):
+        self.created = time.monotonic()
+        self.name = name
+        self.arguments = arguments
+        self.fingerprint = fingerprint
+        self.future = future
+
+
+def _target(root_dir: str, name: str, arguments: Dict) -> str:
+    return os.path.normpath(os.path.join(root_dir, arguments.get(PREFETCH_TOOLS[name]) or ""))
+
+
+def mentioned_paths(root_dir: str, texts: Iterable[str], limit: int = 8) -> List[Tuple[str, bool]]:
+    """从文本中提取位于 root_dir 内且存在的路径，返回 [(相对路径, 是否目录)]，按出现顺序去重"""
+    root = os.path.realpath(root_dir)
+    found: List[Tuple[str, bool]] = []
+    seen = set()
+    for text in texts:
+        for token in _PATH_RE.findall(text or ""):
+            rel = os.path.normpath(token.rstrip("."))  # 去掉句末的句点
+            if rel == "." or rel in seen:
+                continue
+            seen.add(rel)
+            path = os.path.realpath(os.path.join(root, rel))
+            if path != root and not path.startswith(root + os.sep):
+                continue
+            if os.path.isfile(path) or os.path.isdir(path):
+                found.append((rel, os.path.isdir(path)))
+                if len(found) >= limit:
+                    return found
+    return found
+
+
+class ToolPrefetcher:
+    """
+    进程内共享的预取表，键为 (会话ID, tool_call_id)：
+    - schedule 在共享工具线程池中提交只读工具调用，与浏览器往返并行执行
+    - take 取用结果：名称与参数一致、目标指纹未变才返回，否则返回 None 由调用方照常执行
+    未被取用的条目超过 ttl 秒或数量超过 max_entries 时丢弃
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 120.0, warm_limit: int = 8):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.warm_limit = warm_limit
+        self.scheduled = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.warmed = 0
+        self._entries: "OrderedDict[Tuple[str, str], _Prefetched]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _submit(self, func, *args) -> Future:
+        # 复制 contextvars 上下文，预取线程中的 span 仍归属当前会话的 trace
+        return get_tool_executor().submit(contextvars.copy_context().run, func, *args)
+
+    def _expire(self, now: float):
+        """丢弃过期与超出数量的条目（需持有锁）"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - entry.created <= self.ttl:
+                break
+            del self._entries[key]
+            entry.future.cancel()
+
+    def schedule(self, session_id: str, main_agent, tool_calls: List[Dict]) -> int:
+        """提交一轮中可预取的调用，返回提交的数量"""
+        count = 0
+        for call in tool_calls:
+            name = call["function"]["name"]
+            if name not in PREFETCH_TOOLS or not call.get("id"):
+                continue
+            raw = call["function"].get("arguments") or "{}"
+            try:
+                arguments = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            fingerprint = path_fingerprint(_target(main_agent.root_dir, name, arguments))
+            future = self._submit(main_agent.execute_tool_call, name, arguments)
+            with self._lock:
+                old = self._entries.pop((session_id, call["id"]), None)
+                if old is not None:
+                    old.future.cancel()
+                self._entries[(session_id, call["id"])] = _Prefetched(name, raw, fingerprint, future)
+                self._expire(time.monotonic())
+                self.scheduled += 1
+            count += 1
+        return count
+
+    def take(self, session_id: str, call: Dict, main_agent, timeout: float) -> Optional[Dict]:
+        """取出预取结果；仍在执行时最多等待 timeout 秒（超时即返回超时错误，与直接执行一致）"""
+        with self._lock:
+            entry = self._entries.pop((session_id, call.get("id")), None)
+        outcome, result = self._resolve(entry, call, main_agent, timeout)
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "stale":
+                self.stale += 1
+            else:
+                self.misses += 1
+        telemetry.inc("tool_prefetch_total", outcome=outcome)
+        return result
+
+    @staticmethod
+    def _resolve(entry: Optional[_Prefetched], call: Dict, main_agent,
+                 timeout: float) -> Tuple[str, Optional[Dict]]:
+        if entry is None:
+            return "miss", None
+        name = call["function"]["name"]
+        if entry.name != name or entry.arguments != (call["function"].get("arguments") or "{}"):
+            entry.future.cancel()
+            return "miss", None
+        try:
+            result = entry.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return "hit", {"error": f"工具执行超时（{timeout:g}s）"}
+        except Exception:  # 已取消或执行异常，交由调用方重新执行
+            return "miss", None
+        if path_fingerprint(_target(main_agent.root_dir, name, json.loads(entry.arguments))) != entry.fingerprint:
+            return "stale", None
+        return "hit", result
+
+    def take_all(self, session_id: str, tool_calls: List[Dict], main_agent) -> List[Optional[Dict]]:
+        return [self.take(session_id, call, main_agent, main_agent.tool_timeout) for call in tool_calls]
+
+    def warm(self, main_agent, texts: Iterable[str]) -> int:
+        """
+        用户输入或注入的记忆中提到的文件/目录：后台以默认参数执行 read_file/list_files，
+        结果写入共享工具缓存，模型随后发起相同调用时直接命中；未启用工具缓存时不预热
+        """
+        if main_agent.tool_cache is None:
+            return 0
+        paths = mentioned_paths(main_agent.root_dir, texts, self.warm_limit)
+        for rel, is_dir in paths:
+            if is_dir:
+                self._submit(main_agent.execute_tool_call, "list_files", {"path": rel})
+            else:
+                self._submit(main_agent.execute_tool_call, "read_file", {"file_path": rel})
+        with self._lock:
+            self.warmed += len(paths)
+        return len(paths)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"pending": len(self._entries), "scheduled": self.scheduled, "hits": self.hits,
+                    "misses": self.misses, "stale": self.stale, "warmed": self.warmed}
+
+
+_shared_prefetcher: Optional[ToolPrefetcher] = None
+_shared_prefetcher_lock = threading.Lock()
+
+
+def get_shared_prefetcher() -> Optional[ToolPrefetcher]:
+    """MEMAGENT_PREFETCH 未设置时返回 None（不预取）"""
+    global _shared_prefetcher
+    if not os.environ.get("MEMAGENT_PREFETCH"):
+        return None
+    with _shared_prefetcher_lock:
+        if _shared_prefetcher is None:
+            _shared_prefetcher = ToolPrefetcher()
+        return _shared_prefetcher
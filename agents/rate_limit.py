@@ -0,0 +1,72 @@
+# rate_limit.py - 按模型端点限流：令牌桶，同步客户端阻塞等待，异步客户端 await 等待
+#
+# 环境变量：MEMAGENT_LLM_RATE_LIMITS="https://api.a.com/v1=5,https://api.b.com/v1=0.5"（每秒请求数）
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+
+class RateLimiter:
+    """线程安全的令牌桶：平均每秒 rate 个请求，允许 burst 个突发"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def reserve(self) -> float:
+        """预订一个请求额度，返回调用方还需等待的秒数（令牌可透支，等待结束即轮到该请求）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            self.waited += wait
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+_env_loaded = False
+
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """解析 "URL=每秒请求数,URL=每秒请求数"；URL 本身可能含 =，按最后一个 = 切分"""
+    limits = {}
+    for item in spec.split(","):
+        url, _, rate = item.strip().rpartition("=")
+        if url and rate:
+            limits[url.rstrip('/')] = float(rate)
+    return limits
+
+
+def set_endpoint_rate(base_url: str, rate: float, burst: Optional[float] = None) -> RateLimiter:
+    """为端点设置（或替换）限流；此后新建的指向该端点的客户端都会共享这个令牌桶"""
+    limiter = RateLimiter(rate, burst)
+    with _limiters_lock:
+        _limiters[base_url.rstrip('/')] = limiter
+    return limiter
+
+
+def get_endpoint_limiter(base_url: str) -> Optional[RateLimiter]:
+    """端点的共享令牌桶；未配置限流时返回 None"""
+    global _env_loaded
+    with _limiters_lock:
+        if not _env_loaded:
+            _env_loaded = True
+            for url, rate in parse_rate_limits(os.environ.get("MEMAGENT_LLM_RATE_LIMITS", "")).items():
+                _limiters.setdefault(url, RateLimiter(rate))
+        return _limiters.get(base_url.rstrip('/'))
@@ -0,0 +1,198 @@
+# response_cache.py - 语义响应缓存：相同或相近的问题、且回答所依赖的文件未变化时，直接返回历史回答
+
+import json
+import os
+import re
+import stat
+import threading
+import time
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+
+from agents.memory_index import MemoryIndex, tokenize
+from agents.memory_store import JournalMemoryStore, MemoryStore
+
+_SPACE_RE = re.compile(r"\s+")
+# 问题中的路径、文件名、数字等"锚点"：近似匹配时必须完全一致（llm_client.py 与 async_llm_client.py 不是同一个问题）
+_ANCHOR_RE = re.compile(r"[\w./\\-]*[\d./\\][\w./\\-]*")
+
+
+def normalize_question(text: str) -> str:
+    """全角转半角、小写、标点替换为空格并合并空白，作为精确匹配的键"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = "".join(" " if unicodedata.category(c)[0] in "PSZ" else c for c in text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def anchors(text: str) -> set:
+    return {token.strip(".").lower() for token in _ANCHOR_RE.findall(text or "") if token.strip(".")}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """
+    以规范化问题为键保存 {问题, 回答, 依赖路径指纹}，存于 <memory_file>.responses（快照 + 追加日志，多进程共享）
+    默认只接受规范化后完全相同的问题；threshold < 1 时再用倒排索引取候选，分词集合的 Jaccard 相似度
+    达到 threshold 且路径/数字等锚点完全一致才算命中
+    命中的条目还要校验依赖路径的指纹全部未变、且未超过 ttl 秒，已失效的条目顺带删除；
+    没有读取任何文件的回答无从校验是否过期，不写入缓存
+    文件指纹为 (inode, mtime_ns, size)；目录指纹为条目名列表的 CRC（不含记忆文件自身，避免写记忆导致失效）
+    """
+
+    def __init__(self, memory_file: str, threshold: float = 1.0, candidates: int = 5,
+                 store: Optional[MemoryStore] = None, ttl: float = 86400.0):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.candidates = candidates
+        self.store = store or JournalMemoryStore(f"{memory_file}.responses")
+        self._own_prefix = os.path.basename(memory_file)
+        self.entries = self.store.load()
+        self.index = MemoryIndex()
+        for key in self.entries:
+            self.index.add(key, "")
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        # 依赖路径 -> 条目键（及其反向），首次收到文件变更批次时才建立
+        self._by_source: Optional[Dict[str, Set[str]]] = None
+        self._sources_of: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        """同步其他进程写入的条目到问题索引"""
+        changed = self.store.poll_changes()
+        if changed is None:
+            self.index.build({key: "" for key in self.entries})
+            self._by_source = None
+            return
+        for key in changed:
+            if key in self.entries:
+                self.index.add(key, "")
+            else:
+                self.index.remove(key)
+            if self._by_source is not None:
+                self._index_sources(key)
+
+    def _index_sources(self, key: str):
+        for path in self._sources_of.pop(key, ()):
+            keys = self._by_source.get(path)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_source[path]
+        value = self.entries.get(key)
+        if value is not None:
+            paths = self._sources_of[key] = list(json.loads(value)["sources"])
+            for path in paths:
+                self._by_source.setdefault(path, set()).add(key)
+
+    def fingerprint(self, path: str) -> Optional[List]:
+        """路径不存在时返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if stat.S_ISDIR(st.st_mode):
+            try:
+                names = sorted(n for n in os.listdir(path) if not n.startswith(self._own_prefix))
+            except OSError:
+                return None
+            return ["dir", zlib.crc32("\0".join(names).encode('utf-8', 'surrogateescape'))]
+        return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+    def record(self, question: str, answer: str, sources: List[str]):
+        """记录回答及其依赖路径的当前指纹"""
+        key = normalize_question(question)
+        if not key or not answer or not sources:
+            return
+        value = json.dumps({
+            "question": question,
+            "answer": answer,
+            "sources": {path: self.fingerprint(path) for path in sources},
+            "created": time.time()
+        }, ensure_ascii=False)
+        with self._lock:
+            self.store.set(key, value)
+            self._sync()
+
+    def _fresh(self, entry: Dict) -> bool:
+        if not entry["sources"] or time.time() - entry.get("created", 0) > self.ttl:
+            return False
+        return all(self.fingerprint(path) == fp for path, fp in entry["sources"].items())
+
+    def _candidates(self, key: str) -> List[Tuple[str, float]]:
+        if key in self.entries:
+            return [(key, 1.0)]
+        if self.threshold >= 1.0:
+            return []
+        query_terms = set(tokenize(key))
+        scored = []
+        for candidate, _ in self.index.search(key, self.candidates):
+            score = jaccard(query_terms, set(tokenize(candidate)))
+            if score >= self.threshold:
+                scored.append((candidate, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored
+
+    def lookup(self, question: str) -> Optional[Dict]:
+        """返回 {"question", "answer", "similarity", "latency_ms"}；未命中返回 None"""
+        t0 = time.perf_counter()
+        key = normalize_question(question)
+        with self._lock:
+            self._sync()
+            for candidate, score in self._candidates(key) if key else []:
+                entry = json.loads(self.entries[candidate])
+                if score < 1.0 and anchors(entry["question"]) != anchors(question):
+                    continue
+                if not self._fresh(entry):
+                    self.store.delete(candidate)
+                    self._sync()
+                    self.invalidated += 1
+                    continue
+                self.hits += 1
+                return {
+                    "question": entry["question"],
+                    "answer": entry["answer"],
+                    "similarity": round(score, 4),
+                    "latency_ms": round((time.perf_counter() - t0) * 1000, 3)
+                }
+            self.misses += 1
+        return None
+
+    def apply_changes(self, changes):
+        """文件监听（agents.fs_watcher）的变更批次：依赖这些路径且指纹确已变化的条目立即删除，不必等到下次命中时才校验"""
+        paths = [changes.abs_path(p) for p in changes.files | changes.dirs | changes.removed_dirs]
+        prefixes = tuple(changes.abs_path(d) + os.sep for d in changes.removed_dirs)
+        with self._lock:
+            self._sync()
+            if self._by_source is None:
+                self._by_source, self._sources_of = {}, {}
+                for key in self.entries:
+                    self._index_sources(key)
+            if changes.overflow:
+                keys = set(self.entries)
+            else:
+                keys = set()
+                for path in paths:
+                    keys |= self._by_source.get(path, set())
+                if prefixes:
+                    for path, owners in self._by_source.items():
+                        if path.startswith(prefixes):
+                            keys |= owners
+            for key in keys:
+                value = self.entries.get(key)
+                if value is not None and not self._fresh(json.loads(value)):
+                    self.store.delete(key)
+                    self.invalidated += 1
+            self._sync()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "invalidated": self.invalidated}
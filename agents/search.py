@@ -0,0 +1,188 @@
+# search.py - 跨文件关键词/正则搜索：流式扫描、进程池并行、达到上限即停止
+
+import fnmatch
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern
+
+from agents.gitignore import walk_files
+
+# 文件数超过该阈值后，剩余文件交给进程池并行扫描
+PARALLEL_THRESHOLD = 2000
+BATCH_SIZE = 256
+MAX_LINE_CHARS = 200
+_BINARY_SNIFF = 8192
+PROCESS_WORKERS = os.cpu_count() or 2
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    服务端是多线程进程（持有锁、sqlite 连接、监听线程），直接 fork 可能在子进程中继承被其他线程持有的锁；
+    改用 forkserver（不支持时用 spawn）启动工作进程
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS,
+                                                mp_context=multiprocessing.get_context(method))
+        return _process_pool
+
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """进程池损坏（工作进程被杀、启动失败）后丢弃，下次 get_process_pool 重新创建"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def compile_pattern(pattern: str, regex: bool = False, ignore_case: bool = False) -> Pattern:
+    if not pattern:
+        raise ValueError("搜索内容不能为空")
+    flags = re.IGNORECASE if ignore_case else 0
+    return re.compile(pattern if regex else re.escape(pattern), flags)
+
+
+def _clip_line(line: str, start: int, end: int) -> str:
+    """过长的行只保留匹配附近 MAX_LINE_CHARS 个字符"""
+    if len(line) <= MAX_LINE_CHARS:
+        return line
+    half = max(0, (MAX_LINE_CHARS - (end - start)) // 2)
+    left = max(0, start - half)
+    return ("…" if left else "") + line[left:left + MAX_LINE_CHARS] + "…"
+
+
+def search_file(path: str, rel_path: str, compiled: Pattern, limit: int) -> Iterator[Dict]:
+    """
+    逐行流式扫描单个文件（底层按缓冲块读取，不整体载入内存），产出匹配
+    含 NUL 字节的文件视为二进制跳过
+    """
+    try:
+        with open(path, 'rb') as fb:
+            if b"\0" in fb.read(_BINARY_SNIFF):
+                return
+        f = open(path, 'r', encoding='utf-8', errors='replace', newline='')
+    except OSError:
+        return
+    found = 0
+    with f:
+        for line_no, line in enumerate(f, 1):
+            m = compiled.search(line)
+            if m is None:
+                continue
+            line = line.rstrip("\r\n")
+            yield {
+                "file": rel_path,
+                "line": line_no,
+                "column": m.start() + 1,
+                "text": _clip_line(line, m.start(), m.end())
+            }
+            found += 1
+            if found >= limit:
+                return
+
+
+def _search_batch(root: str, rel_paths: List[str], pattern: str, flags: int, limit: int) -> List[Dict]:
+    """进程池任务：扫描一批文件，最多返回 limit 条"""
+    compiled = re.compile(pattern, flags)
+    results = []
+    for rel_path in rel_paths:
+        for match in search_file(os.path.join(root, rel_path), rel_path, compiled, limit - len(results)):
+            results.append(match)
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _batches(iterable: Iterable[str], size: int) -> Iterator[List[str]]:
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def search_tree(root: str, pattern: str, sub_path: str = "", regex: bool = False, ignore_case: bool = False,
+                glob: Optional[str] = None, max_results: int = 50, stats: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    在 root/sub_path 下递归搜索（遵循 .gitignore），按遍历顺序产出匹配，满 max_results 条即停止
+    前 PARALLEL_THRESHOLD 个文件在当前进程扫描；树更大时剩余文件分批提交到进程池，
+    保持有限的在途批次，结果仍按文件顺序产出；进程池损坏时丢弃它，本次查询剩余的文件改在当前进程扫描
+    stats 若传入，会写入 files_scanned
+    """
+    compiled = compile_pattern(pattern, regex, ignore_case)
+    stats = stats if stats is not None else {}
+    stats["files_scanned"] = 0
+
+    def candidates() -> Iterator[str]:
+        for rel_path, entry in walk_files(root, sub_path):
+            if glob and not fnmatch.fnmatch(entry.name, glob):
+                continue
+            yield rel_path
+
+    files = candidates()
+    remaining = max_results
+    for rel_path in islice(files, PARALLEL_THRESHOLD):
+        stats["files_scanned"] += 1
+        for match in search_file(os.path.join(root, rel_path), rel_path, compiled, remaining):
+            yield match
+            remaining -= 1
+            if remaining <= 0:
+                return
+
+    pool = get_process_pool()
+    in_flight = []
+    batches = _batches(files, BATCH_SIZE)
+    max_in_flight = 2 * PROCESS_WORKERS
+    unscanned: List[str] = []  # 进程池损坏时尚未产出结果的文件，按原顺序改为串行扫描
+    try:
+        while True:
+            while len(in_flight) < max_in_flight:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                try:
+                    future = pool.submit(_search_batch, root, batch, compiled.pattern, compiled.flags, remaining)
+                except BrokenProcessPool:
+                    unscanned = batch
+                    break
+                in_flight.append((future, batch))
+            if not in_flight and not unscanned:
+                return
+            if unscanned:
+                raise BrokenProcessPool
+            future, batch = in_flight[0]
+            results = future.result()
+            in_flight.pop(0)
+            stats["files_scanned"] += len(batch)
+            for match in results:
+                yield match
+                remaining -= 1
+                if remaining <= 0:
+                    return
+    except BrokenProcessPool:
+        discard_process_pool(pool)
+        unscanned = [path for _, batch in in_flight for path in batch] + unscanned
+        in_flight = []
+    finally:
+        for future, _ in in_flight:
+            future.cancel()
+
+    for rel_path in chain(unscanned, files):
+        stats["files_scanned"] += 1
+        for match in search_file(os.path.join(root, rel_path), rel_path, compiled, remaining):
+            yield match
+            remaining -= 1
+            if remaining <= 0:
+                return
@@ -0,0 +1,294 @@
+# session_store.py - 会话存储：容量/空闲时间/字节预算淘汰，支持内存与 SQLite 后端
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# factory(work_dir, llm_config) -> {"main_agent": ..., "memory_agent": ..., "context_agent": ...}
+AgentFactory = Callable[[str, Optional[Dict]], Dict]
+
+
+def estimate_messages_bytes(messages: List[Dict]) -> int:
+    """粗略估算消息历史占用的字节数（只统计文本与工具调用参数）"""
+    total = 0
+    for m in messages:
+        total += 64 + len(m.get("content") or "") * 3
+        for call in m.get("tool_calls") or []:
+            total += 64 + len(call.get("function", {}).get("arguments") or "")
+    return total
+
+
+class SessionStore:
+    """
+    会话存储接口。get/create 返回的会话字典包含各代理实例与 "messages"；
+    修改 messages 后需调用 save 持久化（内存后端中为原地修改，save 只更新统计）
+    """
+
+    def __init__(self, factory: AgentFactory, max_sessions: int = 1000, idle_ttl: float = 3600.0,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def create(self, session_id: str, work_dir: str = ".", llm_config: Optional[Dict] = None) -> Dict:
+        """获取会话，不存在或配置变化时新建（保留原有消息历史）"""
+        raise NotImplementedError
+
+    def save(self, session_id: str, session: Dict):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def stats(self) -> Dict:
+        raise NotImplementedError
+
+    def _build(self, work_dir: str, llm_config: Optional[Dict], messages: List[Dict]) -> Dict:
+        session = dict(self.factory(work_dir, llm_config))
+        session.update({"work_dir": work_dir, "llm_config": llm_config, "messages": messages})
+        return session
+
+
+class InMemorySessionStore(SessionStore):
+    """进程内 LRU 会话存储"""
+
+    def __init__(self, factory: AgentFactory, **kwargs):
+        super().__init__(factory, **kwargs)
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._meta: Dict[str, Dict] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                self._meta[session_id]["accessed"] = time.monotonic()
+            return session
+
+    def create(self, session_id: str, work_dir: str = ".", llm_config: Optional[Dict] = None) -> Dict:
+        with self._lock:
+            session = self.get(session_id)
+            if session is not None and session["work_dir"] == work_dir and session["llm_config"] == llm_config:
+                return session
+            messages = session["messages"] if session is not None else []
+            session = self._build(work_dir, llm_config, messages)
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self.save(session_id, session)
+            return session
+
+    def save(self, session_id: str, session: Dict):
+        with self._lock:
+            if session_id not in self._sessions:
+                # 会话已被淘汰（如 /stream_chat 结束或迟到的 /execute_tool），不再为它记账，否则字节数只增不减
+                return
+            size = estimate_messages_bytes(session["messages"])
+            self._sessions.move_to_end(session_id)
+            meta = self._meta.setdefault(session_id, {"size": 0})
+            self._bytes += size - meta["size"]
+            meta.update(size=size, accessed=time.monotonic())
+            self._evict(keep=session_id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            meta = self._meta.pop(session_id, None)
+            if meta is not None:
+                self._bytes -= meta["size"]
+
+    def _evict(self, keep: Optional[str] = None):
+        """依次淘汰：空闲超时的会话；超出数量或字节预算时最久未访问的会话"""
+        now = time.monotonic()
+        for session_id in list(self._sessions):
+            if now - self._meta[session_id]["accessed"] <= self.idle_ttl:
+                break  # OrderedDict 按访问顺序排列，后面的都更新
+            if session_id != keep:
+                self.delete(session_id)
+                self.evictions += 1
+        while (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes) and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self.delete(oldest)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._sessions), "bytes": self._bytes,
+                    "evictions": self.evictions}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite 会话存储：会话配置与消息历史存于数据库，可被多个 worker 进程共享
+    代理实例不可序列化，每个进程按会话配置缓存一份（数量受 agent_cache_size 限制），
+    消息历史每次请求都从数据库读取
+    llm_config 中的 api_key 不落盘：客户端提供的 key 只保存在创建会话的进程内存中，
+    读取时优先用它，否则使用服务端配置的 MEMAGENT_LLM_API_KEY（多 worker 部署时由其他进程接手的会话依赖这一项）
+    """
+
+    def __init__(self, factory: AgentFactory, db_path: str = "sessions.db", agent_cache_size: int = 64, **kwargs):
+        super().__init__(factory, **kwargs)
+        self.db_path = db_path
+        self.agent_cache_size = agent_cache_size
+        self._agents: "OrderedDict[str, tuple]" = OrderedDict()
+        self._api_keys: "OrderedDict[str, str]" = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        db = self._db()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                work_dir TEXT NOT NULL,
+                llm_config TEXT,
+                messages TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+        """)
+        # 清除旧版本写入的明文 API Key；数据库中仍有会话内容，仅允许当前用户读写
+        with db:
+            db.execute("UPDATE sessions SET llm_config = json_remove(llm_config, '$.api_key') "
+                       "WHERE llm_config IS NOT NULL AND json_extract(llm_config, '$.api_key') IS NOT NULL")
+        os.chmod(db_path, 0o600)
+
+    def _db(self) -> sqlite3.Connection:
+        """每个线程一个连接；WAL 模式允许多进程并发读写"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _agents_for(self, session_id: str, work_dir: str, llm_config: Optional[Dict]) -> Dict:
+        signature = (work_dir, json.dumps(llm_config, sort_keys=True))
+        with self._lock:
+            cached = self._agents.get(session_id)
+            if cached is not None and cached[0] == signature:
+                self._agents.move_to_end(session_id)
+                return cached[1]
+            agents = self.factory(work_dir, llm_config)
+            self._agents[session_id] = (signature, agents)
+            while len(self._agents) > self.agent_cache_size:
+                self._agents.popitem(last=False)
+            return agents
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        db = self._db()
+        row = db.execute("SELECT work_dir, llm_config, messages, updated FROM sessions WHERE id = ?",
+                         (session_id,)).fetchone()
+        if row is None:
+            with self._lock:
+                self._api_keys.pop(session_id, None)
+            return None
+        work_dir, llm_config, messages, updated = row
+        if time.time() - updated > self.idle_ttl:
+            self.delete(session_id)
+            self.evictions += 1
+            return None
+        with db:
+            db.execute("UPDATE sessions SET updated = ? WHERE id = ?", (time.time(), session_id))
+        llm_config = self._with_api_key(session_id, json.loads(llm_config)) if llm_config else None
+        session = dict(self._agents_for(session_id, work_dir, llm_config))
+        session.update({"work_dir": work_dir, "llm_config": llm_config, "messages": json.loads(messages)})
+        return session
+
+    def create(self, session_id: str, work_dir: str = ".", llm_config: Optional[Dict] = None) -> Dict:
+        existing = self.get(session_id)
+        messages = existing["messages"] if existing is not None else []
+        session = dict(self._agents_for(session_id, work_dir, llm_config))
+        session.update({"work_dir": work_dir, "llm_config": llm_config, "messages": messages})
+        self.save(session_id, session)
+        return session
+
+    def _with_api_key(self, session_id: str, llm_config: Dict) -> Dict:
+        with self._lock:
+            api_key = self._api_keys.get(session_id)
+        api_key = api_key or os.environ.get("MEMAGENT_LLM_API_KEY")
+        if api_key:
+            llm_config["api_key"] = api_key
+        return llm_config
+
+    def _without_api_key(self, session_id: str, llm_config: Optional[Dict]) -> Optional[str]:
+        """写入数据库的 llm_config：去掉 api_key，客户端提供的 key 留在进程内（数量同样受 max_sessions 限制）"""
+        if not llm_config:
+            return None
+        llm_config = dict(llm_config)
+        api_key = llm_config.pop("api_key", None)
+        if api_key and api_key != os.environ.get("MEMAGENT_LLM_API_KEY"):
+            with self._lock:
+                self._api_keys[session_id] = api_key
+                self._api_keys.move_to_end(session_id)
+                while len(self._api_keys) > self.max_sessions:
+                    self._api_keys.popitem(last=False)
+        return json.dumps(llm_config, ensure_ascii=False)
+
+    def save(self, session_id: str, session: Dict):
+        messages = json.dumps(session["messages"], ensure_ascii=False)
+        llm_config = self._without_api_key(session_id, session["llm_config"])
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (id, work_dir, llm_config, messages, size, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, session["work_dir"], llm_config, messages, len(messages.encode('utf-8')), time.time()))
+            self._evict(db, session_id)
+
+    def _evict(self, db: sqlite3.Connection, keep: str):
+        """删除空闲超时的会话，以及超出数量或字节预算的最久未用会话"""
+        now = time.time()
+        removed = db.execute("DELETE FROM sessions WHERE updated < ? AND id != ?", (now - self.idle_ttl, keep)).rowcount
+        removed += db.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE id != ? "
+            "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (keep, max(0, self.max_sessions - 1))).rowcount
+        removed += db.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM (SELECT id, SUM(size) OVER "
+            "(ORDER BY id = ? DESC, updated DESC) AS running FROM sessions) WHERE running > ? AND id != ?)",
+            (keep, self.max_bytes, keep)).rowcount
+        self.evictions += removed
+
+    def delete(self, session_id: str):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        with self._lock:
+            self._agents.pop(session_id, None)
+            self._api_keys.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        count, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        return {"backend": "sqlite", "sessions": count, "bytes": total, "evictions": self.evictions,
+                "cached_agents": len(self._agents)}
+
+
+def create_session_store(factory: AgentFactory) -> SessionStore:
+    """按环境变量创建会话存储：MEMAGENT_SESSION_BACKEND=memory|sqlite"""
+    kwargs = {
+        "max_sessions": int(os.environ.get("MEMAGENT_MAX_SESSIONS", 1000)),
+        "idle_ttl": float(os.environ.get("MEMAGENT_SESSION_TTL", 3600)),
+        "max_bytes": int(os.environ.get("MEMAGENT_SESSION_MAX_BYTES", 256 * 1024 * 1024)),
+    }
+    backend = os.environ.get("MEMAGENT_SESSION_BACKEND", "memory")
+    if backend == "sqlite":
+        return SQLiteSessionStore(factory, db_path=os.environ.get("MEMAGENT_SESSION_DB", "sessions.db"), **kwargs)
+    if backend != "memory":
+        raise ValueError(f"未知会话存储后端: {backend}")
+    return InMemorySessionStore(factory, **kwargs)
@@ -0,0 +1,249 @@
+# telemetry.py - 轻量埋点：计时 span、计数器与直方图，导出 Prometheus 文本格式，可选写入 JSONL 追踪日志
+#
+# 环境变量：MEMAGENT_METRICS=0 关闭全部埋点（span 退化为共享的空对象）；
+#           MEMAGENT_TRACE_LOG=traces.jsonl 把每个结束的 span 追加为一行 JSON
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 秒；覆盖从内存检索（亚毫秒）到慢速模型调用（数十秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 当前请求所属会话的 (trace_id, session_id)；线程池与 asyncio 任务需通过 contextvars 传递
+_current_trace: ContextVar[Optional[Tuple[str, str]]] = ContextVar("memagent_trace", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def trace_id_for(session_id: str) -> str:
+    """由会话 ID 派生的追踪 ID：多个 worker 进程对同一会话得到相同的值，无需额外存储"""
+    return hashlib.blake2b(session_id.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def bind_trace(session_id: Optional[str]) -> Token:
+    """把后续 span 归属到该会话（None 表示不属于任何会话）；返回的 token 交给 unbind_trace 恢复"""
+    return _current_trace.set((trace_id_for(session_id), session_id) if session_id else None)
+
+
+def unbind_trace(token: Token):
+    _current_trace.reset(token)
+
+
+@contextmanager
+def trace(session_id: str) -> Iterator[str]:
+    token = bind_trace(session_id)
+    try:
+        yield _current_trace.get()[0]
+    finally:
+        unbind_trace(token)
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current_trace.get()
+    return current[0] if current else None
+
+
+def _label_key(labels: Dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Span:
+    """计时区间：退出时记录 memagent_<name>_seconds 直方图，异常时累加 memagent_<name>_errors_total"""
+    __slots__ = ("telemetry", "name", "labels", "attrs", "start", "wall_start")
+
+    def __init__(self, telemetry: "Telemetry", name: str, labels: Dict):
+        self.telemetry = telemetry
+        self.name = name
+        self.labels = labels
+        self.attrs: Dict = {}
+
+    def set(self, **attrs):
+        """附加只写入追踪日志的属性（如字节数、命中与否），不作为指标标签"""
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        # 生成器提前关闭（GeneratorExit）等非 Exception 不计为错误
+        error = exc if exc_type is not None and issubclass(exc_type, Exception) else None
+        self.telemetry._finish(self, time.perf_counter() - self.start, error)
+        return False
+
+
+class _NoopSpan:
+    """埋点关闭时使用的共享空 span"""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Telemetry:
+    """
+    进程内指标注册表（线程安全）：计数器与直方图按 (名称, 标签) 聚合，render_prometheus 导出
+    trace_file 不为空时每个结束的 span 追加一行 JSON，包含会话的 trace_id
+    """
+
+    def __init__(self, enabled: bool = True, trace_file: Optional[str] = None,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, prefix: str = "memagent"):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.prefix = prefix
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._lock = threading.Lock()
+        self._trace = open(trace_file, 'a', encoding='utf-8', buffering=1) if enabled and trace_file else None
+        self._trace_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Telemetry":
+        return cls(enabled=os.environ.get("MEMAGENT_METRICS", "1") not in ("0", "false", "no"),
+                   trace_file=os.environ.get("MEMAGENT_TRACE_LOG") or None)
+
+    def span(self, name: str, **labels):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, labels)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """累加计数器 <prefix>_<name>（名称应以 _total 结尾）"""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def _finish(self, span: Span, duration: float, error: Optional[BaseException]):
+        self.observe(f"{span.name}_seconds", duration, **span.labels)
+        if error is not None:
+            self.inc(f"{span.name}_errors_total", **span.labels)
+        if self._trace is None:
+            return
+        current = _current_trace.get()
+        record = {
+            "ts": round(span.wall_start, 6),
+            "trace_id": current[0] if current else None,
+            "session_id": current[1] if current else None,
+            "span": span.name,
+            "duration_ms": round(duration * 1000, 3),
+            **span.labels,
+            **span.attrs,
+        }
+        if error is not None:
+            record["error"] = f"{type(error).__name__}: {error}"
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._trace_lock:
+            self._trace.write(line)
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Prometheus 文本格式（0.0.4）；gauges 为调用方附加的即时值，如缓存条目数"""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{metric}{_format_labels(key)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = 'le="%g"' % bound
+                        lines.append(f"{metric}_bucket{_format_labels(key, le)} {cumulative}")
+                    inf = 'le="+Inf"'
+                    lines.append(f"{metric}_bucket{_format_labels(key, inf)} {histogram.count}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {histogram.count}")
+        for name, value in sorted((gauges or {}).items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def close(self):
+        with self._trace_lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+# 进程级单例，各模块直接导入使用
+telemetry = Telemetry.from_env()
+
+
+def record_llm_usage(response: Dict, model: str):
+    """按响应中的 usage 字段累加 token 计数（服务端未返回 usage 时跳过）"""
+    if not telemetry.enabled:
+        return
+    usage = (response or {}).get("usage") or {}
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            telemetry.inc("llm_tokens_total", usage[kind], model=model, kind=kind.split("_")[0])
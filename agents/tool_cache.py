@@ -0,0 +1,135 @@
+# tool_cache.py - 工具结果缓存：按目标文件指纹自动失效，LRU + 字节预算淘汰
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# 可缓存的工具及其目标路径参数；目录的 mtime 在增删条目时变化，文件的 mtime/size 在内容变化时变化
+CACHEABLE_TOOLS = {
+    "list_files": "path",
+    "read_file": "file_path",
+    "search_keyword": "file_path",
+}
+
+
+def path_fingerprint(path: str) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime_ns, size)；路径不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class ToolResultCache:
+    """
+    线程安全的工具结果缓存，可被多个 MainAgent（多个会话）共享
+    键包含目标文件的指纹，文件一旦变化旧条目便不会再命中，随 LRU 自然淘汰
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[tuple, Tuple[Dict, int]]" = OrderedDict()
+        # 目标路径 -> 缓存键，文件监听据此主动清除已过期的条目
+        self._by_target: Dict[str, Set[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def make_key(self, root_dir: str, tool_name: str, arguments: Dict) -> Optional[tuple]:
+        """构造缓存键；工具不可缓存或目标不存在时返回 None"""
+        path_arg = CACHEABLE_TOOLS.get(tool_name)
+        if path_arg is None:
+            return None
+        args = {k: v for k, v in arguments.items() if v is not None}
+        target = os.path.normpath(os.path.join(root_dir, args.get(path_arg) or ""))
+        fingerprint = path_fingerprint(target)
+        if fingerprint is None:
+            return None
+        args[path_arg] = target
+        return tool_name, json.dumps(args, sort_keys=True, ensure_ascii=False), fingerprint
+
+    @staticmethod
+    def _target(key: tuple) -> str:
+        return json.loads(key[1])[CACHEABLE_TOOLS[key[0]]]
+
+    def _drop(self, key: tuple, target: Optional[str] = None):
+        """删除条目并维护反向索引（需持有锁）"""
+        _, size = self._entries.pop(key)
+        self.current_bytes -= size
+        target = target or self._target(key)
+        keys = self._by_target.get(target)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_target[target]
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, result: Dict):
+        """写入结果；单个结果超过预算的一半时不缓存"""
+        size = len(json.dumps(result, ensure_ascii=False).encode('utf-8')) + len(key[1])
+        if size > self.max_bytes // 2:
+            return
+        target = self._target(key)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key, target)
+            self._entries[key] = (result, size)
+            self._by_target.setdefault(target, set()).add(key)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, paths: Iterable[str], prefixes: Tuple[str, ...] = ()):
+        """清除目标为 paths 之一或位于 prefixes 之下的条目；这些条目的指纹已变，本就不会再命中，提前释放预算"""
+        with self._lock:
+            targets = [path for path in paths if path in self._by_target]
+            if prefixes:
+                targets += [path for path in self._by_target if path.startswith(prefixes)]
+            for target in targets:
+                for key in list(self._by_target.get(target, ())):
+                    self._drop(key, target)
+                    self.invalidations += 1
+
+    def apply_changes(self, changes):
+        """文件监听（agents.fs_watcher）的变更批次：清除变化的文件与目录上的工具结果"""
+        if changes.overflow:
+            self.clear()
+            return
+        paths = [changes.abs_path(p) for p in changes.files | changes.dirs | changes.removed_dirs]
+        self.invalidate(paths, tuple(changes.abs_path(d) + os.sep for d in changes.removed_dirs))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_target.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
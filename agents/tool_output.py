@@ -0,0 +1,221 @@
+# tool_output.py - 工具输出预算：超出预算的结果分页返回，剩余部分保存在服务端游标中，由 fetch_more 工具续取
+
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from agents import file_reader
+from agents.tool_cache import path_fingerprint
+
+# 各工具单次输出的字符预算（近似序列化后的长度），未列出的工具使用默认预算
+DEFAULT_BUDGETS = {
+    "read_file": 16000,
+}
+# 结果为字典时，按这些字段分页，其余字段只随最后一页返回（如 list_tree 的 next_cursor）
+LIST_FIELDS = ("matches", "entries")
+
+
+def _item_chars(item) -> int:
+    return len(item) if isinstance(item, str) else len(json.dumps(item, ensure_ascii=False))
+
+
+class ListContinuation:
+    """已计算好的列表结果：续页直接按偏移切片，不重新执行工具"""
+
+    def __init__(self, items: List, offset: int, field: Optional[str] = None, meta: Optional[Dict] = None):
+        self.items = items
+        self.offset = offset
+        self.field = field
+        self.meta = meta or {}
+
+    def page(self, budget: int) -> Tuple[object, Optional["ListContinuation"], Dict]:
+        """返回 (本页结果, 后续游标, 附加字段)；每页至少包含一项"""
+        used = 0
+        stop = self.offset
+        while stop < len(self.items):
+            used += _item_chars(self.items[stop]) + 2
+            if used > budget and stop > self.offset:
+                break
+            stop += 1
+        page = self.items[self.offset:stop]
+        rest = ListContinuation(self.items, stop, self.field, self.meta) if stop < len(self.items) else None
+        extra = {"remaining_items": len(self.items) - stop} if rest else {}
+        if self.field is None:
+            return page, rest, extra
+        # 附加字段只放在最后一页，避免模型在读完本结果前就使用 next_cursor 之类的字段
+        return {self.field: page, **({} if rest else self.meta)}, rest, extra
+
+
+class TextContinuation:
+    """已在内存中的长文本，按字符切分"""
+
+    def __init__(self, text: str, offset: int = 0):
+        self.text = text
+        self.offset = offset
+
+    def page(self, budget: int) -> Tuple[str, Optional["TextContinuation"], Dict]:
+        stop = self.offset + budget
+        rest = TextContinuation(self.text, stop) if stop < len(self.text) else None
+        extra = {"remaining_chars": len(self.text) - stop} if rest else {}
+        return self.text[self.offset:stop], rest, extra
+
+
+class FileContinuation:
+    """文件的字节窗口：续页时再从 mmap 读取下一段；文件发生变化则拒绝续取"""
+
+    def __init__(self, path: str, offset: int, end: int, fingerprint):
+        self.path = path
+        self.offset = offset
+        self.end = end
+        self.fingerprint = fingerprint
+
+    def page(self, budget: int) -> Tuple[str, Optional["FileContinuation"], Dict]:
+        if path_fingerprint(self.path) != self.fingerprint:
+            raise ValueError("文件已变化，请重新调用 read_file")
+        text, next_offset, end = file_reader.read_window_bounded(self.path, self.offset, self.end, budget)
+        if next_offset is None:
+            return text, None, {}
+        return text, FileContinuation(self.path, next_offset, end, self.fingerprint), {
+            "next_start": next_offset, "remaining_bytes": end - next_offset}
+
+
+class OutputGovernor:
+    """
+    按工具限制单条工具结果的大小：超出预算时返回第一页，并附 truncated 与不透明的 continuation；
+    游标保存在进程内（LRU + 过期时间），fetch_more 取下一页时不重新执行工具
+    游标只指向固定位置，同一个 continuation 可重复获取；read_file 的首页不带游标写入工具结果缓存，
+    命中时由 resume_file 重新签发游标，游标被淘汰或过期后再次调用原工具仍能续取
+    """
+
+    def __init__(self, default_budget: int = 12000, budgets: Optional[Dict[str, int]] = None,
+                 max_cursors: int = 1000, ttl: float = 600.0):
+        self.default_budget = default_budget
+        self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+        self.max_cursors = max_cursors
+        self.ttl = ttl
+        self._cursors: "OrderedDict[str, Tuple[float, str, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.pages_served = 0
+
+    def budget_for(self, tool_name: str) -> int:
+        return self.budgets.get(tool_name, self.default_budget)
+
+    def _save(self, tool_name: str, continuation) -> str:
+        token = secrets.token_urlsafe(9)
+        now = time.monotonic()
+        with self._lock:
+            self._cursors[token] = (now, tool_name, continuation)
+            while self._cursors:
+                oldest, (created, _, _) = next(iter(self._cursors.items()))
+                if len(self._cursors) <= self.max_cursors and now - created <= self.ttl:
+                    break
+                del self._cursors[oldest]
+        return token
+
+    def _render(self, tool_name: str, continuation) -> Dict:
+        page, rest, extra = continuation.page(self.budget_for(tool_name))
+        result = {"result": page}
+        if rest is not None:
+            result.update(truncated=True, continuation=self._save(tool_name, rest), **extra)
+        return result
+
+    def limit(self, tool_name: str, result: Dict) -> Dict:
+        """对完整结果应用预算；未超出预算或无法分页的结果原样返回"""
+        if "result" not in result or result.get("truncated"):
+            return result
+        value = result["result"]
+        budget = self.budget_for(tool_name)
+        if isinstance(value, str):
+            if len(value) <= budget:
+                return result
+            continuation = TextContinuation(value)
+        elif isinstance(value, list):
+            continuation = ListContinuation(value, 0)
+        elif isinstance(value, dict):
+            field = next((f for f in LIST_FIELDS if isinstance(value.get(f), list)), None)
+            if field is None:
+                return result
+            meta = {k: v for k, v in value.items() if k != field}
+            continuation = ListContinuation(value[field], 0, field, meta)
+        else:
+            return result
+        limited = self._render(tool_name, continuation)
+        if not limited.get("truncated"):
+            return result
+        return limited
+
+    def read_file(self, path: str, start: Optional[int] = None, end: Optional[int] = None) -> Dict:
+        """按预算读取文件字节窗口，超出部分以 FileContinuation 续取，不解码整个文件"""
+        budget = self.budget_for("read_file")
+        fingerprint = path_fingerprint(path)
+        text, next_offset, end = file_reader.read_window_bounded(path, start, end, budget)
+        result = {"result": text}
+        if next_offset is not None:
+            rest = FileContinuation(path, next_offset, end, fingerprint)
+            result.update(truncated=True, continuation=self._save("read_file", rest),
+                          next_start=next_offset, remaining_bytes=end - next_offset)
+        return result
+
+    def resume_file(self, path: str, result: Dict) -> Dict:
+        """为缓存中不带游标的 read_file 首页重新签发 continuation；文件已变化时续取会被 FileContinuation 拒绝"""
+        if not result.get("truncated") or "next_start" not in result:
+            return result
+        start = result["next_start"]
+        rest = FileContinuation(path, start, start + result["remaining_bytes"], path_fingerprint(path))
+        return {**result, "continuation": self._save("read_file", rest)}
+
+    def fetch_more(self, token: str) -> Dict:
+        with self._lock:
+            entry = self._cursors.get(token)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._cursors[token]
+                entry = None
+        if entry is None:
+            return {"error": "continuation 不存在或已过期，请重新调用原工具"}
+        _, tool_name, continuation = entry
+        try:
+            result = self._render(tool_name, continuation)
+        except ValueError as e:
+            return {"error": str(e)}
+        with self._lock:
+            self.pages_served += 1
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"cursors": len(self._cursors), "pages_served": self.pages_served,
+                    "default_budget": self.default_budget}
+
+
+_shared_governor: Optional[OutputGovernor] = None
+_shared_governor_lock = threading.Lock()
+
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """解析 "read_file=16000,search_files=8000" 形式的按工具预算"""
+    budgets = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+def get_shared_output_governor() -> Optional[OutputGovernor]:
+    """
+    进程内共享的输出预算：MEMAGENT_TOOL_OUTPUT_CHARS 为默认预算（为 0 时不限制，返回 None），
+    MEMAGENT_TOOL_OUTPUT_BUDGETS 按工具覆盖，如 "read_file=32000,search_files=8000"
+    """
+    global _shared_governor
+    default_budget = int(os.environ.get("MEMAGENT_TOOL_OUTPUT_CHARS", 12000))
+    if default_budget <= 0:
+        return None
+    with _shared_governor_lock:
+        if _shared_governor is None:
+            budgets = {**DEFAULT_BUDGETS, **parse_budgets(os.environ.get("MEMAGENT_TOOL_OUTPUT_BUDGETS", ""))}
+            _shared_governor = OutputGovernor(default_budget, budgets)
+        return _shared_governor
@@ -0,0 +1,254 @@
+# tree_listing.py - 递归目录列表：基于 os.scandir 的目录快照缓存（按目录 mtime 失效），支持深度、通配符、.gitignore 与游标分页
+
+import base64
+import binascii
+import fnmatch
+import os
+import stat
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from agents.gitignore import ALWAYS_IGNORED, IgnoreRules, load_rules
+
+# 快照条目 (名称, 类型, 字节数)；类型 d=目录 f=文件 l=符号链接
+SnapshotEntry = Tuple[str, str, int]
+_KIND_NAMES = {"d": "dir", "f": "file", "l": "symlink"}
+
+
+class DirSnapshot:
+    __slots__ = ("signature", "entries", "has_gitignore")
+
+    def __init__(self, signature: Tuple[int, int], entries: List[SnapshotEntry]):
+        self.signature = signature
+        self.entries = entries
+        self.has_gitignore = any(name == ".gitignore" for name, _, _ in entries)
+
+
+def dir_signature(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns
+
+
+def scan_dir(path: str) -> DirSnapshot:
+    """
+    一次 scandir 读取整个目录：目录类型来自 d_type，文件大小需要一次 lstat
+    签名在扫描前取得，扫描期间发生的变化会在下次访问时触发重扫
+    """
+    signature = dir_signature(path)
+    entries: List[SnapshotEntry] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append((entry.name, "d", 0))
+                    continue
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue  # 扫描期间被删除
+            entries.append((entry.name, "l" if stat.S_ISLNK(st.st_mode) else "f", st.st_size))
+    entries.sort()
+    return DirSnapshot(signature, entries)
+
+
+class DirectoryCache:
+    """
+    线程安全的目录快照缓存，可被所有会话共享：每次访问只 stat 目录本身，inode/mtime 未变即复用快照
+    目录 mtime 只在增删/重命名条目时变化，原地改写的文件其大小会滞后到该目录下次变化为止（启用文件监听时由 apply_changes 及时重扫）
+    总条目数超过 max_entries 时按 LRU 淘汰整个目录的快照
+    """
+
+    def __init__(self, max_entries: int = 500000):
+        self.max_entries = max_entries
+        self.current_entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._snapshots: "OrderedDict[str, DirSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> DirSnapshot:
+        signature = dir_signature(path)
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot is not None and snapshot.signature == signature:
+                self._snapshots.move_to_end(path)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+        snapshot = scan_dir(path)
+        with self._lock:
+            old = self._snapshots.pop(path, None)
+            if old is not None:
+                self.current_entries -= len(old.entries)
+            self._snapshots[path] = snapshot
+            self.current_entries += len(snapshot.entries)
+            while self.current_entries > self.max_entries and len(self._snapshots) > 1:
+                _, evicted = self._snapshots.popitem(last=False)
+                self.current_entries -= len(evicted.entries)
+                self.evictions += 1
+        return snapshot
+
+    def invalidate(self, path: str):
+        """丢弃某个目录的快照（例如收到文件系统变更通知时）"""
+        with self._lock:
+            old = self._snapshots.pop(path, None)
+            if old is not None:
+                self.current_entries -= len(old.entries)
+
+    def apply_changes(self, changes):
+        """
+        文件监听（agents.fs_watcher）的变更批次：已缓存的变化目录立即重扫，下次访问仍是命中（也修正了原地改写导致的大小滞后）；
+        删除的目录连同其子目录的快照一起丢弃
+        """
+        if changes.overflow:
+            self.clear()
+            return
+        prefixes = tuple(changes.abs_path(d) + os.sep for d in changes.removed_dirs)
+        with self._lock:
+            if prefixes:
+                for path in [p for p in self._snapshots if (p + os.sep).startswith(prefixes)]:
+                    self.current_entries -= len(self._snapshots.pop(path).entries)
+            stale = [path for path in map(changes.abs_path, changes.dirs) if path in self._snapshots]
+        for path in stale:
+            self.invalidate(path)
+            try:
+                self.get(path)
+            except OSError:
+                pass  # 目录已被删除
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self.current_entries = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"dirs": len(self._snapshots), "entries": self.current_entries, "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_shared_cache: Optional[DirectoryCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_listing_cache() -> DirectoryCache:
+    """进程内共享的目录快照缓存，容量由 MEMAGENT_LISTING_CACHE_ENTRIES 设置"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = DirectoryCache(int(os.environ.get("MEMAGENT_LISTING_CACHE_ENTRIES", 500000)))
+        return _shared_cache
+
+
+def encode_cursor(rel_path: str) -> str:
+    return base64.urlsafe_b64encode(rel_path.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if not cursor:
+        return None
+    try:
+        return tuple(base64.b64decode(cursor, altchars=b"-_", validate=True).decode('utf-8').split('/'))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("无效的 cursor，请使用上一页返回的 next_cursor")
+
+
+def split_patterns(patterns) -> List[str]:
+    """通配符参数可以是列表或逗号分隔的字符串"""
+    if not patterns:
+        return []
+    if isinstance(patterns, str):
+        patterns = patterns.split(",")
+    return [p.strip() for p in patterns if p and p.strip()]
+
+
+def _matches(patterns: Sequence[str], name: str, rel_path: str) -> bool:
+    """含 / 的模式匹配相对路径，否则只匹配文件名"""
+    return any(fnmatch.fnmatch(rel_path if "/" in p else name, p) for p in patterns)
+
+
+def list_tree(root: str, sub_path: str = "", max_depth: int = 3, glob=None, exclude=None,
+              use_gitignore: bool = True, limit: int = 200, cursor: Optional[str] = None,
+              cache: Optional[DirectoryCache] = None) -> Dict:
+    """
+    按名称排序的先序遍历 root/sub_path，返回至多 limit 个条目：
+    {"path": 相对 root 的路径（目录以 / 结尾）, "type": file|dir|symlink, "size": 字节数}
+    深度达到 max_depth 而未展开的目录带 "collapsed": true；给出 glob 时只列出匹配的文件
+    next_cursor 非空表示还有后续页，原样传回 cursor 即可继续；游标是上一页最后一个路径，
+    排在它之前的子树整体跳过，目录树在两页之间发生变化也不会重复或遗漏未变化的部分
+    """
+    cache = cache or get_shared_listing_cache()
+    if use_gitignore:
+        rules, rel = load_rules(root, sub_path)
+    else:
+        rel = os.path.normpath(sub_path).replace(os.sep, '/').strip('/')
+        rel, rules = ('' if rel == '.' else rel), IgnoreRules()
+    base = os.path.join(root, rel) if rel else root
+    if not os.path.isdir(base):
+        raise FileNotFoundError(f"Directory not found: {base}")
+    limit = max(1, limit)
+    max_depth = max(1, max_depth)
+    after = decode_cursor(cursor)
+    includes = split_patterns(glob)
+    excludes = split_patterns(exclude)
+    base_parts = tuple(rel.split('/')) if rel else ()
+
+    entries: List[Dict] = []
+    dirs_visited = 1
+    snapshot = cache.get(base)  # load_rules 已包含 sub_path 自身的 .gitignore
+    # 栈元素: (目录相对 root 的路径分量, 该目录的忽略规则, 深度, 条目迭代器)
+    stack = [(base_parts, rules, 0, iter(snapshot.entries))]
+    while stack and len(entries) <= limit:
+        dir_parts, dir_rules, depth, it = stack[-1]
+        item = next(it, None)
+        if item is None:
+            stack.pop()
+            continue
+        name, kind, size = item
+        parts = dir_parts + (name,)
+        rel_path = '/'.join(parts)
+        is_dir = kind == "d"
+        if is_dir and name in ALWAYS_IGNORED:
+            continue
+        if use_gitignore and dir_rules.ignored(rel_path, is_dir):
+            continue
+        if excludes and _matches(excludes, name, rel_path):
+            continue
+        # 整个子树都排在游标之前时直接跳过；游标位于该目录内部时只进入、不输出
+        emit = after is None or parts > after
+        if not emit and not (is_dir and after[:len(parts)] == parts):
+            continue
+
+        if not is_dir:
+            if emit and (not includes or _matches(includes, name, rel_path)):
+                entries.append({"path": rel_path, "type": _KIND_NAMES[kind], "size": size})
+            continue
+
+        expand = depth + 1 < max_depth
+        if emit and not includes:
+            entry = {"path": rel_path + "/", "type": "dir"}
+            if not expand:
+                entry["collapsed"] = True
+            entries.append(entry)
+        if not expand:
+            continue
+        dir_path = os.path.join(root, *parts)
+        try:
+            child = cache.get(dir_path)
+        except OSError:
+            continue  # 遍历期间被删除或无权限
+        dirs_visited += 1
+        child_rules = dir_rules.child(dir_path, rel_path) if use_gitignore and child.has_gitignore else dir_rules
+        stack.append((parts, child_rules, depth + 1, iter(child.entries)))
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor(entries[-1]["path"].rstrip('/'))
+    return {
+        "entries": entries,
+        "next_cursor": next_cursor,
+        "dirs_visited": dirs_visited,
+    }
@@ -0,0 +1,453 @@
+# trigram_index.py - 工作目录的持久化三元组索引：先用索引缩小候选文件，再逐个校验内容
+#
+# 命令行:
+#   python -m agents.trigram_index build  <root> [--index PATH]
+#   python -m agents.trigram_index search <root> <pattern> [--regex] [-i] [--max-results N]
+#   python -m agents.trigram_index stats  <root>
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from agents.gitignore import walk_files
+from agents.search import compile_pattern, search_file
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# 超过该大小的文件不建索引，查询时始终作为候选
+MAX_INDEXED_SIZE = 1 << 20
+# 每个段最多包含的文件数，限制建索引时的内存占用
+SEGMENT_FILES = 5000
+# 段数超过该值或失效文件占比过高时合并
+MAX_SEGMENTS = 16
+
+STATUS_INDEXED = 1
+STATUS_UNINDEXED = 0   # 过大，无法用索引过滤
+STATUS_BINARY = 2      # 二进制文件，搜索时跳过
+
+
+def default_index_path(root: str) -> str:
+    """索引默认存放在 ~/.cache/memagent 下，避免写入被索引的目录本身"""
+    cache_dir = os.environ.get("MEMAGENT_INDEX_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "memagent")
+    digest = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f"trigram-{digest}.db")
+
+
+def extract_trigrams(data: bytes) -> Set[int]:
+    """提取 ASCII 小写化后的字节三元组，编码为 24 位整数"""
+    data = data.lower()
+    grams = {data[i:i + 3] for i in range(len(data) - 2)}
+    return {int.from_bytes(g, 'big') for g in grams}
+
+
+def literal_trigrams(literal: str) -> Set[int]:
+    return extract_trigrams(literal.encode('utf-8'))
+
+
+def required_literals(pattern: str, regex: bool, ignore_case: bool = False) -> List[str]:
+    """
+    提取匹配必须包含的字面量片段：普通关键词即其本身；
+    正则只取顶层顺序结构中连续的字面字符，遇到分支/重复等结构即断开
+    忽略大小写时索引只能处理 ASCII 大小写，含非 ASCII 字符的片段不参与过滤
+    """
+    if not regex:
+        literals = [pattern]
+    else:
+        try:
+            parsed = sre_parse.parse(pattern)
+        except re.error:
+            return []
+        ignore_case = ignore_case or bool(parsed.state.flags & re.IGNORECASE)
+        literals, current = [], []
+        for op, arg in parsed:
+            if op == sre_parse.LITERAL:
+                current.append(chr(arg))
+                continue
+            if current:
+                literals.append("".join(current))
+                current = []
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+                # x+ / (abc){2,} 之类：重复体若全是字面字符，则至少出现一次
+                sub = [chr(a) for o, a in arg[2] if o == sre_parse.LITERAL]
+                if sub and len(sub) == len(arg[2]):
+                    literals.append("".join(sub))
+        if current:
+            literals.append("".join(current))
+    if ignore_case:
+        literals = [lit for lit in literals if lit.isascii()]
+    return [lit for lit in literals if len(lit.encode('utf-8')) >= 3]
+
+
+class TrigramIndex:
+    """
+    Zoekt/codesearch 风格的三元组倒排索引，存储于 SQLite：
+    - files:    每个文件一行，记录 mtime/size；文件变化时分配新 id，旧 id 自然失效
+    - postings: (trigram, segment) -> 排序后的文件 id 数组；每次增量更新写入一个新段
+    查询时合并各段的 id 并过滤失效 id，段过多时整体合并
+    """
+
+    def __init__(self, root: str, index_path: Optional[str] = None, refresh_interval: float = 5.0):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path or default_index_path(self.root)
+        self.refresh_interval = refresh_interval
+        self.last_refresh = 0.0
+        # 由文件监听增量维护时，本进程内完成一次全量 refresh 后不再按间隔重扫
+        self.watched = False
+        self._refreshed = False
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                status INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                trigram INTEGER NOT NULL,
+                seg INTEGER NOT NULL,
+                ids BLOB NOT NULL,
+                PRIMARY KEY (trigram, seg)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._load_files()
+
+    def _load_files(self):
+        self.files: Dict[str, Tuple[int, int, int, int]] = {}
+        self.path_of: Dict[int, str] = {}
+        for file_id, path, mtime_ns, size, status in self._db.execute(
+                "SELECT id, path, mtime_ns, size, status FROM files"):
+            self.files[path] = (file_id, mtime_ns, size, status)
+            self.path_of[file_id] = path
+        self.last_refresh = float(self._meta("last_refresh") or 0)
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self):
+        """其他进程（共享同一索引文件）提交过写入时重新加载文件表，避免按过期的 id/路径映射写入或查询"""
+        if self._db.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+            self._load_files()
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _next_segment(self) -> int:
+        seg = int(self._meta("next_segment") or 0)
+        self._set_meta("next_segment", seg + 1)
+        return seg
+
+    def _scan(self) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+        """只做 stat 的遍历：返回与索引记录的 mtime/size 不一致的文件 [(路径, mtime_ns, size)] 与已删除的路径"""
+        with self._lock:
+            self._sync()
+            seen = set()
+            changed = []
+            for rel_path, entry in walk_files(self.root):
+                seen.add(rel_path)
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                known = self.files.get(rel_path)
+                if known is None or known[1] != st.st_mtime_ns or known[2] != st.st_size:
+                    changed.append((rel_path, st.st_mtime_ns, st.st_size))
+            removed = [path for path in self.files if path not in seen]
+            return changed, removed
+
+    def refresh(self) -> Dict[str, int]:
+        """遍历工作目录，按 mtime/size 找出新增、修改、删除的文件并增量更新索引"""
+        with self._lock:
+            changed, removed = self._scan()
+            self.update(changed, removed)
+            self.last_refresh = time.time()
+            self._refreshed = True
+            self._set_meta("last_refresh", self.last_refresh)
+            self._db.commit()
+            return {"changed": len(changed), "removed": len(removed), "files": len(self.files)}
+
+    def update_paths(self, rel_paths: List[str]):
+        """按路径增量更新（供文件监听等外部事件驱动），不存在的路径视为删除"""
+        changed, removed = [], []
+        for rel_path in rel_paths:
+            try:
+                st = os.stat(os.path.join(self.root, rel_path))
+            except OSError:
+                removed.append(rel_path)
+                continue
+            changed.append((rel_path, st.st_mtime_ns, st.st_size))
+        with self._lock:
+            self.update(changed, removed)
+            self._db.commit()
+
+    def apply_changes(self, changes):
+        """
+        文件监听（agents.fs_watcher）的变更批次：删除的目录先移除其下所有文件，再按路径增量更新
+        失败时这批变更已丢失，取消"已由监听维护"的状态，下次查询前重新全量 refresh
+        """
+        try:
+            if changes.overflow:
+                self.refresh()
+                return
+            paths = set(changes.files)
+            if changes.removed_dirs:
+                prefixes = tuple(d + '/' for d in changes.removed_dirs)
+                with self._lock:
+                    paths.update(p for p in self.files if p.startswith(prefixes))
+            if paths:
+                self.update_paths(sorted(paths))
+        except Exception:
+            self._refreshed = False
+            self.last_refresh = 0.0
+            raise
+
+    def update(self, changed: List[Tuple[str, int, int]], removed: List[str]):
+        """写入变化：删除旧记录，为变化的文件分配新 id，并按段写入倒排表；出错时回滚并按数据库重建内存映射"""
+        with self._lock:
+            self._sync()
+            try:
+                for rel_path in removed:
+                    known = self.files.pop(rel_path, None)
+                    if known is not None:
+                        self.path_of.pop(known[0], None)
+                    self._db.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+                for start in range(0, len(changed), SEGMENT_FILES):
+                    self._write_segment(changed[start:start + SEGMENT_FILES])
+                if self._needs_compaction():
+                    self.compact()
+            except BaseException:
+                self._db.rollback()
+                self._load_files()
+                raise
+
+    def _write_segment(self, batch: List[Tuple[str, int, int]]):
+        postings: Dict[int, array] = {}
+        for rel_path, mtime_ns, size in batch:
+            status = STATUS_UNINDEXED
+            grams: Set[int] = set()
+            if size <= MAX_INDEXED_SIZE:
+                try:
+                    with open(os.path.join(self.root, rel_path), 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                if b"\0" in data[:8192]:
+                    status = STATUS_BINARY
+                else:
+                    status = STATUS_INDEXED
+                    grams = extract_trigrams(data)
+            known = self.files.get(rel_path)
+            if known is not None:
+                self.path_of.pop(known[0], None)
+            # 按路径删除：其他进程可能已为该路径写入了本进程不知道的 id
+            self._db.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+            cursor = self._db.execute(
+                "INSERT INTO files (path, mtime_ns, size, status) VALUES (?, ?, ?, ?)",
+                (rel_path, mtime_ns, size, status))
+            file_id = cursor.lastrowid
+            self.files[rel_path] = (file_id, mtime_ns, size, status)
+            self.path_of[file_id] = rel_path
+            for gram in grams:
+                ids = postings.get(gram)
+                if ids is None:
+                    postings[gram] = ids = array('I')
+                ids.append(file_id)
+        if postings:
+            seg = self._next_segment()
+            self._set_meta("segments", int(self._meta("segments") or 0) + 1)
+            # id 单调递增且按顺序追加，每个数组天然有序
+            self._db.executemany("INSERT INTO postings (trigram, seg, ids) VALUES (?, ?, ?)",
+                                 ((gram, seg, ids.tobytes()) for gram, ids in postings.items()))
+
+    def _needs_compaction(self) -> bool:
+        return int(self._meta("segments") or 0) > MAX_SEGMENTS
+
+    def compact(self):
+        """按三元组顺序流式合并所有段为一个段，并剔除已失效的文件 id"""
+        with self._lock:
+            live = self.path_of
+            seg = self._next_segment()
+
+            def merged() -> Iterator[Tuple[int, int, bytes]]:
+                current, ids = None, set()
+                for gram, blob in self._db.execute("SELECT trigram, ids FROM postings ORDER BY trigram"):
+                    if gram != current:
+                        if ids:
+                            yield current, seg, array('I', sorted(ids)).tobytes()
+                        current, ids = gram, set()
+                    part = array('I')
+                    part.frombytes(blob)
+                    ids.update(i for i in part if i in live)
+                if ids:
+                    yield current, seg, array('I', sorted(ids)).tobytes()
+
+            self._db.execute("DROP TABLE IF EXISTS postings_new")
+            self._db.execute("CREATE TABLE postings_new (trigram INTEGER NOT NULL, seg INTEGER NOT NULL, "
+                             "ids BLOB NOT NULL, PRIMARY KEY (trigram, seg)) WITHOUT ROWID")
+            self._db.executemany("INSERT INTO postings_new (trigram, seg, ids) VALUES (?, ?, ?)", merged())
+            self._db.execute("DROP TABLE postings")
+            self._db.execute("ALTER TABLE postings_new RENAME TO postings")
+            self._set_meta("segments", 1)
+            self._db.commit()
+
+    def _posting(self, gram: int) -> Set[int]:
+        ids: Set[int] = set()
+        for (blob,) in self._db.execute("SELECT ids FROM postings WHERE trigram = ?", (gram,)):
+            part = array('I')
+            part.frombytes(blob)
+            ids.update(part)
+        return ids
+
+    def candidates(self, pattern: str, regex: bool = False, ignore_case: bool = False) -> Optional[List[str]]:
+        """
+        返回可能匹配的文件路径（已排序）；无法从模式中提取三元组时返回 None，表示需要全量扫描
+        未建索引的大文件总是包含在候选中，二进制文件总是排除
+        """
+        grams: Set[int] = set()
+        for literal in required_literals(pattern, regex, ignore_case):
+            grams |= literal_trigrams(literal)
+        if not grams:
+            return None
+        with self._lock:
+            self._sync()
+            result: Optional[Set[int]] = None
+            # 先取最稀有的三元组，尽早让交集变小
+            postings = sorted((self._posting(g) for g in grams), key=len)
+            for ids in postings:
+                result = ids if result is None else result & ids
+                if not result:
+                    break
+            paths = {self.path_of[i] for i in (result or ()) if i in self.path_of}
+            paths.update(p for p, info in self.files.items() if info[3] == STATUS_UNINDEXED)
+        return sorted(paths)
+
+    def maybe_refresh(self) -> Tuple[Set[str], Set[str]]:
+        """
+        查询前调用，返回索引尚未反映的 (新增或修改的路径, 已删除的路径)
+        由文件监听维护时直接返回；否则每 refresh_interval 秒增量重建一次，其余查询只做 stat 遍历，
+        变化的文件交给调用方直接扫描，结果与不用索引的 search_tree 一致
+        """
+        if self.watched and self._refreshed:
+            return set(), set()
+        if time.time() - self.last_refresh >= self.refresh_interval:
+            self.refresh()
+            return set(), set()
+        changed, removed = self._scan()
+        return {path for path, _, _ in changed}, set(removed)
+
+    def search(self, pattern: str, sub_path: str = "", regex: bool = False, ignore_case: bool = False,
+               glob: Optional[str] = None, max_results: int = 50, stats: Optional[Dict] = None) -> Iterator[Dict]:
+        """先经索引缩小候选，再逐个文件校验；结果格式与 search.search_tree 一致"""
+        changed, removed = self.maybe_refresh()
+        compiled = compile_pattern(pattern, regex, ignore_case)
+        stats = stats if stats is not None else {}
+        paths = self.candidates(pattern, regex, ignore_case)
+        if paths is None:
+            with self._lock:
+                self._sync()
+                paths = sorted(p for p, info in self.files.items() if info[3] != STATUS_BINARY)
+        if changed or removed:
+            # 索引中的记录已过期：变化的文件不论倒排表如何都作为候选，已删除的剔除
+            paths = sorted((set(paths) | changed) - removed)
+        # 与 walk_files 一致地规范化，"./src"、"src/" 都指向 src
+        prefix = os.path.normpath(sub_path).replace(os.sep, '/').strip('/')
+        if prefix and prefix != '.':
+            paths = [p for p in paths if p.startswith(prefix + '/')]
+        if glob:
+            paths = [p for p in paths if fnmatch.fnmatch(os.path.basename(p), glob)]
+        stats["files_scanned"] = 0
+        stats["candidates"] = len(paths)
+        remaining = max_results
+        for rel_path in paths:
+            stats["files_scanned"] += 1
+            for match in search_file(os.path.join(self.root, rel_path), rel_path, compiled, remaining):
+                yield match
+                remaining -= 1
+                if remaining <= 0:
+                    return
+
+    def stats(self) -> Dict:
+        with self._lock:
+            row = self._db.execute("SELECT COUNT(*), COUNT(DISTINCT trigram), COUNT(DISTINCT seg) FROM postings").fetchone()
+        return {
+            "root": self.root,
+            "index_path": self.index_path,
+            "files": len(self.files),
+            "posting_rows": row[0],
+            "trigrams": row[1],
+            "segments": row[2],
+            "index_bytes": os.path.getsize(self.index_path),
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_shared_indexes: Dict[str, TrigramIndex] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_index(root: str, index_path: Optional[str] = None) -> TrigramIndex:
+    """同一工作目录在进程内只打开一个索引，供所有会话共用"""
+    root = os.path.abspath(root)
+    with _shared_lock:
+        index = _shared_indexes.get(root)
+        if index is None:
+            index = _shared_indexes[root] = TrigramIndex(root, index_path)
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MemAgent trigram content index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("build", "search", "stats"):
+        p = sub.add_parser(name)
+        p.add_argument("root")
+        p.add_argument("--index", default=None, help="索引文件路径（默认 ~/.cache/memagent 下）")
+        if name == "search":
+            p.add_argument("pattern")
+            p.add_argument("--regex", action="store_true")
+            p.add_argument("-i", "--ignore-case", action="store_true")
+            p.add_argument("--max-results", type=int, default=50)
+    args = parser.parse_args()
+
+    index = TrigramIndex(args.root, args.index)
+    if args.command == "build":
+        t0 = time.perf_counter()
+        result = index.refresh()
+        result["seconds"] = round(time.perf_counter() - t0, 3)
+        print(json.dumps({**result, **index.stats()}, ensure_ascii=False, indent=2))
+    elif args.command == "search":
+        stats = {}
+        t0 = time.perf_counter()
+        for match in index.search(args.pattern, regex=args.regex, ignore_case=args.ignore_case,
+                                  max_results=args.max_results, stats=stats):
+            print(f"{match['file']}:{match['line']}:{match['column']}: {match['text']}")
+        print(f"-- {stats['candidates']} candidates, {stats['files_scanned']} scanned, "
+              f"{(time.perf_counter() - t0) * 1000:.1f} ms")
+    else:
+        print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 import os
 import json
 from agents import MainAgent, MemoryAgent, ContextAgent
+from agents.memory_consolidation import memory_key
 
 
 class AIAgentSystem:
@@ -43,7 +44,7 @@ class AIAgentSystem:
             # 无明确指令，交由记忆代理总结
             summary = self.memory_agent.summarize_conversation(self.conversation_history)
             if summary:
-                key = f"Q: {user_input[:50]}..."
+                key = memory_key(user_input)
                 self.memory_agent.add_memory_entry(key, summary)
             response = {"message": "已记录您的问题，暂无直接操作指令。"}
 
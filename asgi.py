@@ -0,0 +1,378 @@
+# asgi.py - ASGI 服务入口：与 server.py 相同的 API，模型请求与工具调用均为异步，单进程可承载数百并发会话
+# 运行：uvicorn asgi:app --host 0.0.0.0 --port 8000（需要 aiohttp 与 uvicorn）
+
+import asyncio
+import contextvars
+import json
+import os
+import time
+from functools import partial
+from urllib.parse import parse_qsl
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from agents.async_llm_client import AsyncLLMClient, close_async_sessions
+from agents.session_store import create_session_store
+from agents.telemetry import bind_trace, telemetry
+from server import (answer_from_cache, build_agents, elapsed_ms, fill_results, memory_page, metrics_gauges,
+                    prefetcher, remember_final_response, sse_event, take_prefetched, tool_cache)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webui')
+
+session_store = create_session_store(partial(build_agents, client_class=AsyncLLMClient))
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+async def run_blocking(func, *args):
+    """在默认线程池中执行阻塞操作（记忆检索/写入等），不阻塞事件循环；携带当前 contextvars（追踪上下文）"""
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run,
+                                                            partial(func, *args))
+
+
+async def read_json(receive) -> Dict:
+    """读取 JSON 请求体，并按其中的 session_id 绑定追踪上下文（每个请求是独立的 task，无需解绑）"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body) if body else {}
+    except json.JSONDecodeError:
+        raise HTTPError(400, "请求体不是合法的 JSON")
+    if isinstance(data, dict):
+        bind_trace(data.get("session_id", "default"))
+    return data
+
+
+async def send_response(send, status: int, body: bytes, content_type: str, headers: Tuple = ()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, data, status: int = 200):
+    await send_response(send, status, json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                        "application/json")
+
+
+async def require_session(session_id: str, message: str = "会话不存在") -> Dict:
+    """SQLite 后端的 get 会读盘，未命中进程内缓存时还会重建 agent，需在线程池中调用"""
+    agents = await run_blocking(session_store.get, session_id)
+    if agents is None:
+        raise HTTPError(400, message)
+    return agents
+
+
+def default_session() -> Dict:
+    """/memories 相关接口使用的默认会话；创建会构造 agent、打开记忆库，需在线程池中调用"""
+    return session_store.get("default") or session_store.create("default")
+
+
+async def index(scope, receive, send):
+    with open(os.path.join(STATIC_DIR, 'index.html'), 'rb') as f:
+        await send_response(send, 200, f.read(), "text/html; charset=utf-8")
+
+
+async def get_memories(scope, receive, send):
+    """分页浏览记忆条目（使用默认会话），参数见 server.memory_page"""
+    agents = await run_blocking(default_session)
+    params = dict(parse_qsl(scope.get("query_string", b"").decode('utf-8')))
+    try:
+        page = await run_blocking(memory_page, agents["memory_agent"], params)
+    except ValueError:
+        raise HTTPError(400, "offset/limit 必须是整数")
+    await send_json(send, page, 404 if "error" in page else 200)
+
+
+async def consolidate_memories(scope, receive, send):
+    agents = await run_blocking(default_session)
+    memory_agent = agents["memory_agent"]
+
+    def consolidate():
+        result = memory_agent.consolidate()
+        memory_agent.save_memories()
+        return result
+
+    await send_json(send, await run_blocking(consolidate))
+
+
+async def get_tool_cache_stats(scope, receive, send):
+    await send_json(send, tool_cache.stats())
+
+
+async def get_metrics(scope, receive, send):
+    body = telemetry.render_prometheus(metrics_gauges()).encode('utf-8')
+    await send_response(send, 200, body, "text/plain; version=0.0.4")
+
+
+async def get_session_stats(scope, receive, send):
+    await send_json(send, session_store.stats())
+
+
+async def start_session(scope, receive, send):
+    """开始新会话"""
+    data = await read_json(receive)
+    session_id = data.get("session_id", "default")
+    base_url = data.get("base_url", "").rstrip('/')
+    api_key = data.get("api_key", "")
+    if not base_url or not api_key:
+        raise HTTPError(400, "缺少 base_url 或 api_key")
+
+    llm_config = {
+        "base_url": base_url,
+        "api_key": api_key,
+        "model_name": data.get("model_name", "gpt-4"),
+        "timeout": data.get("timeout")
+    }
+    agents = await run_blocking(session_store.create, session_id, data.get("work_dir", "."), llm_config)
+    agents["messages"] = []  # 重置消息历史
+    user_input = data.get("user_input", "")
+
+    # 快速路径：相同/相近问题且依赖文件未变化，直接返回缓存的回答
+    cached = await run_blocking(answer_from_cache, agents, user_input)
+    if cached is not None:
+        await run_blocking(session_store.save, session_id, agents)
+        await send_json(send, {"session_id": session_id, "context_used": "", "cached_response": cached})
+        return
+
+    # 注入记忆上下文
+    relevant_memories = await run_blocking(agents["context_agent"].find_relevant_memories, user_input)
+    context_str = "\n".join([f"{k}: {v}" for k, v in relevant_memories.items()]) if relevant_memories else ""
+    if context_str:
+        agents["messages"].append({"role": "system", "content": f"相关记忆:\n{context_str}"})
+    agents["messages"].append({"role": "user", "content": user_input})
+    await run_blocking(session_store.save, session_id, agents)
+    if prefetcher is not None:
+        await run_blocking(prefetcher.warm, agents["main_agent"], [user_input, context_str])
+
+    await send_json(send, {"session_id": session_id, "context_used": context_str})
+
+
+async def next_step(scope, receive, send):
+    """执行下一步（LLM决策或工具调用）"""
+    started = time.perf_counter()
+    data = await read_json(receive)
+    session_id = data.get("session_id", "default")
+    agents = await require_session(session_id, "会话不存在，请先调用 /start_session")
+    main_agent = agents["main_agent"]
+    llm_client = main_agent.llm_client
+    messages = agents["messages"]
+
+    try:
+        payload, history_stats = await run_blocking(main_agent.prepare_messages, messages)
+        llm_started = time.perf_counter()
+        response = await llm_client.achat_completion(payload, tools=main_agent.get_tool_definitions())
+        llm_ms = elapsed_ms(llm_started)
+    except Exception as e:
+        await send_json(send, {"error": str(e)}, 500)
+        return
+
+    if llm_client.is_tool_call(response):
+        tool_calls = llm_client.extract_tool_calls(response)
+        message = llm_client.extract_content(response) or "正在执行工具调用..."
+        if prefetcher is not None:
+            await run_blocking(prefetcher.schedule, session_id, main_agent, tool_calls)
+        messages.append({"role": "assistant", "content": message, "tool_calls": tool_calls})
+        await run_blocking(session_store.save, session_id, agents)
+        await send_json(send, {"type": "tool_call", "message": message, "tool_calls": tool_calls,
+                               "history": history_stats,
+                               "timing": {"llm_ms": llm_ms, "server_ms": elapsed_ms(started)},
+                               "session_id": session_id})
+        return
+
+    final_content = llm_client.extract_content(response)
+    messages.append({"role": "assistant", "content": final_content})
+    await run_blocking(session_store.save, session_id, agents)
+    await run_blocking(remember_final_response, agents, final_content)
+    await send_json(send, {"type": "final_response", "response": final_content,
+                           "history": history_stats,
+                           "timing": {"llm_ms": llm_ms, "server_ms": elapsed_ms(started)},
+                           "session_id": session_id})
+
+
+async def execute_tool(scope, receive, send):
+    """执行单个工具调用"""
+    started = time.perf_counter()
+    data = await read_json(receive)
+    session_id = data.get("session_id")
+    tool_call = data.get("tool_call")
+    agents = await require_session(session_id)
+    main_agent = agents["main_agent"]
+
+    tool_started = time.perf_counter()
+    result, = await run_blocking(take_prefetched, session_id, main_agent, [tool_call])
+    prefetched = result is not None
+    if result is None:
+        result, = await main_agent.arun_tool_calls([tool_call])
+    tool_ms = elapsed_ms(tool_started)
+    agents["messages"].append(main_agent.make_tool_message(tool_call, result))
+    await run_blocking(session_store.save, session_id, agents)
+    await send_json(send, {
+        "type": "tool_result",
+        "result": result,
+        "tool_name": tool_call["function"]["name"],
+        "prefetched": prefetched,
+        "timing": {"tool_ms": tool_ms, "server_ms": elapsed_ms(started)},
+        "session_id": session_id
+    }, 500 if "error" in result else 200)
+
+
+async def execute_tools(scope, receive, send):
+    """批量执行一轮中的全部工具调用"""
+    started = time.perf_counter()
+    data = await read_json(receive)
+    session_id = data.get("session_id")
+    tool_calls = data.get("tool_calls") or []
+    agents = await require_session(session_id)
+    main_agent = agents["main_agent"]
+
+    tool_started = time.perf_counter()
+    taken = await run_blocking(take_prefetched, session_id, main_agent, tool_calls)
+    missing = [call for call, result in zip(tool_calls, taken) if result is None]
+    results = fill_results(taken, await main_agent.arun_tool_calls(missing) if missing else [])
+    tool_ms = elapsed_ms(tool_started)
+    for call, result in zip(tool_calls, results):
+        agents["messages"].append(main_agent.make_tool_message(call, result))
+    await run_blocking(session_store.save, session_id, agents)
+    await send_json(send, {
+        "type": "tool_results",
+        "results": [
+            {"tool_call_id": call["id"], "tool_name": call["function"]["name"], "result": result}
+            for call, result in zip(tool_calls, results)
+        ],
+        "prefetched": len(tool_calls) - len(missing),
+        "timing": {"tool_ms": tool_ms, "server_ms": elapsed_ms(started)},
+        "session_id": session_id
+    })
+
+
+async def stream_chat(scope, receive, send):
+    """以 SSE 推送完整的工具调用循环，事件与 server.py 的 /stream_chat 一致"""
+    data = await read_json(receive)
+    session_id = data.get("session_id", "default")
+    agents = await require_session(session_id, "会话不存在，请先调用 /start_session")
+    main_agent = agents["main_agent"]
+    llm_client = main_agent.llm_client
+    messages = agents["messages"]
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no")],
+    })
+
+    async def emit(event: str, payload: Dict):
+        await send({"type": "http.response.body", "body": sse_event(event, payload).encode('utf-8'),
+                    "more_body": True})
+
+    try:
+        tools = main_agent.get_tool_definitions()
+        while True:
+            response = None
+            payload, history_stats = await run_blocking(main_agent.prepare_messages, messages)
+            if history_stats["tokens_saved"]:
+                await emit("history", history_stats)
+            async for event in llm_client.astream_chat_completion(payload, tools=tools):
+                if event["type"] == "token":
+                    await emit("token", {"content": event["content"]})
+                else:
+                    response = event["response"]
+
+            if not llm_client.is_tool_call(response):
+                final_content = llm_client.extract_content(response)
+                messages.append({"role": "assistant", "content": final_content})
+                await run_blocking(remember_final_response, agents, final_content)
+                await emit("final_response", {"response": final_content, "session_id": session_id})
+                break
+
+            tool_calls = llm_client.extract_tool_calls(response)
+            message = llm_client.extract_content(response) or "正在执行工具调用..."
+            messages.append({"role": "assistant", "content": message, "tool_calls": tool_calls})
+            await emit("tool_call", {"message": message, "tool_calls": tool_calls})
+
+            # 每个工具完成即推送；消息历史仍按 tool_call 原顺序追加
+            results: List[Optional[Dict]] = [None] * len(tool_calls)
+            async for index, result in main_agent.aiter_tool_calls(tool_calls):
+                results[index] = result
+                call = tool_calls[index]
+                await emit("tool_result", {"tool_name": call["function"]["name"],
+                                           "tool_call_id": call.get("id"), "result": result})
+            for call, result in zip(tool_calls, results):
+                messages.append(main_agent.make_tool_message(call, result))
+    except Exception as e:
+        await emit("error", {"error": str(e)})
+    finally:
+        await run_blocking(session_store.save, session_id, agents)
+    await send({"type": "http.response.body", "body": b""})
+
+
+Handler = Callable[..., Awaitable[None]]
+ROUTES: Dict[Tuple[str, str], Handler] = {
+    ("GET", "/"): index,
+    ("GET", "/memories"): get_memories,
+    ("POST", "/memories/consolidate"): consolidate_memories,
+    ("GET", "/tool_cache"): get_tool_cache_stats,
+    ("GET", "/sessions"): get_session_stats,
+    ("GET", "/metrics"): get_metrics,
+    ("POST", "/start_session"): start_session,
+    ("POST", "/next_step"): next_step,
+    ("POST", "/execute_tool"): execute_tool,
+    ("POST", "/execute_tools"): execute_tools,
+    ("POST", "/stream_chat"): stream_chat,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_sessions()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        await send_json(send, {"error": "Not Found"}, 404)
+        return
+    started = time.perf_counter()
+    status = 500
+
+    async def send_with_status(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_with_status)
+    except HTTPError as e:
+        await send_json(send_with_status, {"error": str(e)}, e.status)
+    finally:
+        # 与 Flask 不同，流式响应计到最后一个分片发出为止
+        telemetry.observe("http_request_seconds", time.perf_counter() - started,
+                          route=scope["path"], method=scope["method"], status=status)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run("asgi:app", host='0.0.0.0', port=8000)
@@ -0,0 +1,268 @@
+# batch.py - 批量/离线查询：流式读取 JSONL 查询，按有界并发与端点限流运行完整的工具调用循环，
+# 结果逐行写入 JSONL，输出文件即检查点，中断后重新运行同一命令会跳过已完成的查询
+#
+# 运行: python batch.py queries.jsonl -o results.jsonl --base-url URL --api-key KEY [--model gpt-4]
+#                      [--work-dir .] [--concurrency 8] [--rate-limit 5] [--retry-errors] [--no-memory]
+# 输入每行一个 JSON 对象：id 取自 id/request_id 字段（缺省为行号），问题取自 query/user_input/question/prompt，
+# 或 title + body；可用 --id-field / --query-field 指定
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from agents import MainAgent, ContextAgent
+from agents.llm_client import LLMClient
+from agents.memory_agent import get_shared_memory_agent
+from agents.rate_limit import get_endpoint_limiter, set_endpoint_rate
+from agents.tool_cache import ToolResultCache
+from agents.tool_output import get_shared_output_governor
+
+ID_FIELDS = ("id", "request_id")
+QUERY_FIELDS = ("query", "user_input", "question", "prompt")
+
+
+def query_of(record: Dict, query_field: Optional[str] = None) -> str:
+    if query_field:
+        return str(record.get(query_field) or "")
+    for field in QUERY_FIELDS:
+        if record.get(field):
+            return str(record[field])
+    return "\n\n".join(str(record[f]) for f in ("title", "body") if record.get(f))
+
+
+def iter_queries(path: str, id_field: Optional[str] = None,
+                 query_field: Optional[str] = None) -> Iterator[Tuple[int, str, str]]:
+    """逐行读取输入，返回 (行号, id, 问题)；无法解析的行以空问题返回，由调用方记为错误"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                yield line_no, f"line-{line_no}", ""
+                continue
+            fields = (id_field,) if id_field else ID_FIELDS
+            query_id = next((str(record[k]) for k in fields if record.get(k) is not None), f"line-{line_no}")
+            yield line_no, query_id, query_of(record, query_field)
+
+
+def load_checkpoint(path: str) -> Dict[str, bool]:
+    """
+    读取已有输出，返回 {id: 是否成功}（同一 id 以最后一行为准）；
+    末尾不完整的行（崩溃时写了一半）会被截掉，保证追加后仍是合法 JSONL
+    """
+    done: Dict[str, bool] = {}
+    if not os.path.exists(path):
+        return done
+    valid_end = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            valid_end += len(line)
+            done[str(record.get("id"))] = "error" not in record
+    if valid_end != os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_end)
+    return done
+
+
+class ResultWriter:
+    """逐条追加结果并立即 flush；每 fsync_every 条 fsync 一次，崩溃最多丢失尚未 fsync 的几条"""
+
+    def __init__(self, path: str, fsync_every: int = 32):
+        self.file = open(path, 'a', encoding='utf-8')
+        self.fsync_every = fsync_every
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                os.fsync(self.file.fileno())
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+class BatchStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.latencies: List[float] = []
+        self._lock = threading.Lock()
+
+    def add(self, elapsed_ms: float, ok: bool):
+        with self._lock:
+            self.done += 1
+            self.failed += 0 if ok else 1
+            self.latencies.append(elapsed_ms)
+
+    def report(self) -> Dict:
+        with self._lock:
+            wall = time.monotonic() - self.started
+            latencies = sorted(self.latencies)
+
+        def pct(q: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))], 1) if latencies else 0.0
+
+        return {"done": self.done, "failed": self.failed, "skipped": self.skipped, "wall_s": round(wall, 2),
+                "queries_per_s": round(self.done / wall, 3) if wall else 0.0,
+                "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99)}
+
+
+class BatchRunner:
+    """每个查询一个独立的消息历史，工具缓存、目录快照缓存与记忆在所有查询之间共享"""
+
+    def __init__(self, endpoints: List[str], api_key: str, model_name: str, work_dir: str = ".",
+                 use_memory: bool = True, concurrency: int = 8, timeout: Optional[float] = None):
+        self.work_dir = os.path.abspath(work_dir)
+        self.clients = [LLMClient(url, api_key, model_name, timeout=timeout, pool_size=concurrency)
+                        for url in endpoints]
+        self.tool_cache = ToolResultCache(int(os.environ.get("MEMAGENT_TOOL_CACHE_BYTES", 64 * 1024 * 1024)))
+        self.memory_agent = None
+        self.context_agent = None
+        if use_memory:
+            self.memory_agent = get_shared_memory_agent(os.path.join(self.work_dir, "memory.json"))
+            self.context_agent = ContextAgent(self.memory_agent, mode=os.environ.get("MEMAGENT_RETRIEVAL", "keyword"))
+
+    def run_query(self, line_no: int, query_id: str, query: str) -> Dict:
+        # 按行号轮流分配端点，续跑时同一查询仍落到同一端点
+        client = self.clients[line_no % len(self.clients)]
+        record = {"id": query_id, "line": line_no, "endpoint": client.base_url}
+        started = time.perf_counter()
+        try:
+            if not query:
+                raise ValueError("无法从该行解析出问题")
+            main_agent = MainAgent(root_dir=self.work_dir, llm_client=client, tool_cache=self.tool_cache,
+                                   output_governor=get_shared_output_governor())
+            messages = []
+            if self.context_agent is not None:
+                relevant = self.context_agent.find_relevant_memories(query)
+                if relevant:
+                    context_str = "\n".join(f"{k}: {v}" for k, v in relevant.items())
+                    messages.append({"role": "system", "content": f"相关记忆:\n{context_str}"})
+            messages.append({"role": "user", "content": query})
+            answer = main_agent.chat_with_tools(messages)
+            record["answer"] = answer
+            if self.memory_agent is not None and answer:
+                self.memory_agent.remember_exchange(query, answer)
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return record
+
+    def close(self):
+        if self.memory_agent is not None:
+            self.memory_agent.save_memories()
+
+
+def run_batch(runner: BatchRunner, queries: Iterator[Tuple[int, str, str]], writer: ResultWriter,
+              skip: Set[str], concurrency: int, progress_interval: float = 10.0) -> BatchStats:
+    """
+    流式提交查询：进行中的查询数不超过 2 × concurrency，输入文件不会整体读入内存
+    结果按完成顺序写出；Ctrl-C 时不再提交新查询，已提交的完成后退出
+    """
+    stats = BatchStats()
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+    finished = threading.Event()
+
+    def run(line_no: int, query_id: str, query: str):
+        try:
+            record = runner.run_query(line_no, query_id, query)
+            writer.write(record)
+            stats.add(record["elapsed_ms"], "error" not in record)
+        finally:
+            in_flight.release()
+
+    def report_progress():
+        while not finished.wait(progress_interval):
+            print(f"[batch] {json.dumps(stats.report())}", file=sys.stderr, flush=True)
+
+    threading.Thread(target=report_progress, daemon=True).start()
+    seen: Set[str] = set()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        try:
+            for line_no, query_id, query in queries:
+                if query_id in skip or query_id in seen:
+                    stats.skipped += 1
+                    continue
+                seen.add(query_id)
+                in_flight.acquire()
+                pool.submit(run, line_no, query_id, query)
+        except KeyboardInterrupt:
+            print("[batch] 已中断，等待进行中的查询完成；重新运行同一命令即可续跑", file=sys.stderr)
+    finished.set()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量运行 JSONL 中的查询（支持断点续跑）")
+    parser.add_argument("input", help="输入 JSONL")
+    parser.add_argument("-o", "--output", required=True, help="结果 JSONL（同时作为检查点）")
+    parser.add_argument("--base-url", action="append", required=True,
+                        help="OpenAI 兼容端点，可重复指定多个，查询按行轮流分配")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY", ""))
+    parser.add_argument("--model", default="gpt-4")
+    parser.add_argument("--work-dir", default=".", help="工具可访问的目录，记忆文件为其中的 memory.json")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate-limit", action="append", default=[],
+                        help="每秒请求数：单个数字作用于每个端点，或 URL=数字 单独指定")
+    parser.add_argument("--timeout", type=float, help="单次模型请求超时（秒）")
+    parser.add_argument("--id-field")
+    parser.add_argument("--query-field")
+    parser.add_argument("--retry-errors", action="store_true", help="续跑时重新执行上次失败的查询")
+    parser.add_argument("--no-memory", action="store_true", help="不注入记忆，也不把结果写入记忆")
+    parser.add_argument("--progress", type=float, default=10.0, help="进度输出间隔（秒）")
+    args = parser.parse_args()
+    if not args.api_key:
+        parser.error("缺少 --api-key（或环境变量 OPENAI_API_KEY）")
+
+    endpoints = [url.rstrip('/') for url in args.base_url]
+    for spec in args.rate_limit:
+        url, _, rate = spec.rpartition("=")
+        for endpoint in ([url.rstrip('/')] if url else endpoints):
+            set_endpoint_rate(endpoint, float(rate))
+
+    done = load_checkpoint(args.output)
+    skip = {query_id for query_id, ok in done.items() if ok or not args.retry_errors}
+    if done:
+        print(f"[batch] 检查点中已有 {len(done)} 条结果，跳过 {len(skip)} 条", file=sys.stderr)
+
+    runner = BatchRunner(endpoints, args.api_key, args.model, args.work_dir,
+                         use_memory=not args.no_memory, concurrency=args.concurrency, timeout=args.timeout)
+    writer = ResultWriter(args.output)
+    try:
+        stats = run_batch(runner, iter_queries(args.input, args.id_field, args.query_field), writer, skip,
+                          args.concurrency, args.progress)
+    finally:
+        writer.close()
+        runner.close()
+    report = stats.report()
+    report["rate_limit_wait_s"] = {url: round(limiter.waited, 2) for url in endpoints
+                                   for limiter in [get_endpoint_limiter(url)] if limiter is not None}
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# benchmarks/__init__.py - 性能基准脚本（python -m benchmarks.<name> 运行）
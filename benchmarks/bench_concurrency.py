@@ -0,0 +1,72 @@
+# bench_concurrency.py - 并发会话压测：Flask（有界线程池）与 ASGI（asyncio）服务在模型慢响应下的吞吐对比
+#
+# 运行: python -m benchmarks.bench_concurrency [--levels 10 50 100 200 400] [--latency 0.5] [--flask-threads 16]
+# 需要 aiohttp 与 uvicorn；两种服务与模拟模型（benchmarks.mock_llm）各在独立子进程中运行（见 benchmarks.harness）
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.harness import percentile, spawn_mock_llm, spawn_server, stop
+
+
+async def run_session(client: aiohttp.ClientSession, url: str, session_id: str, llm_url: str,
+                      work_dir: str) -> float:
+    t0 = time.perf_counter()
+    async with client.post(f"{url}/start_session", json={
+            "session_id": session_id, "work_dir": work_dir, "base_url": llm_url, "api_key": "bench",
+            "user_input": f"bench question {session_id}"}) as r:
+        r.raise_for_status()
+        await r.read()
+    async with client.post(f"{url}/next_step", json={"session_id": session_id}) as r:
+        r.raise_for_status()
+        await r.read()
+    return time.perf_counter() - t0
+
+
+async def run_level(url: str, concurrency: int, llm_url: str, work_dir: str, tag: str):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=600)) as client:
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            run_session(client, url, f"{tag}-{concurrency}-{i}", llm_url, work_dir) for i in range(concurrency)
+        ), return_exceptions=True)
+        wall = time.perf_counter() - t0
+    latencies = sorted(r for r in results if isinstance(r, float))
+    errors = len(results) - len(latencies)
+    return len(latencies) / wall, percentile(latencies, 50), percentile(latencies, 95), errors
+
+
+def bench_server(kind: str, args, llm_url: str, work_dir: str):
+    proc, url = spawn_server(kind, args.flask_threads)
+    try:
+        for level in args.levels:
+            rate, p50, p95, errors = asyncio.run(run_level(url, level, llm_url, work_dir, kind))
+            print(f"{kind:>6} {level:>8} {rate:>8.1f} {p50:>8.2f} {p95:>8.2f} {errors:>7}")
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask 与 ASGI 服务的并发会话压测")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 50, 100, 200, 400])
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟模型延迟（秒）")
+    parser.add_argument("--flask-threads", type=int, default=16)
+    args = parser.parse_args()
+
+    mock, llm_url = spawn_mock_llm(args.latency)
+    print(f"mock latency {args.latency}s, flask threads {args.flask_threads}")
+    print(f"{'server':>6} {'sessions':>8} {'sess/s':>8} {'p50(s)':>8} {'p95(s)':>8} {'errors':>7}")
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for kind in ("flask", "asgi"):
+                bench_server(kind, args, llm_url, work_dir)
+    finally:
+        stop(mock)
+
+
+if __name__ == "__main__":
+    main()
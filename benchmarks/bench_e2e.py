@@ -0,0 +1,170 @@
+# bench_e2e.py - 端到端压测：按设定并发驱动 /start_session → /next_step → /execute_tool → /next_step 的完整会话
+# 统计各接口与整个会话的 p50/p95/p99、每秒请求数，以及耗时在模型 / 工具 / 服务自身 / 网络与排队之间的拆分
+#
+# 运行: python -m benchmarks.bench_e2e [--sessions 200] [--concurrency 20] [--latency 0.2] [--server flask|asgi]
+#                                      [--script script.json] [--files 50] [--prefetch] [--client-delay 0.05]
+# 仅依赖标准库（--server asgi 时服务端需要 aiohttp 与 uvicorn）；模拟模型与服务各在独立子进程中运行，可离线执行
+
+import argparse
+import http.client
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+from benchmarks.harness import percentile, spawn_mock_llm, spawn_server, stop
+
+STAGES = ("llm_ms", "tool_ms", "server_ms")
+
+
+class Recorder:
+    """线程安全地汇总各接口延迟与服务端上报的 timing"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.stages: Dict[str, float] = defaultdict(float)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, seconds: float, timing: Dict):
+        with self._lock:
+            self.requests += 1
+            self.latencies[endpoint].append(seconds * 1000)
+            self.stages["client_ms"] += seconds * 1000
+            for stage in STAGES:
+                self.stages[stage] += timing.get(stage, 0.0)
+
+    def add_session(self, seconds: float):
+        with self._lock:
+            self.latencies["session"].append(seconds * 1000)
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+
+class Client:
+    """每个工作线程一个 keep-alive 连接；服务端关闭连接时 http.client 会自动重连"""
+
+    def __init__(self, url: str, recorder: Recorder):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=600)
+        self.recorder = recorder
+
+    def post(self, endpoint: str, payload: Dict) -> Dict:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        t0 = time.perf_counter()
+        self.conn.request("POST", endpoint, body=body, headers={"Content-Type": "application/json"})
+        response = self.conn.getresponse()
+        data = json.loads(response.read() or b"{}")
+        elapsed = time.perf_counter() - t0
+        if response.status != 200:
+            raise RuntimeError(f"{endpoint} 返回 {response.status}: {data.get('error')}")
+        self.recorder.add(endpoint, elapsed, data.get("timing") or {})
+        return data
+
+
+def run_session(client: Client, session_id: str, llm_url: str, work_dir: str, max_steps: int,
+                client_delay: float = 0.0):
+    t0 = time.perf_counter()
+    client.post("/start_session", {"session_id": session_id, "work_dir": work_dir, "base_url": llm_url,
+                                   "api_key": "bench", "user_input": f"bench question {session_id}"})
+    for _ in range(max_steps):
+        step = client.post("/next_step", {"session_id": session_id})
+        if step["type"] != "tool_call":
+            break
+        for call in step["tool_calls"]:
+            if client_delay:
+                time.sleep(client_delay)  # 浏览器渲染工具调用并发回请求的耗时
+            client.post("/execute_tool", {"session_id": session_id, "tool_call": call})
+    client.recorder.add_session(time.perf_counter() - t0)
+
+
+def make_work_dir(root: str, files: int) -> str:
+    """生成供工具读取/列出的测试目录"""
+    work_dir = os.path.join(root, "work")
+    os.makedirs(work_dir)
+    for i in range(files):
+        with open(os.path.join(work_dir, f"file_{i:04d}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"benchmark file {i}\n" * 20)
+    return work_dir
+
+
+def report(recorder: Recorder, wall: float, args):
+    print(f"server {args.server}, mock latency {args.latency}s, sessions {args.sessions}, "
+          f"concurrency {args.concurrency}, prefetch {'on' if args.prefetch else 'off'}")
+    print(f"{'endpoint':<16} {'count':>7} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+    for endpoint in ("/start_session", "/next_step", "/execute_tool", "session"):
+        values = sorted(recorder.latencies.get(endpoint, []))
+        print(f"{endpoint:<16} {len(values):>7} {percentile(values, 50):>9.1f} "
+              f"{percentile(values, 95):>9.1f} {percentile(values, 99):>9.1f}")
+
+    sessions = len(recorder.latencies.get("session", []))
+    print(f"\nwall {wall:.2f}s, {recorder.requests / wall:.1f} req/s, {sessions / wall:.1f} sessions/s, "
+          f"errors {recorder.errors}")
+
+    # 服务端 server_ms 包含模型与工具耗时；客户端耗时再减去 server_ms 即网络与排队
+    stages = recorder.stages
+    split = {
+        "llm": stages["llm_ms"],
+        "tools": stages["tool_ms"],
+        "server": max(0.0, stages["server_ms"] - stages["llm_ms"] - stages["tool_ms"]),
+        "network/queue": max(0.0, stages["client_ms"] - stages["server_ms"]),
+    }
+    total = sum(split.values()) or 1.0
+    print("time split: " + ", ".join(f"{name} {value / total:.1%}" for name, value in split.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MemAgent 服务端到端压测（使用本地模拟模型）")
+    parser.add_argument("--sessions", type=int, default=200, help="会话总数")
+    parser.add_argument("--concurrency", type=int, default=20, help="并发会话数")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟模型延迟（秒）")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--flask-threads", type=int, default=16)
+    parser.add_argument("--script", help="模拟模型的 JSON 脚本（见 benchmarks.mock_llm）")
+    parser.add_argument("--files", type=int, default=50, help="测试目录中的文件数")
+    parser.add_argument("--max-steps", type=int, default=8, help="每个会话最多调用 /next_step 的次数")
+    parser.add_argument("--prefetch", action="store_true", help="服务端启用只读工具预取（MEMAGENT_PREFETCH=1）")
+    parser.add_argument("--client-delay", type=float, default=0.0,
+                        help="收到工具调用后客户端发起 /execute_tool 前的等待（秒），模拟浏览器往返")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        work_dir = make_work_dir(root, args.files)
+        mock, llm_url = spawn_mock_llm(args.latency, args.script)
+        # 记忆文件位于临时工作目录；会话固定存内存，避免在仓库中生成 sessions.db
+        env = {"MEMAGENT_SESSION_BACKEND": "memory", "MEMAGENT_PREFETCH": "1" if args.prefetch else ""}
+        server, url = spawn_server(args.server, args.flask_threads, env=env)
+        recorder = Recorder()
+        local = threading.local()
+
+        def worker(i: int):
+            if not hasattr(local, "client"):
+                local.client = Client(url, recorder)
+            try:
+                run_session(local.client, f"e2e-{i}", llm_url, work_dir, args.max_steps, args.client_delay)
+            except Exception as e:
+                recorder.add_error()
+                print(f"session e2e-{i} failed: {e}")
+                local.client.conn.close()
+
+        try:
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(worker, range(args.sessions)))
+            wall = time.perf_counter() - t0
+        finally:
+            stop(server)
+            stop(mock)
+    report(recorder, wall, args)
+
+
+if __name__ == "__main__":
+    main()
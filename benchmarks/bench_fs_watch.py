@@ -0,0 +1,175 @@
+# bench_fs_watch.py - 文件监听的"写入 -> 索引一致"延迟：高频改写/新建/删除文件时，三元组索引与目录快照缓存多久反映变更
+#
+# 运行: python -m benchmarks.bench_fs_watch [--files 5000] [--seconds 5] [--rate 500] [--max-delay 0.25] [--poll-interval 1]
+# 监听批次发布后校验索引中该文件的 mtime/size 与磁盘一致（删除则已移除），每 20 次写入抽查一次能否用唯一标记查到文件，
+# 记录自写入起的延迟
+# 对照组为不监听时每次查询前的全量 refresh（三元组索引默认每 5 秒做一次）
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Dict, Tuple
+
+from agents.fs_watcher import FileWatcher
+from agents.trigram_index import TrigramIndex
+from agents.tree_listing import DirectoryCache, list_tree
+from benchmarks.bench_trigram_index import make_tree
+from benchmarks.harness import percentile
+
+
+class ConsistencyProbe:
+    """记录每个文件最早一次尚未反映到索引中的写入，批次发布后校验并计算延迟"""
+
+    def __init__(self, index: TrigramIndex):
+        self.index = index
+        self.pending: Dict[str, Tuple[float, str]] = {}
+        self.latencies = []
+        self.transient = 0
+        self._lock = threading.Lock()
+
+    def consistent(self, rel_path: str, token: str) -> bool:
+        try:
+            st = os.stat(os.path.join(self.index.root, rel_path))
+        except OSError:
+            return rel_path not in self.index.files
+        known = self.index.files.get(rel_path)
+        if known is None or known[1:3] != (st.st_mtime_ns, st.st_size):
+            return False
+        return not token or rel_path in (self.index.candidates(token) or ())
+
+    def wrote(self, rel_path: str, token: str):
+        now = time.monotonic()
+        with self._lock:
+            first = self.pending.get(rel_path)
+            self.pending[rel_path] = (first[0] if first else now, token)
+
+    def __call__(self, changes):
+        now = time.monotonic()
+        with self._lock:
+            done = {p: self.pending.pop(p) for p in changes.files if p in self.pending}
+        for rel_path, (written, token) in done.items():
+            if not self.consistent(rel_path, token):
+                # 这次批次之后文件又被改写，留给下一批次
+                with self._lock:
+                    self.pending.setdefault(rel_path, (written, token))
+                continue
+            self.latencies.append(now - written)
+
+    def settle(self) -> int:
+        """写入结束后调用：两次轮询之间建了又删的文件不会产生任何事件，索引中本就没有它们，计为 transient；返回仍不一致的数量"""
+        with self._lock:
+            pending = list(self.pending.items())
+        for rel_path, (_, token) in pending:
+            if self.consistent(rel_path, "") and not os.path.exists(os.path.join(self.index.root, rel_path)):
+                with self._lock:
+                    self.pending.pop(rel_path, None)
+                    self.transient += 1
+        return len(self.pending)
+
+
+def churn(root: str, probe: ConsistencyProbe, n_files: int, seconds: float, rate: float, seed: int = 7) -> int:
+    """80% 改写已有文件，10% 新建，10% 删除之前新建的文件；rate 为每秒写入次数（0 表示不限速）"""
+    rng = random.Random(seed)
+    created = []
+    writes = 0
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        # 唯一标记只在抽查的写入中出现，其余写入内容互不相同但不参与查询
+        token = f"{rng.getrandbits(64):016x}" if writes % 20 == 0 else ""
+        roll = rng.random()
+        if roll < 0.1:
+            rel_path = f"pkg{rng.randrange(50)}/new{writes}.py"
+            created.append(rel_path)
+        elif roll < 0.2 and created:
+            rel_path = created.pop(rng.randrange(len(created)))
+            os.remove(os.path.join(root, rel_path))
+            probe.wrote(rel_path, token)
+            writes += 1
+            continue
+        else:
+            i = rng.randrange(n_files)
+            rel_path = f"pkg{i % 50}/mod{i % 7}/file{i}.py"
+        with open(os.path.join(root, rel_path), 'w') as f:
+            f.write(f"def churned():\n    return '{token or writes}'\n")
+        probe.wrote(rel_path, token)
+        writes += 1
+        if rate:
+            delay = started + writes / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    return writes
+
+
+def run(backend: str, args) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "tree")
+        make_tree(root, args.files)
+        index = TrigramIndex(root, os.path.join(tmp, "index.db"))
+        index.refresh()
+        t0 = time.perf_counter()
+        index.refresh()
+        full_refresh_ms = (time.perf_counter() - t0) * 1000
+        cache = DirectoryCache()
+        list_tree(root, max_depth=5, limit=args.files * 2, cache=cache)
+
+        probe = ConsistencyProbe(index)
+        t0 = time.perf_counter()
+        watcher = FileWatcher(root, backend=backend, max_delay=args.max_delay, poll_interval=args.poll_interval).start()
+        start_ms = (time.perf_counter() - t0) * 1000
+        index.watched = True
+        watcher.subscribe(index.apply_changes)
+        watcher.subscribe(cache.apply_changes)
+        watcher.subscribe(probe)
+
+        cpu0 = time.process_time()
+        writes = churn(root, probe, args.files, args.seconds, args.rate)
+        deadline = time.monotonic() + args.poll_interval * 2 + 5
+        while probe.pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+            if backend == "poll":
+                probe.settle()
+        cpu_s = time.process_time() - cpu0
+        watcher.stop()
+        stats = watcher.stats()
+        index.close()
+
+    latencies = sorted(x * 1000 for x in probe.latencies)
+    return {"backend": backend, "writes": writes, "batches": stats["batches"], "start_ms": start_ms,
+            "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "max": latencies[-1] if latencies else 0,
+            "unresolved": len(probe.pending), "transient": probe.transient, "cpu_s": cpu_s, "full_refresh_ms": full_refresh_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文件监听的写入到索引一致延迟")
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=500, help="每秒写入次数，0 表示不限速")
+    parser.add_argument("--max-delay", type=float, default=0.25, help="inotify 持续写入时一个批次最多攒多久（秒）")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--backend", choices=["inotify", "poll"], action="append",
+                        help="默认两种都测（inotify 不可用时跳过）")
+    args = parser.parse_args()
+
+    backends = args.backend or ["inotify", "poll"]
+    print(f"{args.files} files, {args.seconds:g}s churn at {args.rate:g} writes/s")
+    print(f"{'backend':<8} {'writes':>7} {'batches':>8} {'start(ms)':>10} {'p50(ms)':>8} {'p95(ms)':>8} "
+          f"{'max(ms)':>8} {'unresolved':>11} {'transient':>10} {'cpu(s)':>7}")
+    full_refresh_ms = None
+    for backend in backends:
+        try:
+            r = run(backend, args)
+        except OSError as e:
+            print(f"{backend:<8} 不可用: {e}")
+            continue
+        full_refresh_ms = r["full_refresh_ms"]
+        print(f"{backend:<8} {r['writes']:>7} {r['batches']:>8} {r['start_ms']:>10.1f} {r['p50']:>8.1f} "
+              f"{r['p95']:>8.1f} {r['max']:>8.1f} {r['unresolved']:>11} {r['transient']:>10} {r['cpu_s']:>7.2f}")
+    if full_refresh_ms is not None:
+        print(f"full index refresh without watching (no changes): {full_refresh_ms:.1f} ms per rescan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# bench_memory_index.py - 对比线性子串扫描与倒排索引的记忆检索耗时
+#
+# 运行: python -m benchmarks.bench_memory_index [--sizes 1000 10000 100000]
+
+import argparse
+import random
+import time
+from typing import Dict, List
+
+from agents.memory_index import MemoryIndex
+
+_SUBJECTS = ["文件", "目录", "日志", "配置", "接口", "数据库", "缓存", "会话", "模型", "工具"]
+_VERBS = ["读取", "搜索", "统计", "删除", "更新", "解析", "列出", "比较", "备份", "检查"]
+_SYLLABLES = ["ka", "lo", "mi", "ser", "ver", "to", "ken", "da", "ta", "ne", "ro", "qu", "ix", "al"]
+
+
+def make_vocab(size: int, rng: random.Random) -> List[str]:
+    """生成标识符词表，查询时按 Zipf 分布抽样以模拟真实词频"""
+    vocab = set()
+    while len(vocab) < size:
+        vocab.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(vocab)
+
+
+def make_memories(n: int, seed: int = 42) -> Dict[str, str]:
+    """生成 n 条与 memory.json 同格式的合成记忆"""
+    rng = random.Random(seed)
+    vocab = make_vocab(5000, rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    memories = {}
+    for i in range(n):
+        w1, w2, w3 = rng.choices(vocab, weights, k=3)
+        question = f"如何{rng.choice(_VERBS)}{rng.choice(_SUBJECTS)}中的 {w1} 第{i}号"
+        answer = (f"在 {w2}.py 中{rng.choice(_VERBS)}{rng.choice(_SUBJECTS)} {w3}，"
+                  f"参见第 {rng.randint(1, 500)} 行")
+        memories[f"Q: {question[:50]}..."] = f"问题：{question}；解答：{answer}"
+    return memories
+
+
+def linear_scan(memories: Dict[str, str], query: str, top_k: int = 3) -> Dict[str, str]:
+    """原 ContextAgent.find_relevant_memories 的子串扫描实现"""
+    relevant = {}
+    query_lower = query.lower()
+    for key, value in memories.items():
+        if query_lower in key.lower() or query_lower in value.lower():
+            relevant[key] = value
+            if len(relevant) >= top_k:
+                break
+    return relevant
+
+
+def bench(n: int, queries: List[str], repeat: int) -> Dict[str, float]:
+    memories = make_memories(n)
+
+    t0 = time.perf_counter()
+    index = MemoryIndex()
+    index.build(memories)
+    build_s = time.perf_counter() - t0
+
+    scan_hits = index_hits = 0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            scan_hits += bool(linear_scan(memories, q))
+    scan_ms = (time.perf_counter() - t0) * 1000 / (repeat * len(queries))
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            index_hits += bool(index.search(q, 3))
+    index_ms = (time.perf_counter() - t0) * 1000 / (repeat * len(queries))
+
+    total = repeat * len(queries)
+    return {
+        "n": n,
+        "build_s": build_s,
+        "scan_ms": scan_ms,
+        "index_ms": index_ms,
+        "scan_hit_rate": scan_hits / total,
+        "index_hit_rate": index_hits / total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    vocab = make_vocab(5000, random.Random(42))
+    queries = ["第42号", "数据库配置在哪"] + [
+        f"{rng.choice(_VERBS)} {w} 在哪" for w in rng.sample(vocab[:2000], 18)]
+    print(f"{'entries':>8} {'build(s)':>9} {'scan(ms)':>10} {'index(ms)':>10} "
+          f"{'speedup':>8} {'scan hit':>9} {'index hit':>10}")
+    for n in args.sizes:
+        r = bench(n, queries, args.repeat)
+        print(f"{r['n']:>8} {r['build_s']:>9.2f} {r['scan_ms']:>10.3f} {r['index_ms']:>10.3f} "
+              f"{r['scan_ms'] / max(r['index_ms'], 1e-9):>7.1f}x "
+              f"{r['scan_hit_rate']:>9.0%} {r['index_hit_rate']:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# bench_memory_load.py - 记忆库启动耗时与常驻内存：journal（memory.json 快照）与 compact（key + 指针，值经 mmap 读取）对比
+#
+# 运行: python -m benchmarks.bench_memory_load [--memories 20000] [--value-bytes 4000]
+# 每种格式在独立子进程中加载，测量构造 MemoryAgent、第一次检索与读取一页 /memories 的耗时及最大 RSS 增量
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.harness import REPO_ROOT
+
+PROBE = r"""
+import json, os, resource, sys, time
+os.environ["MEMAGENT_MEMORY_STORE"] = sys.argv[2]
+os.environ["MEMAGENT_MAX_MEMORIES"] = "0"
+from agents.memory_agent import MemoryAgent
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+agent = MemoryAgent(sys.argv[1])
+load_ms = (time.perf_counter() - t0) * 1000
+load_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+t0 = time.perf_counter()
+agent.list_memories(limit=50)
+page_ms = (time.perf_counter() - t0) * 1000
+t0 = time.perf_counter()
+agent.index.search("topic 42 question", 3)
+search_ms = (time.perf_counter() - t0) * 1000
+print(json.dumps({"entries": len(agent.memories), "load_ms": load_ms, "load_rss_kb": load_rss,
+                  "page_ms": page_ms, "first_search_ms": search_ms}))
+"""
+
+
+def make_memories(path: str, n: int, value_bytes: int):
+    filler = "这是一段较长的解答正文，用于模拟多段落的回答。" * (value_bytes // 60 + 1)
+    memories = {f"Q: question {i} about topic {i % 997}... #{i:012x}":
+                f"问题：question {i} about topic {i % 997}；解答：{filler[:value_bytes // 3]}" for i in range(n)}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(memories, f, ensure_ascii=False, indent=2)
+
+
+def probe(memory_file: str, kind: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE, memory_file, kind], cwd=REPO_ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="记忆库加载耗时与内存对比")
+    parser.add_argument("--memories", type=int, default=20000)
+    parser.add_argument("--value-bytes", type=int, default=4000, help="每条记忆正文的近似字节数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_file = os.path.join(tmp, "memory.json")
+        make_memories(memory_file, args.memories, args.value_bytes)
+        print(f"{args.memories} memories, snapshot {os.path.getsize(memory_file) / 1e6:.1f} MB")
+        probe(memory_file, "compact")  # 首次打开时从 memory.json 导入，不计入结果
+        print(f"{'store':<8} {'load(ms)':>9} {'load RSS(MB)':>13} {'page(ms)':>9} {'1st search(ms)':>15}")
+        for kind in ("journal", "compact"):
+            r = probe(memory_file, kind)
+            print(f"{kind:<8} {r['load_ms']:>9.1f} {r['load_rss_kb'] / 1024:>13.1f} {r['page_ms']:>9.1f} "
+                  f"{r['first_search_ms']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
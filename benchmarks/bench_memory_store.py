@@ -0,0 +1,53 @@
+# bench_memory_store.py - 对比整文件重写与追加日志两种记忆存储的写入/加载耗时
+#
+# 运行: python -m benchmarks.bench_memory_store [--base 100000] [--writes 200]
+
+import argparse
+import os
+import tempfile
+import time
+
+from agents.memory_store import JournalMemoryStore, JsonMemoryStore, atomic_write_json
+from benchmarks.bench_memory_index import make_memories
+
+
+def bench_store(store_cls, path: str, writes: int):
+    store = store_cls(path)
+    t0 = time.perf_counter()
+    store.load()
+    load_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for i in range(writes):
+        store.set(f"Q: bench-{i}...", f"问题：bench-{i}；解答：ok")
+    store.flush()
+    write_ms = (time.perf_counter() - t0) * 1000 / writes
+    store.close()
+
+    # 重新加载：日志存储需要重放刚才追加的条目
+    t0 = time.perf_counter()
+    reloaded = store_cls(path)
+    count = len(reloaded.load())
+    reload_s = time.perf_counter() - t0
+    reloaded.close()
+    return load_s, write_ms, reload_s, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base", type=int, default=100000, help="预先存在的记忆条数")
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    base = make_memories(args.base)
+    print(f"{'store':>20} {'load(s)':>8} {'write(ms)':>10} {'reload(s)':>10} {'entries':>8}")
+    for store_cls in (JsonMemoryStore, JournalMemoryStore):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "memory.json")
+            atomic_write_json(path, base)
+            load_s, write_ms, reload_s, count = bench_store(store_cls, path, args.writes)
+            print(f"{store_cls.__name__:>20} {load_s:>8.2f} {write_ms:>10.3f} {reload_s:>10.2f} {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# bench_tree_listing.py - list_tree（目录快照缓存）与逐目录 listdir + isfile 的耗时对比
+#
+# 运行: python -m benchmarks.bench_tree_listing [--files 100000] [--root 已有目录] [--page 200]
+# 不指定 --root 时在临时目录生成合成目录树
+
+import argparse
+import os
+import tempfile
+import time
+
+from agents.tree_listing import DirectoryCache, list_tree
+
+
+def make_tree(root: str, n_files: int):
+    """生成 n_files 个空文件，分布在两层共约 n_files/50 个目录中"""
+    for i in range(n_files):
+        d = os.path.join(root, f"pkg{i % 40}", f"mod{(i // 40) % 50}")
+        if i < 2000:
+            os.makedirs(d, exist_ok=True)
+        open(os.path.join(d, f"file{i}.txt"), 'w').close()
+
+
+def listdir_walk(root: str) -> int:
+    """旧方式：每个目录一次 list_files 工具调用（listdir + 每个条目一次 isfile）"""
+    count = 0
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        for name in os.listdir(d):
+            path = os.path.join(d, name)
+            if os.path.isfile(path):
+                count += 1
+            elif os.path.isdir(path):
+                stack.append(path)
+    return count
+
+
+def full_listing(root: str, cache: DirectoryCache, page: int) -> int:
+    count, cursor = 0, None
+    while True:
+        result = list_tree(root, max_depth=64, limit=page, cursor=cursor, cache=cache)
+        count += len(result["entries"])
+        cursor = result["next_cursor"]
+        if not cursor:
+            return count
+
+
+def timed(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="目录树列表耗时对比")
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--root", help="使用已有目录而不是生成合成树")
+    parser.add_argument("--page", type=int, default=200, help="list_tree 每页条目数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.root or tmp
+        if not args.root:
+            make_tree(root, args.files)
+        cache = DirectoryCache(max_entries=10 * args.files + 100000)
+        print(f"listdir + isfile (all dirs): {timed(lambda: listdir_walk(root)):9.1f} ms")
+        print(f"list_tree first page, cold:  {timed(lambda: list_tree(root, limit=args.page, cache=cache)):9.1f} ms")
+        print(f"list_tree first page, warm:  {timed(lambda: list_tree(root, limit=args.page, cache=cache)):9.1f} ms")
+        print(f"list_tree all pages, cold:   {timed(lambda: full_listing(root, DirectoryCache(), args.page)):9.1f} ms")
+        full_listing(root, cache, args.page)
+        print(f"list_tree all pages, warm:   {timed(lambda: full_listing(root, cache, args.page)):9.1f} ms")
+
+        def deep_page():
+            result = list_tree(root, max_depth=64, limit=args.page, cache=cache)
+            for _ in range(10):
+                result = list_tree(root, max_depth=64, limit=args.page, cursor=result["next_cursor"], cache=cache)
+        print(f"list_tree 11 pages, warm:    {timed(deep_page):9.1f} ms")
+        print(f"cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
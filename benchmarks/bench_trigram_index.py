@@ -0,0 +1,80 @@
+# bench_trigram_index.py - 三元组索引查询与暴力扫描（search_tree）的耗时对比
+#
+# 运行: python -m benchmarks.bench_trigram_index [--files 20000] [--root 已有目录]
+# 不指定 --root 时在临时目录生成合成代码树
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from agents.search import search_tree
+from agents.trigram_index import TrigramIndex
+
+_WORDS = ["config", "server", "session", "memory", "token", "request", "handler", "cache", "index",
+          "timeout", "retry", "client", "parser", "stream", "buffer", "worker", "queue", "event"]
+
+
+def make_tree(root: str, n_files: int, seed: int = 1):
+    """生成 n_files 个类 Python 源文件，每个约 2KB，少数文件含稀有标识符"""
+    rng = random.Random(seed)
+    for i in range(n_files):
+        d = os.path.join(root, f"pkg{i % 50}", f"mod{i % 7}")
+        os.makedirs(d, exist_ok=True)
+        lines = []
+        for j in range(40):
+            a, b = rng.sample(_WORDS, 2)
+            lines.append(f"    {a}_{b} = get_{b}({a}, retries={rng.randint(0, 9)})  # line {j}")
+        if i % 1000 == 7:
+            lines.append("    raise RareSentinelError('needle_in_haystack')")
+        with open(os.path.join(d, f"file{i}.py"), 'w') as f:
+            f.write(f"def func_{i}():\n" + "\n".join(lines) + "\n")
+
+
+def timed(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--root", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.root
+        if root is None:
+            root = os.path.join(tmp, "tree")
+            t0 = time.perf_counter()
+            make_tree(root, args.files)
+            print(f"generated {args.files} files in {time.perf_counter() - t0:.1f}s")
+
+        index = TrigramIndex(root, os.path.join(tmp, "trigram.db"), refresh_interval=3600)
+        t0 = time.perf_counter()
+        info = index.refresh()
+        print(f"index build: {time.perf_counter() - t0:.2f}s, {info['files']} files, "
+              f"{index.stats()['index_bytes'] / 1e6:.1f} MB")
+        t0 = time.perf_counter()
+        index.refresh()
+        print(f"no-op refresh (stat only): {time.perf_counter() - t0:.2f}s")
+
+        queries = [("needle_in_haystack", False), ("RareSentinel\\w+", True),
+                   ("func_1234\\(", True), ("get_timeout", False)]
+        print(f"{'query':>22} {'brute(ms)':>10} {'index(ms)':>10} {'candidates':>11} {'matches':>8}")
+        for pattern, regex in queries:
+            brute = timed(lambda: list(search_tree(root, pattern, regex=regex, max_results=10 ** 9)), args.repeat)
+            stats = {}
+            indexed = timed(lambda: list(index.search(pattern, regex=regex, max_results=10 ** 9, stats=stats)),
+                            args.repeat)
+            matches = len(list(index.search(pattern, regex=regex, max_results=10 ** 9)))
+            print(f"{pattern:>22} {brute:>10.1f} {indexed:>10.1f} {stats['candidates']:>11} {matches:>8}")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
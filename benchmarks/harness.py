@@ -0,0 +1,123 @@
+# harness.py - 压测公共设施：在子进程中启动模拟模型与 Flask/ASGI 服务、等待就绪、分位数统计（仅依赖标准库）
+#
+# 子进程入口: python -m benchmarks.harness --serve flask|asgi --port 8000 [--flask-threads 16]
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from typing import List, Optional, Tuple
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """固定大小线程池的 WSGI 服务，模拟 gunicorn gthread 等按线程数限制并发的部署"""
+    request_queue_size = 1024
+    threads = 16
+
+    def process_request(self, request, client_address):
+        if not hasattr(self, "_pool"):
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+
+def serve(kind: str, port: int, threads: int):
+    if kind == "flask":
+        from server import app
+        PooledWSGIServer.threads = threads
+        make_server("127.0.0.1", port, app, server_class=PooledWSGIServer,
+                    handler_class=_QuietHandler).serve_forever()
+    else:
+        import uvicorn
+        uvicorn.run("asgi:app", host="127.0.0.1", port=port, log_level="warning", backlog=2048)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1.0).close()
+            return
+        except urllib.error.HTTPError:
+            return  # 服务已在响应
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"服务未就绪: {url}")
+
+
+def spawn_mock_llm(latency: float, script: Optional[str] = None,
+                   chunk_delay: float = 0.0) -> Tuple[subprocess.Popen, str]:
+    """在子进程中启动 benchmarks.mock_llm，返回 (进程, base_url)"""
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.mock_llm", "--port", str(port), "--latency", str(latency),
+               "--chunk-delay", str(chunk_delay)]
+    if script:
+        command += ["--script", script]
+    proc = subprocess.Popen(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}/v1"
+    wait_ready(base_url)
+    return proc, base_url
+
+
+def spawn_server(kind: str, flask_threads: int = 16, env: Optional[dict] = None) -> Tuple[subprocess.Popen, str]:
+    """在子进程中启动 Flask（有界线程池）或 ASGI 服务，返回 (进程, 服务地址)"""
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "-m", "benchmarks.harness", "--serve", kind, "--port", str(port),
+                             "--flask-threads", str(flask_threads)], cwd=REPO_ROOT,
+                            env={**os.environ, **(env or {})})
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(f"{url}/sessions")
+    except RuntimeError:
+        stop(proc)
+        raise
+    return proc, url
+
+
+def stop(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法分位数，sorted_values 须已升序排列；空列表返回 nan"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="压测用的服务子进程入口")
+    parser.add_argument("--serve", choices=["flask", "asgi"], required=True)
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--flask-threads", type=int, default=16)
+    args = parser.parse_args()
+    serve(args.serve, args.port, args.flask_threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# mock_llm.py - 本地模拟的 OpenAI 兼容聊天接口：按脚本确定性地返回工具调用或最终回答，可配置延迟与流式输出
+# 基于 asyncio，单线程即可同时挂起上千个请求，避免模拟服务本身成为瓶颈
+#
+# 运行: python -m benchmarks.mock_llm [--port 9000] [--latency 0.5] [--script script.json] [--chunk-delay 0.01]
+#
+# 脚本为步骤列表，第 N 步对应本轮（最后一条 user 消息之后）已有 N 次 assistant 回复时的请求，超出则重复最后一步：
+# [
+#   {"tool_calls": [{"name": "list_files", "arguments": {}}], "latency": 0.2},
+#   {"content": "当前目录下有 3 个文件。"}
+# ]
+
+import argparse
+import asyncio
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 默认脚本：先列目录，再给出最终回答
+DEFAULT_SCRIPT = [
+    {"content": "先查看目录。", "tool_calls": [{"name": "list_files", "arguments": {}}]},
+    {"content": "当前目录下的文件已列出，共若干个。"},
+]
+
+
+def load_script(path: Optional[str]) -> List[Dict]:
+    if not path:
+        return DEFAULT_SCRIPT
+    with open(path, 'r', encoding='utf-8') as f:
+        script = json.load(f)
+    if not isinstance(script, list) or not script:
+        raise ValueError("脚本必须是非空的步骤列表")
+    return script
+
+
+def current_step(messages: List[Dict]) -> int:
+    """本轮已有的 assistant 回复数，即应执行的脚本步骤"""
+    step = 0
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            break
+        if message.get("role") == "assistant":
+            step += 1
+    return step
+
+
+class MockLLM:
+    def __init__(self, latency: float = 0.5, script: Optional[List[Dict]] = None, chunk_delay: float = 0.0):
+        self.latency = latency
+        self.script = script or DEFAULT_SCRIPT
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.host = "127.0.0.1"
+        self.port: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self, port: int = 0):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, port, backlog=2048)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def shutdown(self):
+        """从其他线程停止后台运行的服务"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def reply_for(self, messages: List[Dict]) -> Tuple[Dict, float]:
+        """按脚本生成 (assistant 消息, 延迟)；工具调用 id 由步骤与序号决定，保证可复现"""
+        step_no = current_step(messages)
+        step = self.script[min(step_no, len(self.script) - 1)]
+        message = {"role": "assistant", "content": step.get("content", "")}
+        if step.get("tool_calls"):
+            message["tool_calls"] = [{
+                "id": f"call_{step_no}_{i}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}),
+                                                                          ensure_ascii=False)}
+            } for i, call in enumerate(step["tool_calls"])]
+        return message, step.get("latency", self.latency)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 keep-alive：同一连接上顺序处理多个请求"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                path = request_line.split()[1].decode()
+                if not path.endswith("/chat/completions"):
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+                    continue
+                if not await self._respond(json.loads(body or b"{}"), writer):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, payload: Dict, writer: asyncio.StreamWriter) -> bool:
+        """写出响应；返回 False 表示应关闭连接"""
+        self.requests += 1
+        message, latency = self.reply_for(payload.get("messages") or [])
+        await asyncio.sleep(latency)
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+        if payload.get("stream"):
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+            for chunk in self._stream_chunks(message):
+                writer.write(f"data: {json.dumps({'choices': [{'index': 0, 'delta': chunk}]}, ensure_ascii=False)}"
+                             f"\n\n".encode('utf-8'))
+                if self.chunk_delay:
+                    await writer.drain()
+                    await asyncio.sleep(self.chunk_delay)
+            done = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+            writer.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+            await writer.drain()
+            return False
+        body = json.dumps({"choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]},
+                          ensure_ascii=False).encode('utf-8')
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+        return True
+
+    @staticmethod
+    def _stream_chunks(message: Dict) -> List[Dict]:
+        """文本按词切分为增量；工具调用先发 id/名称，参数分两段发送，模拟真实服务的分片"""
+        chunks = [{"content": word} for word in message["content"].split(" ") if word]
+        for i, call in enumerate(message.get("tool_calls") or []):
+            arguments = call["function"]["arguments"]
+            half = len(arguments) // 2
+            chunks.append({"tool_calls": [{"index": i, "id": call["id"], "type": "function",
+                                           "function": {"name": call["function"]["name"], "arguments": ""}}]})
+            chunks.append({"tool_calls": [{"index": i, "function": {"arguments": arguments[:half]}}]})
+            chunks.append({"tool_calls": [{"index": i, "function": {"arguments": arguments[half:]}}]})
+        return chunks
+
+
+def start_mock_llm(latency: float = 0.5, port: int = 0, script: Optional[List[Dict]] = None,
+                   chunk_delay: float = 0.0) -> MockLLM:
+    """在后台线程的事件循环中启动模拟服务；port=0 时自动分配端口，通过 base_url 获取地址"""
+    mock = MockLLM(latency=latency, script=script, chunk_delay=chunk_delay)
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(mock.start(port))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="mock-llm", daemon=True).start()
+    ready.wait()
+    return mock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的 OpenAI 兼容聊天接口")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.5, help="每个请求的模拟延迟（秒），脚本步骤可单独覆盖")
+    parser.add_argument("--script", help="JSON 脚本文件，默认先调用 list_files 再给出回答")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式输出时每个分片之间的间隔（秒）")
+    args = parser.parse_args()
+
+    async def serve():
+        mock = MockLLM(latency=args.latency, script=load_script(args.script), chunk_delay=args.chunk_delay)
+        await mock.start(args.port)
+        print(f"mock LLM listening on {mock.base_url}", flush=True)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
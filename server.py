@@ -2,40 +2,178 @@
 
 import os
 import json
-from flask import Flask, request, jsonify
-from agents import MainAgent, MemoryAgent, ContextAgent
+import time
+from typing import Dict, List, Optional
+from flask import Flask, Response, g, request, jsonify
+from agents import MainAgent, ContextAgent
 from agents.llm_client import LLMClient
+from agents.memory_agent import get_shared_memory_agent
+from agents.memory_store import store_files_pattern
+from agents.history import HistoryManager
+from agents.tool_cache import ToolResultCache
+from agents.session_store import create_session_store
+from agents.telemetry import bind_trace, telemetry, unbind_trace
+from agents.tree_listing import get_shared_listing_cache
+from agents.tool_output import get_shared_output_governor
+from agents.prefetch import get_shared_prefetcher
 
 
 app = Flask(__name__, static_folder='webui')
-# 移除全局代理，改为会话级状态管理
-session_agents = {}
+# 所有会话共享的工具结果缓存
+tool_cache = ToolResultCache(max_bytes=int(os.environ.get("MEMAGENT_TOOL_CACHE_BYTES", 64 * 1024 * 1024)))
+# 只读工具预取（MEMAGENT_PREFETCH=1 时启用，否则为 None）
+prefetcher = get_shared_prefetcher()
+
+
+def build_agents(work_dir: str, llm_config: dict = None, client_class=LLMClient) -> dict:
+    """按会话配置创建代理实例；client_class 可换成 AsyncLLMClient（ASGI 模式）"""
+    # 初始化 LLM 客户端
+    llm_client = None
+    if llm_config and llm_config.get("base_url") and llm_config.get("api_key"):
+        llm_client = client_class(
+            base_url=llm_config["base_url"],
+            api_key=llm_config["api_key"],
+            model_name=llm_config["model_name"],
+            timeout=llm_config.get("timeout")
+        )
+
+    history = HistoryManager(max_tokens=int(os.environ.get("MEMAGENT_HISTORY_TOKENS", 16000)))
+    main_agent = MainAgent(root_dir=work_dir, llm_client=llm_client, tool_cache=tool_cache, history=history,
+                           output_governor=get_shared_output_governor())
+    if os.environ.get("MEMAGENT_TRIGRAM_INDEX"):
+        main_agent.enable_trigram_index()
+    # 同一工作目录的会话共享一个记忆代理
+    memory_agent = get_shared_memory_agent(os.path.join(work_dir, "memory.json"))
+    context_agent = ContextAgent(memory_agent, mode=os.environ.get("MEMAGENT_RETRIEVAL", "keyword"))
+    if os.environ.get("MEMAGENT_RESPONSE_CACHE"):
+        memory_agent.enable_response_cache(float(os.environ.get("MEMAGENT_RESPONSE_CACHE_THRESHOLD", 1.0)),
+                                           float(os.environ.get("MEMAGENT_RESPONSE_CACHE_TTL", 86400)))
+    if os.environ.get("MEMAGENT_FS_WATCH"):
+        # 文件变更在后台推送给索引与缓存；响应缓存据此提前清除依赖文件已变化的回答
+        watcher = main_agent.enable_watcher()
+        watcher.ignore_files(store_files_pattern(memory_agent.memory_file))
+        if memory_agent.response_cache is not None:
+            watcher.subscribe(memory_agent.response_cache.apply_changes)
+    return {
+        "main_agent": main_agent,
+        "memory_agent": memory_agent,
+        "context_agent": context_agent
+    }
+
+
+# 会话级状态：数量/空闲时间/字节预算有上限，可选 SQLite 后端供多 worker 共享
+session_store = create_session_store(build_agents)
 
 
 def get_or_create_agents(session_id: str, work_dir: str = ".", llm_config: dict = None):
     """按会话ID管理代理实例"""
-    if session_id not in session_agents:
-        # 初始化 LLM 客户端
-        llm_client = None
-        if llm_config and llm_config.get("base_url") and llm_config.get("api_key"):
-            llm_client = LLMClient(
-                base_url=llm_config["base_url"],
-                api_key=llm_config["api_key"],
-                model_name=llm_config["model_name"]
-            )
-        
-        main_agent = MainAgent(root_dir=work_dir, llm_client=llm_client)
-        memory_agent = MemoryAgent(memory_file=os.path.join(work_dir, "memory.json"))
-        context_agent = ContextAgent(memory_agent)
-        
-        session_agents[session_id] = {
-            "main_agent": main_agent,
-            "memory_agent": memory_agent,
-            "context_agent": context_agent,
-            "messages": []  # 存储对话历史
-        }
-    
-    return session_agents[session_id]
+    agents = session_store.get(session_id)
+    if agents is None:
+        agents = session_store.create(session_id, work_dir, llm_config)
+    return agents
+
+
+def remember_final_response(agents: dict, final_content: str):
+    """把本轮最终回复与最近一次用户提问写入记忆"""
+    messages = agents["messages"]
+    if len(messages) >= 2:
+        user_msg = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        sources = agents["main_agent"].collect_sources(messages)
+        agents["memory_agent"].remember_exchange(user_msg, final_content, sources)
+
+
+def answer_from_cache(agents: dict, user_input: str):
+    """响应缓存命中时直接写入问答并返回命中信息，跳过大模型调用；未启用或未命中返回 None"""
+    response_cache = agents["memory_agent"].response_cache
+    if response_cache is None:
+        return None
+    with telemetry.span("response_cache_lookup") as span:
+        hit = response_cache.lookup(user_input)
+        span.set(hit=hit is not None)
+    if hit is not None:
+        agents["messages"] = [
+            {"role": "user", "content": user_input},
+            {"role": "assistant", "content": hit["answer"]}
+        ]
+    return hit
+
+
+def memory_page(memory_agent, params) -> dict:
+    """/memories 的分页与过滤参数：offset、limit（至多 500）、q（key 子串）、search（相关度）、
+    full=1 返回完整的值；给出 key 时只返回该条记忆"""
+    if params.get("key"):
+        value = memory_agent.get_memory(params["key"])
+        return {"key": params["key"], "value": value} if value is not None else {"error": "记忆不存在"}
+    return memory_agent.list_memories(
+        offset=int(params.get("offset") or 0),
+        limit=min(500, int(params.get("limit") or 50)),
+        query=params.get("q") or None,
+        search=params.get("search") or None,
+        preview=0 if params.get("full") in ("1", "true") else 200
+    )
+
+
+def take_prefetched(session_id: str, main_agent, tool_calls: list) -> list:
+    """取用 /next_step 时预取的结果，未预取或已失效的位置为 None"""
+    if prefetcher is None:
+        return [None] * len(tool_calls)
+    return prefetcher.take_all(session_id, tool_calls, main_agent)
+
+
+def fill_results(taken: list, fresh: list) -> list:
+    """把现场执行的结果按顺序填入 take_prefetched 留下的空位"""
+    fresh = iter(fresh)
+    return [result if result is not None else next(fresh) for result in taken]
+
+
+def elapsed_ms(start: float) -> float:
+    """自 start（time.perf_counter()）起经过的毫秒数，用于响应中的 timing 字段"""
+    return round((time.perf_counter() - start) * 1000, 3)
+
+
+def metrics_gauges() -> dict:
+    """/metrics 中附带的即时值：工具缓存、目录快照缓存与会话存储的规模"""
+    cache_stats = tool_cache.stats()
+    listing_stats = get_shared_listing_cache().stats()
+    session_stats = session_store.stats()
+    return {
+        "tool_cache_entries": cache_stats["entries"],
+        "tool_cache_bytes": cache_stats["bytes"],
+        "listing_cache_dirs": listing_stats["dirs"],
+        "listing_cache_entries": listing_stats["entries"],
+        "sessions": session_stats["sessions"],
+        "session_bytes": session_stats["bytes"],
+        **({"prefetch_pending": prefetcher.stats()["pending"]} if prefetcher is not None else {}),
+    }
+
+
+def sse_event(event: str, data: dict) -> str:
+    """编码一条 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.before_request
+def start_request_trace():
+    """按请求体中的 session_id 绑定追踪上下文，本请求内的 span 都归属该会话"""
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    g.trace_token = bind_trace(data.get("session_id", "default") if isinstance(data, dict) else None)
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # 流式响应只计到响应头发出为止
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    telemetry.observe("http_request_seconds", time.perf_counter() - g.request_started,
+                      route=rule, method=request.method, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_trace(exc):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        unbind_trace(token)
 
 
 @app.route('/')
@@ -45,9 +183,40 @@ def index():
 
 @app.route('/memories', methods=['GET'])
 def get_memories():
-    """获取所有记忆条目（使用默认会话）"""
+    """分页浏览记忆条目（使用默认会话），参数见 memory_page"""
     agents = get_or_create_agents("default")
-    return jsonify(agents["memory_agent"].memories)
+    try:
+        page = memory_page(agents["memory_agent"], request.args)
+    except ValueError:
+        return jsonify({"error": "offset/limit 必须是整数"}), 400
+    return jsonify(page), 404 if "error" in page else 200
+
+
+@app.route('/memories/consolidate', methods=['POST'])
+def consolidate_memories():
+    """合并近似重复的记忆并按容量上限淘汰，再写入新快照（使用默认会话的记忆文件）"""
+    memory_agent = get_or_create_agents("default")["memory_agent"]
+    result = memory_agent.consolidate()
+    memory_agent.save_memories()
+    return jsonify(result)
+
+
+@app.route('/tool_cache', methods=['GET'])
+def get_tool_cache_stats():
+    """工具结果缓存的命中/未命中统计"""
+    return jsonify(tool_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的指标：模型/工具/记忆的耗时直方图、token 与字节计数"""
+    return Response(telemetry.render_prometheus(metrics_gauges()), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/sessions', methods=['GET'])
+def get_session_stats():
+    """会话存储的数量/字节/淘汰统计"""
+    return jsonify(session_store.stats())
 
 
 @app.route('/start_session', methods=['POST'])
@@ -66,14 +235,21 @@ def start_session():
     llm_config = {
         "base_url": base_url,
         "api_key": api_key,
-        "model_name": model_name
+        "model_name": model_name,
+        "timeout": data.get("timeout")
     }
     
-    agents = get_or_create_agents(session_id, work_dir, llm_config)
+    agents = session_store.create(session_id, work_dir, llm_config)
     agents["messages"] = []  # 重置消息历史
+    user_input = data.get("user_input", "")
+
+    # 快速路径：相同/相近问题且依赖文件未变化，直接返回缓存的回答
+    cached = answer_from_cache(agents, user_input)
+    if cached is not None:
+        session_store.save(session_id, agents)
+        return jsonify({"session_id": session_id, "context_used": "", "cached_response": cached})
     
     # 注入记忆上下文
-    user_input = data.get("user_input", "")
     relevant_memories = agents["context_agent"].find_relevant_memories(user_input)
     context_str = "\n".join([f"{k}: {v}" for k, v in relevant_memories.items()]) if relevant_memories else ""
     
@@ -86,6 +262,10 @@ def start_session():
         "role": "user",
         "content": user_input
     })
+    session_store.save(session_id, agents)
+    # 模型思考期间预热问题与记忆中提到的文件
+    if prefetcher is not None:
+        prefetcher.warm(agents["main_agent"], [user_input, context_str])
     
     return jsonify({
         "session_id": session_id,
@@ -96,13 +276,14 @@ def start_session():
 @app.route('/next_step', methods=['POST'])
 def next_step():
     """执行下一步（LLM决策或工具调用）"""
+    started = time.perf_counter()
     data = request.get_json()
     session_id = data.get("session_id", "default")
     
-    if session_id not in session_agents:
+    agents = session_store.get(session_id)
+    if agents is None:
         return jsonify({"error": "会话不存在，请先调用 /start_session"}), 400
-        
-    agents = session_agents[session_id]
+
     main_agent = agents["main_agent"]
     messages = agents["messages"]
     
@@ -110,13 +291,19 @@ def next_step():
         # 获取工具定义
         tools = main_agent.get_tool_definitions()
         
-        # 调用大模型
-        response = main_agent.llm_client.chat_completion(messages, tools=tools)
+        # 按 token 预算压缩历史后调用大模型
+        payload, history_stats = main_agent.prepare_messages(messages)
+        llm_started = time.perf_counter()
+        response = main_agent.llm_client.chat_completion(payload, tools=tools)
+        llm_ms = elapsed_ms(llm_started)
         
         # 检查是否包含工具调用
         if main_agent.llm_client.is_tool_call(response):
             tool_calls = main_agent.llm_client.extract_tool_calls(response)
             message = main_agent.llm_client.extract_content(response) or "正在执行工具调用..."
+            # 浏览器往返期间先在后台执行只读工具，/execute_tool 直接取用
+            if prefetcher is not None:
+                prefetcher.schedule(session_id, main_agent, tool_calls)
             
             # 保存模型决策消息
             model_message = {
@@ -125,12 +312,15 @@ def next_step():
                 "tool_calls": tool_calls
             }
             messages.append(model_message)
+            session_store.save(session_id, agents)
             
             # 返回工具调用详情（供前端显示）
             return jsonify({
                 "type": "tool_call",
                 "message": message,
                 "tool_calls": tool_calls,
+                "history": history_stats,
+                "timing": {"llm_ms": llm_ms, "server_ms": elapsed_ms(started)},
                 "session_id": session_id
             })
         else:
@@ -140,21 +330,16 @@ def next_step():
                 "role": "assistant",
                 "content": final_content
             })
+            session_store.save(session_id, agents)
             
             # 生成记忆
-            if len(messages) >= 2:
-                user_msg = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
-                summary = agents["memory_agent"].summarize_conversation([
-                    {"role": "user", "content": user_msg},
-                    {"role": "assistant", "content": final_content}
-                ])
-                if summary:
-                    key = f"Q: {user_msg[:50]}..."
-                    agents["memory_agent"].add_memory_entry(key, summary)
+            remember_final_response(agents, final_content)
             
             return jsonify({
                 "type": "final_response",
                 "response": final_content,
+                "history": history_stats,
+                "timing": {"llm_ms": llm_ms, "server_ms": elapsed_ms(started)},
                 "session_id": session_id
             })
             
@@ -165,14 +350,15 @@ def next_step():
 @app.route('/execute_tool', methods=['POST'])
 def execute_tool():
     """执行具体工具调用"""
+    started = time.perf_counter()
     data = request.get_json()
     session_id = data.get("session_id")
     tool_call = data.get("tool_call")  # 单个工具调用对象
     
-    if session_id not in session_agents:
+    agents = session_store.get(session_id)
+    if agents is None:
         return jsonify({"error": "会话不存在"}), 400
-        
-    agents = session_agents[session_id]
+
     main_agent = agents["main_agent"]
     messages = agents["messages"]
     
@@ -180,32 +366,30 @@ def execute_tool():
         # 执行工具
         func_name = tool_call["function"]["name"]
         args = json.loads(tool_call["function"]["arguments"])
-        result = main_agent.execute_tool_call(func_name, args)
+        tool_started = time.perf_counter()
+        result, = take_prefetched(session_id, main_agent, [tool_call])
+        prefetched = result is not None
+        if result is None:
+            result = main_agent.execute_tool_call(func_name, args)
+        tool_ms = elapsed_ms(tool_started)
         
         # 构建工具结果消息
-        tool_result_message = {
-            "role": "tool",
-            "tool_call_id": tool_call["id"],
-            "name": func_name,
-            "content": json.dumps(result, ensure_ascii=False)
-        }
-        messages.append(tool_result_message)
+        messages.append(main_agent.make_tool_message(tool_call, result))
+        session_store.save(session_id, agents)
         
         return jsonify({
             "type": "tool_result",
             "result": result,
             "tool_name": func_name,
+            "prefetched": prefetched,
+            "timing": {"tool_ms": tool_ms, "server_ms": elapsed_ms(started)},
             "session_id": session_id
         })
         
     except Exception as e:
         error_result = {"error": str(e)}
-        messages.append({
-            "role": "tool",
-            "tool_call_id": tool_call["id"],
-            "name": tool_call["function"]["name"],
-            "content": json.dumps(error_result, ensure_ascii=False)
-        })
+        messages.append(main_agent.make_tool_message(tool_call, error_result))
+        session_store.save(session_id, agents)
         return jsonify({
             "type": "tool_result",
             "result": error_result,
@@ -214,5 +398,107 @@ def execute_tool():
         }), 500
 
 
+@app.route('/execute_tools', methods=['POST'])
+def execute_tools():
+    """批量执行一轮中的全部工具调用（并行执行，结果按原顺序写入消息历史）"""
+    started = time.perf_counter()
+    data = request.get_json()
+    session_id = data.get("session_id")
+    tool_calls = data.get("tool_calls") or []
+
+    agents = session_store.get(session_id)
+    if agents is None:
+        return jsonify({"error": "会话不存在"}), 400
+
+    main_agent = agents["main_agent"]
+    messages = agents["messages"]
+
+    tool_started = time.perf_counter()
+    taken = take_prefetched(session_id, main_agent, tool_calls)
+    missing = [call for call, result in zip(tool_calls, taken) if result is None]
+    results = fill_results(taken, main_agent.run_tool_calls(missing) if missing else [])
+    tool_ms = elapsed_ms(tool_started)
+    for call, result in zip(tool_calls, results):
+        messages.append(main_agent.make_tool_message(call, result))
+    session_store.save(session_id, agents)
+
+    return jsonify({
+        "type": "tool_results",
+        "results": [
+            {"tool_call_id": call["id"], "tool_name": call["function"]["name"], "result": result}
+            for call, result in zip(tool_calls, results)
+        ],
+        "prefetched": len(tool_calls) - len(missing),
+        "timing": {"tool_ms": tool_ms, "server_ms": elapsed_ms(started)},
+        "session_id": session_id
+    })
+
+
+@app.route('/stream_chat', methods=['POST'])
+def stream_chat():
+    """
+    以 SSE 推送完整的工具调用循环：
+    token（文本增量）/ tool_call（模型决策）/ tool_result（工具结果）/ final_response / error
+    """
+    data = request.get_json()
+    session_id = data.get("session_id", "default")
+
+    agents = session_store.get(session_id)
+    if agents is None:
+        return jsonify({"error": "会话不存在，请先调用 /start_session"}), 400
+
+    main_agent = agents["main_agent"]
+    llm_client = main_agent.llm_client
+    messages = agents["messages"]
+
+    def generate():
+        # 生成器在请求结束（teardown）之后才被迭代，需重新绑定追踪上下文；下一个请求开始时会覆盖
+        bind_trace(session_id)
+        try:
+            tools = main_agent.get_tool_definitions()
+            while True:
+                response = None
+                payload, history_stats = main_agent.prepare_messages(messages)
+                if history_stats["tokens_saved"]:
+                    yield sse_event("history", history_stats)
+                for event in llm_client.stream_chat_completion(payload, tools=tools):
+                    if event["type"] == "token":
+                        yield sse_event("token", {"content": event["content"]})
+                    else:
+                        response = event["response"]
+
+                if not llm_client.is_tool_call(response):
+                    final_content = llm_client.extract_content(response)
+                    messages.append({"role": "assistant", "content": final_content})
+                    remember_final_response(agents, final_content)
+                    yield sse_event("final_response", {"response": final_content, "session_id": session_id})
+                    return
+
+                tool_calls = llm_client.extract_tool_calls(response)
+                message = llm_client.extract_content(response) or "正在执行工具调用..."
+                messages.append({"role": "assistant", "content": message, "tool_calls": tool_calls})
+                yield sse_event("tool_call", {"message": message, "tool_calls": tool_calls})
+
+                # 每个工具完成即推送；消息历史仍按 tool_call 原顺序追加
+                results: List[Optional[Dict]] = [None] * len(tool_calls)
+                for index, result in main_agent.iter_tool_calls(tool_calls):
+                    results[index] = result
+                    call = tool_calls[index]
+                    yield sse_event("tool_result", {"tool_name": call["function"]["name"],
+                                                    "tool_call_id": call.get("id"), "result": result})
+                for call, result in zip(tool_calls, results):
+                    messages.append(main_agent.make_tool_message(call, result))
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            # 客户端中途断开时也保存已产生的消息
+            session_store.save(session_id, agents)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # 关闭反向代理缓冲，保证逐条推送
+    })
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file